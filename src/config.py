@@ -9,6 +9,13 @@ load_dotenv()
 # --- Project info ---
 PROJECT_NAME = os.getenv("PROJECT_NAME", "project")
 LS_PORT = int(os.getenv("LS_PORT", 8080))
+# Host and API key (Account & Settings > Access Token) of Label Studio, used by the `ls_client` module
+LS_HOST = os.getenv("LS_HOST", "localhost")
+LS_API_KEY = os.getenv("LS_API_KEY", "")
+
+# --- Device ---
+# Forces the PyTorch device (e.g. "cpu", "cuda", "cuda:1") instead of detecting it (see `which_device`)
+DEVICE = os.getenv("TIAMAT_DEVICE") or None
 
 # --- Folder paths ---
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
@@ -35,6 +42,7 @@ def show_config():
     print(f"IMG_DATASET_FOLDER: {IMG_DATASET_FOLDER}")
     print(f"MODEL_FOLDER: {MODEL_FOLDER}")
     print(f"PRETRAINED_MODEL: {PRETRAINED_MODEL}")
+    print(f"DEVICE: {DEVICE or 'auto'}")
 
 
 if __name__ == "__main__":
@@ -1,22 +1,94 @@
 """
 Initialization for the TiamaT modules package.
 Provides utility functions for label handling, file manipulation, coordinate transformations, and device management.
+
+The modules are imported lazily: `from modules import get_labels` only imports `class_names_functions`, and the
+heavy libraries (PyTorch, Ultralytics, OpenCV, scikit-learn, Matplotlib) are only imported by the functions that
+use them. Importing the package itself is therefore immediate, whatever stage is run.
 """
 
-from .class_names_functions import get_labels, get_class_name, get_class_code
-from .corners_functions import get_corners,from_corners_to_relative
-from .folders_path import get_img_folder_training, img_folder_inference, get_ground_truth_folder_training, get_corrections_folder_inference, get_results_folder, get_data_folder, get_correctedLabels_folder
-from .transform_coordinates_functions import from_relative_coordonates_to_absolute, from_ls_to_yolo
-from .manipulate_files import open_json_file, change_id, save_json_file, get_files, exclude_training_images, load_data_from_files, find_image_path
-from .device_function import which_device
-
-
-__all__ = [
-    'get_labels', 'get_class_name', 'get_class_code',
-    'get_corners','from_corners_to_relative',
-    'get_img_folder_training', 'img_folder_inference', 'get_ground_truth_folder_training', 
-    'get_corrections_folder_inference', 'get_results_folder', 'get_data_folder', 'get_correctedLabels_folder',
-    'from_relative_coordonates_to_absolute', 'from_ls_to_yolo',
-    'open_json_file', 'change_id', 'save_json_file', 'get_files', 'exclude_training_images', 
-    'load_data_from_files', 'find_image_path', 'which_device'
-    ]
\ No newline at end of file
+import importlib
+import os
+import sys
+
+
+# The modules import each other by name, like the notebooks which add this folder to the path. Each module is
+# imported under its own name only, so that the package and the notebooks share the same module objects.
+_MODULES_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _MODULES_FOLDER not in sys.path:
+    sys.path.append(_MODULES_FOLDER)
+
+# Public functions of each module
+_EXPORTS = {
+    'class_names_functions': ['LabelMap', 'load_label_map', 'get_labels', 'get_class_name', 'get_class_code'],
+    'corners_functions': ['get_corners', 'from_corners_to_relative'],
+    'folders_path': ['get_img_folder_training', 'get_img_folder_inference', 'get_ground_truth_folder_training',
+                     'get_corrections_folder_inference', 'get_results_folder', 'get_data_folder',
+                     'get_correctedLabels_folder', 'get_image_metadata_file', 'get_ground_truth_manifest_file',
+                     'get_ground_truth_journal_file', 'get_image_cache_folder', 'get_image_hash_file',
+                     'get_blob_store_folder', 'get_training_queue_file', 'get_ls_sync_file'],
+    'transform_coordinates_functions': ['from_relative_coordinates_to_absolute', 'from_ls_to_yolo'],
+    'manipulate_files': ['open_json_file', 'change_id', 'save_json_file', 'get_files', 'exclude_training_images',
+                         'load_data_from_files', 'find_image_path'],
+    'device_function': ['which_device'],
+    'image_metadata': ['refresh_image_metadata', 'get_image_metadata', 'get_image_size', 'metadata_to_rows',
+                       'write_metadata_csv'],
+    'evaluation_functions': ['read_yolo_boxes', 'iou_matrix', 'match_boxes', 'evaluate_image', 'iter_evaluation_rows',
+                             'evaluate_images', 'get_store_pairs', 'evaluate_stores'],
+    'annotation_store': ['get_annotation_store_folder', 'write_annotation_store', 'import_yolo_labels',
+                         'load_annotation_store', 'open_annotation_store', 'get_image_boxes', 'boxes_per_image',
+                         'boxes_per_class', 'export_yolo_labels'],
+    'augmentation_functions': ['random_perspective_matrix', 'transform_boxes', 'get_variant_name', 'augment_image',
+                               'augment_dataset'],
+    'dataset_split': ['read_split_file', 'write_image_list', 'link_split', 'prepare_split', 'restore_split_folder'],
+    'ls_conversion': ['parse_ls_annotation', 'load_conversion_manifest', 'convert_ls_annotations'],
+    'ls_export': ['get_local_files_prefix', 'to_local_files_url', 'write_ls_tasks', 'read_ls_tasks'],
+    'ls_client': ['LabelStudioClient', 'iter_batches', 'push_tasks', 'iter_updated_tasks', 'pull_annotations'],
+    'ls_mock_server': ['LabelStudioMockServer'],
+    'training_queue': ['expand_grid', 'get_job_name', 'hash_dataset_split', 'estimate_job_resources',
+                       'get_available_resources', 'submit_training_jobs', 'requeue_training_jobs', 'list_training_jobs',
+                       'write_run_registry', 'run_training_queue'],
+    'results_writer': ['PREDICTION_COLUMNS', 'EVALUATION_COLUMNS', 'ResultsWriter', 'read_results'],
+    'blob_store': ['get_blob_path', 'link_files', 'collect_garbage'],
+    'near_duplicates': ['compute_phash', 'hamming_distance', 'BKTree', 'refresh_image_hashes', 'find_near_duplicates',
+                        'group_near_duplicates', 'copy_duplicate_labels'],
+    'training_cache': ['get_cache_view_folder', 'get_cache_geometry', 'rescale_label_lines', 'cache_image',
+                       'build_training_cache'],
+    'ground_truth_manifest': ['load_ground_truth_manifest', 'allocate_ground_truth_ids', 'recover_ground_truth_move',
+                              'move_corrections_to_ground_truth'],
+    'file_index': ['FileIndex', 'scan_folder', 'index_folder', 'get_folder_index', 'join_indexes'],
+    'cpu_inference': ['get_export_folder', 'export_cpu_model', 'load_exported_model', 'shard_images',
+                      'predict_images_cpu'],
+    'evaluation_metrics': ['load_match_results', 'average_precision', 'compute_metrics', 'write_metrics_txt',
+                           'write_metrics_csv', 'plot_metrics_table', 'plot_pr_curves', 'plot_confusion_matrix',
+                           'write_evaluation_reports'],
+    'instrumentation': ['enable_instrumentation', 'is_instrumentation_enabled', 'reset_instrumentation', 'stage',
+                        'span', 'timed', 'count', 'get_summary', 'format_summary', 'write_trace', 'get_logger',
+                        'configure_logging'],
+    'dataset_statistics': ['scan_dataset', 'compute_geometry_histograms', 'write_dataset_statistics'],
+    'tiled_inference': ['get_tile_grid', 'open_page', 'merge_tile_detections', 'format_page_predictions',
+                        'predict_tiled'],
+    'synthetic_project': ['StubYOLOModel', 'generate_synthetic_project'],
+    'stage_manifest': ['hash_file', 'list_files', 'snapshot_files', 'diff_snapshots', 'load_pipeline_manifest',
+                       'save_pipeline_manifest'],
+    'inference_functions': ['list_images', 'load_yolo_model', 'read_images', 'format_yolo_predictions',
+                            'predict_images_in_batches'],
+    }
+
+_ORIGINS = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = list(_ORIGINS)
+
+
+def __getattr__(name):
+    module = _ORIGINS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module), name)
+    # Cached, so that the next lookups do not go through __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,343 @@
+"""
+The following module provides a compact columnar store for YOLO annotations. All the boxes of a dataset,
+a prediction run or a set of corrections are kept in a single folder with one NumPy file per column,
+instead of one text file per image:
+
+    <labels>.boxes/
+    ├── images.json       # image names (stems), the position in the list is the image id
+    ├── offsets.npy       # int64, boxes of image i are rows offsets[i]:offsets[i+1]
+    ├── class_id.npy      # int32
+    ├── xywh.npy          # float32, relative (x_center, y_center, width, height)
+    └── confidence.npy    # float32 (0 when the labels have no confidence column)
+
+The columns are memory-mapped when the store is opened, so slicing the boxes of one image or running
+a vectorized operation on the whole dataset does not parse any text. The store is imported from, and
+can be exported back to, the YOLO `labels/` layout used by Ultralytics for training.
+
+Functions included:
+1. get_annotation_store_folder: Returns the path of the store associated with a YOLO labels folder.
+2. write_annotation_store: Writes a store from box arrays.
+3. import_yolo_labels: Builds a store from a folder of YOLO label files.
+4. load_annotation_store: Opens a store with memory-mapped columns.
+5. open_annotation_store: Opens the store of a labels folder, (re)building it if the label files changed.
+6. get_image_boxes: Returns the boxes of one image.
+7. boxes_per_image: Returns the number of boxes of every image.
+8. boxes_per_class: Returns the number of boxes of every class.
+9. export_yolo_labels: Writes the store back to YOLO label files.
+"""
+
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+
+def get_annotation_store_folder(labels_folder:str) -> str:
+    """
+    Returns the path of the annotation store associated with a folder of YOLO label files:
+    the store of 'labels/' is the sibling folder 'labels.boxes/'.
+
+    :param labels_folder:
+        - Type: str
+        - Description: Path to a folder containing YOLO label files.
+
+    :return:
+        - Type: str
+        - Description: Path to the annotation store folder.
+    """
+    labels_folder = Path(labels_folder)
+    return str(labels_folder.with_name(f"{labels_folder.name}.boxes"))
+
+
+def write_annotation_store(store_folder:str, images:list, image_ids, class_ids, xywh, confidences) -> str:
+    """
+    Writes an annotation store from box arrays. Boxes are sorted by image id, so the boxes of an image are contiguous.
+
+    :param store_folder:
+        - Type: str
+        - Description: Path to the store folder (created or replaced).
+
+    :param images:
+        - Type: list of str
+        - Description: Image names (stems). The image id of a box is its index in this list.
+
+    :param image_ids:
+        - Type: array-like of int, shape (N,)
+        - Description: Image id of each box.
+
+    :param class_ids:
+        - Type: array-like of int, shape (N,)
+        - Description: Class id of each box.
+
+    :param xywh:
+        - Type: array-like of float, shape (N, 4)
+        - Description: Relative (x_center, y_center, width, height) of each box.
+
+    :param confidences:
+        - Type: array-like of float, shape (N,)
+        - Description: Confidence of each box (0 for annotations).
+
+    :return:
+        - Type: str
+        - Description: Path to the store folder.
+    """
+    store_folder = Path(store_folder)
+    # Written in a temporary folder, which replaces the store at the end: the files of the previous store may be
+    # memory-mapped by a store opened before (see `load_annotation_store`), they must not be rewritten in place
+    tmp_folder = store_folder.with_name(store_folder.name + '.tmp')
+    shutil.rmtree(tmp_folder, ignore_errors=True)
+    tmp_folder.mkdir(parents=True)
+
+    image_ids = np.asarray(image_ids, dtype=np.int64).reshape(-1)
+    order = np.argsort(image_ids, kind='stable')
+    offsets = np.zeros(len(images) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(image_ids, minlength=len(images)))
+
+    np.save(tmp_folder / 'offsets.npy', offsets)
+    np.save(tmp_folder / 'class_id.npy', np.asarray(class_ids, dtype=np.int32).reshape(-1)[order])
+    np.save(tmp_folder / 'xywh.npy', np.asarray(xywh, dtype=np.float32).reshape(-1, 4)[order])
+    np.save(tmp_folder / 'confidence.npy', np.asarray(confidences, dtype=np.float32).reshape(-1)[order])
+    with open(tmp_folder / 'images.json', 'w', encoding='utf-8') as f:
+        json.dump(list(images), f)
+
+    # The files of the previous store are unlinked, not truncated: the stores already opened keep reading them
+    if store_folder.exists():
+        old_folder = store_folder.with_name(store_folder.name + '.old')
+        shutil.rmtree(old_folder, ignore_errors=True)
+        os.replace(store_folder, old_folder)
+        os.replace(tmp_folder, store_folder)
+        shutil.rmtree(old_folder, ignore_errors=True)
+    else:
+        os.replace(tmp_folder, store_folder)
+
+    return str(store_folder)
+
+
+def _label_files(labels_folder:Path) -> list:
+    # A missing folder (e.g. the corrected labels before the first correction) has no label files
+    if not labels_folder.is_dir():
+        return []
+    return sorted((entry for entry in os.scandir(labels_folder)
+                   if entry.is_file() and entry.name.endswith('.txt') and not entry.name.startswith('.')),
+                  key=lambda entry: entry.name)
+
+
+def import_yolo_labels(labels_folder:str, store_folder:str=None) -> str:
+    """
+    Builds an annotation store from a folder of YOLO label files ('<image_name>.txt', one box per line:
+    `class_id x_center y_center width height [confidence]`). Each file is read once.
+    A missing labels folder gives an empty store.
+
+    :param labels_folder:
+        - Type: str
+        - Description: Path to the folder containing the YOLO label files.
+
+    :param store_folder:
+        - Type: str
+        - Description: Path to the store folder. Defaults to `get_annotation_store_folder(labels_folder)`.
+
+    :return:
+        - Type: str
+        - Description: Path to the store folder.
+    """
+    labels_folder = Path(labels_folder)
+    store_folder = store_folder or get_annotation_store_folder(labels_folder)
+
+    images, rows, image_ids = [], [], []
+    for image_id, entry in enumerate(_label_files(labels_folder)):
+        images.append(entry.name[:-len('.txt')])
+        with open(entry.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                values = line.replace(',', ' ').split()
+                if not values:
+                    continue
+                rows.append(([float(value) for value in values] + [0.0] * 6)[:6])
+                image_ids.append(image_id)
+
+    boxes = np.array(rows, dtype=np.float64).reshape(-1, 6)
+    return write_annotation_store(store_folder, images, image_ids, boxes[:, 0], boxes[:, 1:5], boxes[:, 5])
+
+
+def load_annotation_store(store_folder:str) -> dict:
+    """
+    Opens an annotation store. The box columns are memory-mapped (read-only), nothing is parsed.
+
+    :param store_folder:
+        - Type: str
+        - Description: Path to the store folder.
+
+    :return:
+        - Type: dict
+        - Description: A dictionary with the keys:
+                       'images' (list of image names), 'image_index' (dict image name -> image id),
+                       'offsets', 'class_id', 'xywh' and 'confidence' (NumPy arrays).
+    """
+    store_folder = Path(store_folder)
+    if not (store_folder / 'images.json').exists():
+        raise FileNotFoundError(f"No annotation store found in {store_folder}")
+
+    with open(store_folder / 'images.json', 'r', encoding='utf-8') as f:
+        images = json.load(f)
+
+    store = {'images': images, 'image_index': {name: index for index, name in enumerate(images)}}
+    for column in ('offsets', 'class_id', 'xywh', 'confidence'):
+        store[column] = np.load(store_folder / f"{column}.npy", mmap_mode='r')
+
+    return store
+
+
+def open_annotation_store(labels_folder:str, rebuild:bool=False) -> dict:
+    """
+    Opens the annotation store of a folder of YOLO label files. The store is (re)built from the label files
+    if it does not exist, if `rebuild` is True, or if a label file was added, removed or modified since it was built.
+    A missing labels folder is opened as an empty store.
+
+    :param labels_folder:
+        - Type: str
+        - Description: Path to the folder containing the YOLO label files.
+
+    :param rebuild:
+        - Type: bool
+        - Description: If True, the store is always rebuilt.
+
+    :return:
+        - Type: dict
+        - Description: The opened store (see `load_annotation_store`).
+    """
+    labels_folder = Path(labels_folder)
+    store_folder = Path(get_annotation_store_folder(labels_folder))
+    stamp_file = store_folder / 'images.json'
+
+    if not rebuild and stamp_file.exists():
+        built = stamp_file.stat().st_mtime_ns
+        label_files = _label_files(labels_folder)
+        changed = ((labels_folder.is_dir() and labels_folder.stat().st_mtime_ns > built)
+                   or any(entry.stat().st_mtime_ns > built for entry in label_files))
+        if not changed:
+            store = load_annotation_store(store_folder)
+            if len(store['images']) == len(label_files):
+                return store
+
+    import_yolo_labels(labels_folder, store_folder)
+    return load_annotation_store(store_folder)
+
+
+def get_image_boxes(store:dict, image_name:str) -> np.ndarray:
+    """
+    Returns the boxes of one image.
+
+    :param store:
+        - Type: dict
+        - Description: An opened annotation store.
+
+    :param image_name:
+        - Type: str
+        - Description: Name of the image (without extension).
+
+    :return:
+        - Type: numpy.ndarray
+        - Description: Array of shape (N, 6) with columns class_id, x_center, y_center, width, height, confidence.
+                       Empty if the image is not in the store.
+    """
+    image_id = store['image_index'].get(image_name)
+    if image_id is None:
+        return np.empty((0, 6))
+
+    start, end = store['offsets'][image_id], store['offsets'][image_id + 1]
+    boxes = np.empty((end - start, 6))
+    boxes[:, 0] = store['class_id'][start:end]
+    # Rounding drops the float32 noise, so the values print like in the original label files
+    boxes[:, 1:5] = np.round(store['xywh'][start:end].astype(np.float64), 6)
+    boxes[:, 5] = np.round(store['confidence'][start:end].astype(np.float64), 6)
+    return boxes
+
+
+def boxes_per_image(store:dict) -> dict:
+    """
+    Returns the number of boxes of every image of the store.
+
+    :param store:
+        - Type: dict
+        - Description: An opened annotation store.
+
+    :return:
+        - Type: dict
+        - Description: Dictionary mapping image names to their number of boxes.
+    """
+    counts = np.diff(store['offsets'])
+    return dict(zip(store['images'], counts.tolist()))
+
+
+def boxes_per_class(store:dict, image_names:set=None) -> dict:
+    """
+    Returns the number of boxes of every class of the store.
+
+    :param store:
+        - Type: dict
+        - Description: An opened annotation store.
+
+    :param image_names:
+        - Type: set of str
+        - Description: If given, only the boxes of these images are counted.
+
+    :return:
+        - Type: dict
+        - Description: Dictionary mapping class IDs (as strings, like in 'labels.txt') to their number of boxes.
+    """
+    class_id = store['class_id']
+    if image_names is not None:
+        selected = np.array([name in image_names for name in store['images']], dtype=bool)
+        class_id = class_id[np.repeat(selected, np.diff(store['offsets']))]
+
+    class_ids, counts = np.unique(class_id, return_counts=True)
+    return {str(class_id): int(count) for class_id, count in zip(class_ids.tolist(), counts.tolist())}
+
+
+def export_yolo_labels(store:dict, labels_folder:str, with_confidence:bool=False, image_names:set=None) -> int:
+    """
+    Writes the boxes of a store as YOLO label files ('<image_name>.txt'), e.g. to train with Ultralytics.
+
+    :param store:
+        - Type: dict
+        - Description: An opened annotation store.
+
+    :param labels_folder:
+        - Type: str
+        - Description: Destination folder of the label files.
+
+    :param with_confidence:
+        - Type: bool
+        - Description: If True, the confidence is written as a sixth column (prediction format).
+
+    :param image_names:
+        - Type: set of str
+        - Description: If given, only the label files of these images are written.
+
+    :return:
+        - Type: int
+        - Description: The number of label files written.
+    """
+    labels_folder = Path(labels_folder)
+    labels_folder.mkdir(parents=True, exist_ok=True)
+
+    offsets = store['offsets']
+    written = 0
+    for image_id, image_name in enumerate(store['images']):
+        if image_names is not None and image_name not in image_names:
+            continue
+        start, end = offsets[image_id], offsets[image_id + 1]
+        classes = store['class_id'][start:end].tolist()
+        xywh = store['xywh'][start:end].tolist()
+        confidences = store['confidence'][start:end].tolist()
+
+        with open(labels_folder / f"{image_name}.txt", 'w') as label_file:
+            for class_id, (x, y, w, h), confidence in zip(classes, xywh, confidences):
+                line = f"{class_id} {x:.6f} {y:.6f} {w:.6f} {h:.6f}"
+                if with_confidence:
+                    line += f" {confidence:.4f}"
+                label_file.write(line + "\n")
+        written += 1
+
+    return written
@@ -0,0 +1,259 @@
+"""
+The following module provides functions for extending a YOLO training dataset with random perspective
+transformations. Each image is decoded once and its variants are warped in memory; all the boxes of an
+image are transformed with a single array operation; and the images are spread across a process pool.
+Every image gets its own random generator, seeded from a global seed and the image name, so a run gives
+the same variants whatever the number of workers or the order of the images.
+
+The variants are saved next to the original files: '<name>_PT' for the first one, then '<name>_2_PT',
+'<name>_3_PT'... so every augmented image and label file name ends with '_PT'.
+
+Functions included:
+1. random_perspective_matrix: Draws a random perspective transformation for an image size.
+2. transform_boxes: Applies a perspective transformation to an array of relative YOLO boxes.
+3. get_variant_name: Returns the name of the n-th variant of an image.
+4. augment_image: Generates the variants of one image and of its label file.
+5. augment_dataset: Generates the variants of all the annotated images of a folder, across a process pool.
+"""
+
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from file_index import IMG_EXTS
+from instrumentation import count, get_logger, span
+
+
+def random_perspective_matrix(img_width:int, img_height:int, rng:np.random.Generator) -> tuple:
+    """
+    Draws a random perspective transformation that resizes the image to 30–80% of its width and height,
+    to simulate a different viewing angle.
+
+    :param img_width:
+        - Type: int
+        - Description: Width of the original image in pixels.
+
+    :param img_height:
+        - Type: int
+        - Description: Height of the original image in pixels.
+
+    :param rng:
+        - Type: numpy.random.Generator
+        - Description: The random generator of the image.
+
+    :return:
+        - Type: tuple (numpy.ndarray, int, int)
+        - Description: The 3x3 transformation matrix, and the width and height of the transformed image.
+    """
+    import cv2
+
+    new_width = int(rng.integers(int(img_width * 0.3), int(img_width * 0.8), endpoint=True))
+    new_height = int(rng.integers(int(img_height * 0.3), int(img_height * 0.8), endpoint=True))
+
+    pts1 = np.float32([[0, 0], [img_width, 0], [img_width, img_height], [0, img_height]])
+    pts2 = np.float32([[0, 0], [new_width, 0], [new_width, new_height], [0, new_height]])
+
+    return cv2.getPerspectiveTransform(pts1, pts2), new_width, new_height
+
+
+def transform_boxes(boxes:np.ndarray, M:np.ndarray, img_size:tuple, transformed_size:tuple) -> np.ndarray:
+    """
+    Applies a perspective transformation to all the boxes of an image at once.
+
+    The corners of each box are computed in pixels (like `get_corners`), projected with the matrix, and the new
+    box is the rectangle enclosing the four projected corners, in coordinates relative to the transformed image.
+
+    :param boxes:
+        - Type: numpy.ndarray
+        - Description: Array of shape (N, 4) with relative (x_center, y_center, width, height) coordinates.
+
+    :param M:
+        - Type: numpy.ndarray
+        - Description: The 3x3 perspective transformation matrix.
+
+    :param img_size:
+        - Type: tuple of int
+        - Description: (width, height) of the original image in pixels.
+
+    :param transformed_size:
+        - Type: tuple of int
+        - Description: (width, height) of the transformed image in pixels.
+
+    :return:
+        - Type: numpy.ndarray
+        - Description: Array of shape (N, 4) with the relative (x_center, y_center, width, height) coordinates
+                       of the boxes in the transformed image.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    img_width, img_height = img_size
+    new_width, new_height = transformed_size
+
+    # Absolute corners, truncated to whole pixels like in get_corners
+    upper_left_x = np.trunc(boxes[:, 0] * img_width - boxes[:, 2] * img_width / 2)
+    upper_left_y = np.trunc(boxes[:, 1] * img_height - boxes[:, 3] * img_height / 2)
+    bottom_right_x = upper_left_x + np.trunc(boxes[:, 2] * img_width)
+    bottom_right_y = upper_left_y + np.trunc(boxes[:, 3] * img_height)
+
+    # (N, 4, 3) homogeneous coordinates of the corners: upper left, upper right, bottom right, bottom left
+    corners = np.stack([
+        np.stack([upper_left_x, upper_left_y], axis=1),
+        np.stack([bottom_right_x, upper_left_y], axis=1),
+        np.stack([bottom_right_x, bottom_right_y], axis=1),
+        np.stack([upper_left_x, bottom_right_y], axis=1)
+    ], axis=1)
+    corners = np.concatenate([corners, np.ones(corners.shape[:2] + (1,))], axis=2)
+
+    projected = corners @ np.asarray(M, dtype=np.float64).T
+    projected = projected[..., :2] / projected[..., 2:]
+
+    new_min = projected.min(axis=1)
+    new_max = projected.max(axis=1)
+    scale = np.array([new_width, new_height], dtype=np.float64)
+
+    centers = (new_min + new_max) / 2 / scale
+    sizes = (new_max - new_min) / scale
+
+    return np.concatenate([centers, sizes], axis=1)
+
+
+def get_variant_name(img_name:str, variant:int) -> str:
+    """
+    Returns the name (without extension) of a variant of an image: '<name>_PT' for the first variant (variant 0),
+    '<name>_<variant + 1>_PT' for the next ones.
+    """
+    return f"{img_name}_PT" if variant == 0 else f"{img_name}_{variant + 1}_PT"
+
+
+def _image_seed(img_name:str, seed:int) -> np.random.SeedSequence:
+    # crc32 is stable across processes and runs, unlike hash()
+    return np.random.SeedSequence([seed, zlib.crc32(img_name.encode('utf-8'))])
+
+
+def augment_image(img_file:str, ann_file:str, n_variants:int=1, seed:int=0) -> int:
+    """
+    Generates `n_variants` randomly transformed versions of an image and of its YOLO label file.
+    The image is decoded once, and the variants are written next to the original files.
+
+    :param img_file:
+        - Type: str
+        - Description: Absolute path to the image file.
+
+    :param ann_file:
+        - Type: str
+        - Description: Absolute path to the label file of the image (`class_id x_center y_center width height`).
+
+    :param n_variants:
+        - Type: int
+        - Description: Number of transformed versions to generate.
+
+    :param seed:
+        - Type: int
+        - Description: Global seed. The random generator of the image is seeded from it and from the image name.
+
+    :return:
+        - Type: int
+        - Description: The number of variants written.
+    """
+    import cv2
+
+    img_path = Path(img_file)
+    img = cv2.imread(str(img_path))
+    if img is None:
+        raise OSError(f"Could not read image {img_path}")
+    img_height, img_width = img.shape[:2]
+
+    labels = []
+    rows = []
+    with open(ann_file, 'r') as annotations:
+        for line in annotations:
+            values = line.split()
+            if not values:
+                continue  # skip empty lines
+            labels.append(int(float(values[0])))
+            rows.append([float(value) for value in values[1:5]])
+    boxes = np.array(rows, dtype=np.float64).reshape(-1, 4)
+
+    rng = np.random.default_rng(_image_seed(img_path.stem, seed))
+    ann_path = Path(ann_file)
+
+    for variant in range(n_variants):
+        M, new_width, new_height = random_perspective_matrix(img_width, img_height, rng)
+
+        dst = cv2.warpPerspective(img, M, (new_width, new_height))
+        new_boxes = transform_boxes(boxes, M, (img_width, img_height), (new_width, new_height))
+
+        variant_name = get_variant_name(img_path.stem, variant)
+        cv2.imwrite(str(img_path.with_name(f"{variant_name}{img_path.suffix}")), dst)
+
+        with open(ann_path.with_name(f"{variant_name}{ann_path.suffix}"), 'w') as transformed_annotations:
+            for label, (x, y, w, h) in zip(labels, new_boxes.tolist()):
+                transformed_annotations.write(f"{label} {x:.6f} {y:.6f} {w:.6f} {h:.6f}\n")
+
+    return n_variants
+
+
+def _augment_image_args(args):
+    img_file, ann_file, n_variants, seed = args
+    try:
+        return augment_image(img_file, ann_file, n_variants, seed)
+    except Exception as e:
+        get_logger('augmentation').warning(f"Error processing {Path(img_file).name}: {e}")
+        return 0
+
+
+def augment_dataset(img_folder:str, labels_folder:str, n_variants:int=1, seed:int=0, workers:int=None) -> int:
+    """
+    Generates `n_variants` randomly transformed versions of every annotated image of a folder (see `augment_image`).
+    Images that are already variants (names ending with '_PT') and images without a label file are skipped.
+
+    :param img_folder:
+        - Type: str
+        - Description: Path to the folder containing the images.
+
+    :param labels_folder:
+        - Type: str
+        - Description: Path to the folder containing the YOLO label files.
+
+    :param n_variants:
+        - Type: int
+        - Description: Number of transformed versions to generate per image.
+
+    :param seed:
+        - Type: int
+        - Description: Global seed, for reproducible variants.
+
+    :param workers:
+        - Type: int
+        - Description: Number of worker processes. None uses all the CPU cores, 1 runs in the current process.
+
+    :return:
+        - Type: int
+        - Description: The total number of variants written.
+    """
+    img_folder = Path(img_folder)
+    labels_folder = Path(labels_folder)
+
+    tasks = []
+    with span('list'):
+        for img_file in sorted(img_folder.iterdir()):
+            if img_file.suffix.lower() not in IMG_EXTS or img_file.stem.endswith('_PT'):
+                continue
+            ann_file = labels_folder / f"{img_file.stem}.txt"
+            if ann_file.exists():
+                tasks.append((str(img_file), str(ann_file), n_variants, seed))
+    count('images_to_augment', len(tasks))
+
+    with span('augment'):
+        if workers == 1 or len(tasks) < 2:
+            written = sum(map(_augment_image_args, tasks))
+        else:
+            workers = workers or os.cpu_count() or 1
+            chunksize = max(1, len(tasks) // (4 * workers))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                written = sum(executor.map(_augment_image_args, tasks, chunksize=chunksize))
+    count('variants_written', written)
+
+    return written
@@ -0,0 +1,311 @@
+"""
+The following module provides a content-addressed store for the project images, so that an image copied from one
+folder of the pipeline to another (ground-truth images to the training data, eval images to the new ground truth)
+is stored once on disk, whatever the number of folders it appears in.
+
+Each file content is stored once, as a read-only blob named after its SHA-256 hash ('objects/<ab>/<hash>').
+The folders of the project become views of the store: their files are hard links to the blobs (no copy, no extra
+disk space), or reflinks (copy-on-write clones, on file systems supporting them) when hard links are not possible,
+and plain copies as a last resort (e.g. across file systems).
+
+A SQLite index ('store_index.sqlite') records:
+    - the hash of each source file, with its size and modification time: a source is only hashed again when it changed;
+    - the views: the path and hash of each file placed from the store, so that an unchanged view is skipped, and the
+      blobs that no view uses anymore can be removed (`collect_garbage`).
+
+The blobs cloned into the store are read-only: a view cannot be modified in place by mistake (which would modify all
+the views of the same content). A source file adopted by the store (`adopt_sources`) becomes its blob as it is, with
+its permissions unchanged: the user's files are never made read-only. In both cases, edit an image by writing a new
+file with the same name, which does not affect the store.
+
+Functions included:
+1. get_blob_path: Returns the path of the blob of a hash.
+2. link_files: Places files in their destination folders as views of the store.
+3. collect_garbage: Forgets the views that were removed or replaced, and removes the blobs no view uses anymore.
+"""
+
+import os
+import shutil
+import sqlite3
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from instrumentation import count, get_logger, span
+from stage_manifest import hash_file
+
+
+logger = get_logger('blob_store')
+
+# ioctl of Linux cloning a file (copy-on-write) on btrfs, XFS...
+FICLONE = 0x40049409
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path     TEXT PRIMARY KEY,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest   TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS views (
+    path   TEXT PRIMARY KEY,
+    digest TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS views_by_digest ON views (digest);
+"""
+
+
+def _connect(store_folder:Path) -> sqlite3.Connection:
+    store_folder.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(str(store_folder / 'store_index.sqlite'))
+    connection.row_factory = sqlite3.Row
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def get_blob_path(store_folder:str, digest:str) -> Path:
+    """
+    Returns the path of the blob of a SHA-256 hash: '<store_folder>/objects/<first 2 characters>/<hash>'.
+    """
+    return Path(store_folder) / 'objects' / digest[:2] / digest
+
+
+def _reflink(source:Path, destination:Path) -> None:
+    import fcntl
+
+    try:
+        with open(source, 'rb') as src, open(destination, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        destination.unlink(missing_ok=True)
+        raise
+    shutil.copystat(source, destination)
+
+
+def _clone(source:Path, destination:Path, hard_link:bool=True) -> str:
+    """
+    Creates `destination` with the content of `source`: hard link, reflink or copy, the first that works.
+    Returns the method used.
+    """
+    if hard_link:
+        try:
+            os.link(source, destination)
+            return 'linked'
+        except OSError:
+            pass
+    try:
+        _reflink(source, destination)
+        return 'reflinked'
+    except (OSError, ImportError):
+        shutil.copy2(source, destination)
+        return 'copied'
+
+
+def _ingest(source:Path, blob:Path, adopt_source:bool) -> str:
+    blob.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = blob.with_name(f".{blob.name}.{os.getpid()}.tmp")
+    tmp_file.unlink(missing_ok=True)
+    # An adopted source becomes the blob itself (same file), the other ones are cloned
+    method = _clone(source, tmp_file, hard_link=adopt_source)
+    if method != 'linked':
+        # Only the store's own copies: the permissions of an adopted source are the user's file's
+        os.chmod(tmp_file, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    os.replace(tmp_file, blob)
+    return method
+
+
+def _place(blob:Path, destination:Path) -> str:
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = destination.with_name(f".{destination.name}.tmp")
+    tmp_file.unlink(missing_ok=True)
+    method = _clone(blob, tmp_file)
+    # Replaces the previous file of the same name, if any
+    os.replace(tmp_file, destination)
+    return method
+
+
+def _is_view(path:Path, blob:Path) -> bool:
+    try:
+        view_stat, blob_stat = os.stat(path), os.stat(blob)
+    except FileNotFoundError:
+        return False
+    if view_stat.st_ino == blob_stat.st_ino and view_stat.st_dev == blob_stat.st_dev:
+        return True
+    # Reflinks and copies are separate files: checked by size only
+    return view_stat.st_nlink == 1 and view_stat.st_size == blob_stat.st_size
+
+
+def _hash_sources(connection:sqlite3.Connection, sources:list, workers:int) -> list:
+    """
+    Returns the hash of each source file, reusing the known hash of the files whose size and modification time
+    did not change.
+    """
+    digests, to_hash = {}, []
+    for source in dict.fromkeys(sources):
+        source_stat = os.stat(source)
+        row = connection.execute("SELECT * FROM sources WHERE path = ?", (source,)).fetchone()
+        if row is not None and row['size'] == source_stat.st_size and row['mtime_ns'] == source_stat.st_mtime_ns:
+            digests[source] = row['digest']
+        else:
+            to_hash.append((source, source_stat))
+
+    count('hashes_cached', len(digests))
+    count('files_hashed', len(to_hash))
+    if to_hash:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            hashes = executor.map(hash_file, [source for source, _ in to_hash])
+            for (source, source_stat), digest in zip(to_hash, hashes):
+                digests[source] = digest
+                connection.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)",
+                                   (source, source_stat.st_size, source_stat.st_mtime_ns, digest))
+        connection.commit()
+
+    return [digests[source] for source in sources]
+
+
+def link_files(file_pairs:list, store_folder:str, adopt_sources:bool=False, workers:int=8) -> dict:
+    """
+    Places files in their destination folders as views of the store, instead of copying them: the content of each
+    source file is added to the store once (if it is not there yet), and the destination file becomes a hard link
+    to its blob (a reflink or a copy when a hard link is not possible).
+
+    Sources are hashed only when their size or modification time changed, and destinations that are already a view of
+    the right content are skipped. The hashing and the remaining copies are done on a thread pool.
+
+    :param file_pairs:
+        - Type: list of tuple
+        - Description: (source file, destination file) pairs. An existing destination file with other content
+                       is replaced.
+
+    :param store_folder:
+        - Type: str
+        - Description: Path to the store (see `folders_path.get_blob_store_folder`). The store should be on the same
+                       file system as the destination folders, so that the views are hard links.
+
+    :param adopt_sources:
+        - Type: bool
+        - Description: If True, a source file missing from the store is added to it as a hard link (no copy), so the
+                       source file becomes a view of the store too (its permissions are not changed). If False, it is
+                       cloned into the store as a read-only blob. The source file is left untouched in both cases.
+                       Default is False.
+
+    :param workers:
+        - Type: int
+        - Description: Number of threads used to hash the sources and to place the files.
+
+    :return:
+        - Type: dict
+        - Description: {'files': number of pairs, 'unchanged': destinations already up to date,
+                       'stored': contents added to the store, 'linked', 'reflinked', 'copied': number of destinations
+                       placed with each method, 'bytes_copied': bytes physically copied}.
+    """
+    store_folder = Path(store_folder)
+    file_pairs = [(str(Path(source).resolve()), Path(destination).resolve()) for source, destination in file_pairs]
+    stats = {'files': len(file_pairs), 'unchanged': 0, 'stored': 0, 'linked': 0, 'reflinked': 0, 'copied': 0,
+             'bytes_copied': 0}
+    if not file_pairs:
+        return stats
+
+    connection = _connect(store_folder)
+    try:
+        with span('hash'):
+            digests = _hash_sources(connection, [source for source, _ in file_pairs], workers)
+
+        # Each missing content is added once, even if several sources have it
+        to_store = {}
+        for (source, _), digest in zip(file_pairs, digests):
+            if digest not in to_store and not get_blob_path(store_folder, digest).exists():
+                to_store[digest] = source
+
+        if to_store:
+            with span('store'), ThreadPoolExecutor(max_workers=workers) as executor:
+                methods = executor.map(lambda item: _ingest(Path(item[1]), get_blob_path(store_folder, item[0]),
+                                                            adopt_sources), to_store.items())
+                for (digest, source), method in zip(to_store.items(), methods):
+                    if method == 'copied':
+                        stats['bytes_copied'] += os.path.getsize(source)
+                    if adopt_sources and method == 'linked':
+                        connection.execute("INSERT OR REPLACE INTO views VALUES (?, ?)", (source, digest))
+            stats['stored'] = len(to_store)
+
+        # Destinations that are not a view of their content yet
+        to_place = []
+        for (_, destination), digest in zip(file_pairs, digests):
+            blob = get_blob_path(store_folder, digest)
+            row = connection.execute("SELECT digest FROM views WHERE path = ?", (str(destination),)).fetchone()
+            if row is not None and row['digest'] == digest and _is_view(destination, blob):
+                stats['unchanged'] += 1
+            else:
+                to_place.append((blob, destination, digest))
+
+        if to_place:
+            with span('place'), ThreadPoolExecutor(max_workers=workers) as executor:
+                methods = executor.map(lambda task: _place(task[0], task[1]), to_place)
+                for (blob, destination, digest), method in zip(to_place, methods):
+                    stats[method] += 1
+                    if method == 'copied':
+                        stats['bytes_copied'] += os.path.getsize(blob)
+                    connection.execute("INSERT OR REPLACE INTO views VALUES (?, ?)", (str(destination), digest))
+        connection.commit()
+    finally:
+        connection.close()
+
+    count('files_linked', stats['linked'] + stats['reflinked'])
+    count('bytes_copied', stats['bytes_copied'])
+    return stats
+
+
+def collect_garbage(store_folder:str) -> dict:
+    """
+    Forgets the views whose file was removed or replaced by another file, and removes the blobs that no view uses
+    anymore, as well as the hashes of the source files that no longer exist.
+
+    As the views are hard links (or clones) of the blobs, removing a blob never removes the content of a file
+    that still exists in a project folder.
+
+    :param store_folder:
+        - Type: str
+        - Description: Path to the store.
+
+    :return:
+        - Type: dict
+        - Description: {'views_forgotten', 'blobs_removed', 'bytes_freed', 'blobs' (blobs kept), 'bytes' (their size)}.
+    """
+    store_folder = Path(store_folder)
+    stats = {'views_forgotten': 0, 'blobs_removed': 0, 'bytes_freed': 0, 'blobs': 0, 'bytes': 0}
+    if not store_folder.exists():
+        return stats
+
+    connection = _connect(store_folder)
+    try:
+        with span('check_views'):
+            views = connection.execute("SELECT path, digest FROM views").fetchall()
+            stale = [(row['path'],) for row in views
+                     if not _is_view(Path(row['path']), get_blob_path(store_folder, row['digest']))]
+            connection.executemany("DELETE FROM views WHERE path = ?", stale)
+            used = {row['digest'] for row in connection.execute("SELECT DISTINCT digest FROM views")}
+
+            missing_sources = [(row['path'],) for row in connection.execute("SELECT path FROM sources")
+                               if not os.path.exists(row['path'])]
+            connection.executemany("DELETE FROM sources WHERE path = ?", missing_sources)
+        connection.commit()
+        stats['views_forgotten'] = len(stale)
+
+        with span('remove_blobs'):
+            for prefix_folder in (store_folder / 'objects').glob('*'):
+                for blob in prefix_folder.iterdir():
+                    size = blob.stat().st_size
+                    if blob.name in used:
+                        stats['blobs'] += 1
+                        stats['bytes'] += size
+                        continue
+                    blob.unlink()
+                    stats['blobs_removed'] += 1
+                    stats['bytes_freed'] += size
+    finally:
+        connection.close()
+
+    count('blobs_removed', stats['blobs_removed'])
+    logger.info(f"{stats['blobs_removed']} unused blob(s) removed ({stats['bytes_freed'] / 1e6:.1f} MB freed), "
+                f"{stats['blobs']} blob(s) kept ({stats['bytes'] / 1e6:.1f} MB)")
+    return stats
@@ -1,13 +1,143 @@
 """
 The following module provides functions for handling class labels and mappings between class IDs and class names. These utility functions can be used for managing class information, transforming data for machine learning models, and converting between different annotation formats. The module includes the following functions:
 
-1. `get_labels(labels_file)`: Reads a labels file and creates a dictionary mapping class IDs to class names.
-2. `get_class_name(class_id, labels)`: Retrieves the class name associated with a given class ID.
-3. `get_class_code(class_name, labels)`: Retrieves the class ID associated with a given class name.
+1. `LabelMap`: A bidirectional mapping between integer class IDs and class names, with O(1) lookups in both directions.
+2. `load_label_map(labels_file)`: Reads a labels file into a `LabelMap`, once per version of the file.
+3. `get_labels(labels_file)`: Reads a labels file and creates a dictionary mapping class IDs to class names.
+4. `get_class_name(class_id, labels)`: Retrieves the class name associated with a given class ID.
+5. `get_class_code(class_name, labels)`: Retrieves the class ID associated with a given class name.
 
 Each function has its specific utility, which is described below.
 """
 
+import os
+
+
+class LabelMap:
+    """
+    A bidirectional mapping between class IDs (int) and class names, as stored in a 'labels.txt' file.
+    Both `name(class_id)` and `id(class_name)` are dictionary lookups.
+
+    A LabelMap is never modified in place (maps loaded with `load_label_map` are shared): `merge` returns
+    a new LabelMap, and `save` writes it to a 'labels.txt' file.
+
+    :param names:
+        - Type: dict
+        - Description: A dictionary mapping class IDs (int, or str like in 'labels.txt') to class names.
+    """
+
+    def __init__(self, names:dict=None):
+        self._names = {int(class_id): name for class_id, name in (names or {}).items()}
+        self._ids = {name: class_id for class_id, name in self._names.items()}
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, class_name):
+        return class_name in self._ids
+
+    def __eq__(self, other):
+        return isinstance(other, LabelMap) and self._names == other._names
+
+    def __repr__(self):
+        return f"LabelMap({self._names})"
+
+    def name(self, class_id, default:str='unknown-class') -> str:
+        """
+        Returns the class name of a class ID (int, float or str), or `default` if the ID is not defined.
+        """
+        try:
+            return self._names.get(int(float(class_id)), default)
+        except (TypeError, ValueError):
+            return default
+
+    def id(self, class_name:str, default=None):
+        """
+        Returns the class ID (int) of a class name, or `default` if the name is not defined.
+        """
+        return self._ids.get(class_name, default)
+
+    def items(self):
+        """
+        Returns the (class_id, class_name) pairs, in the order of the labels file.
+        """
+        return self._names.items()
+
+    def names(self) -> list:
+        """
+        Returns the class names, in the order of the labels file.
+        """
+        return list(self._names.values())
+
+    def to_dict(self) -> dict:
+        """
+        Returns the mapping as a dictionary {class ID (str): class name}, like `get_labels`.
+        """
+        return {str(class_id): name for class_id, name in self._names.items()}
+
+    def merge(self, class_names) -> 'LabelMap':
+        """
+        Returns a new LabelMap with the names of `class_names` (an iterable of names or another LabelMap)
+        that are not defined yet, appended with new IDs after the current highest ID. Existing IDs never change.
+        """
+        if isinstance(class_names, LabelMap):
+            class_names = class_names.names()
+
+        names = dict(self._names)
+        next_id = max(names) + 1 if names else 0
+        for class_name in class_names:
+            if class_name not in self._ids and class_name not in names.values():
+                names[next_id] = class_name
+                next_id += 1
+
+        return LabelMap(names)
+
+    def save(self, labels_file) -> None:
+        """
+        Writes the mapping to a 'labels.txt' file (one `'<id>': '<name>'` line per class).
+        """
+        with open(labels_file, 'w', encoding='utf-8') as f:
+            for class_id, name in self._names.items():
+                f.write(f"'{class_id}': '{name}'\n")
+
+
+_label_maps = {}
+
+
+def load_label_map(labels_file) -> LabelMap:
+    """
+    Reads a 'labels.txt' file into a `LabelMap`. The file is only read again if its size or modification time
+    changed since the last call, so this function can be called in a loop without re-reading the file.
+
+    :param labels_file:
+        - Type: str or Path
+        - Description: The path to the 'labels.txt' file which contains the class IDs and corresponding class names.
+
+    :return:
+        - Type: LabelMap
+        - Description: The class IDs and names of the file. The same object is returned while the file is unchanged.
+    """
+    path = os.path.abspath(labels_file)
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _label_maps.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    names = {}
+    with open(path, 'r', encoding='utf-8') as labels:
+        for line in labels:
+            if not line.strip():
+                continue
+            key, value = line.strip().split(': ')
+            names[key.strip("'")] = value.strip("'\n")
+
+    label_map = LabelMap(names)
+    _label_maps[path] = (version, label_map)
+    return label_map
+
+
 def get_labels(labels_file):
     """
     This functions checks if the file 'labels.txt' exists. 
@@ -24,15 +154,7 @@ def get_labels(labels_file):
         - Type: dict
         - Description: A dictionary where keys are class IDs (as strings) and values are class names.    
     """
-    labels_dict = {}
-    with open(labels_file, 'r') as labels:
-        for line in labels:
-            key, value = line.strip().split(': ')
-            key = key.strip("'")
-            value = value.strip("'\n")
-            labels_dict[key] = value
-    
-    return labels_dict
+    return load_label_map(labels_file).to_dict()
 
 
 def get_class_name(class_id, labels):
@@ -47,13 +169,16 @@ def get_class_name(class_id, labels):
         If provided as a float, it will be cast to an integer.
         
     :param labels: 
-        - Type: dict
-        - Description: A dictionary that maps class IDs (as strings) to class names.
+        - Type: dict or LabelMap
+        - Description: A dictionary that maps class IDs (as strings) to class names, or a LabelMap.
     
     :return: 
         - Type: str
         - Description: The name of the class corresponding to the provided class ID. Returns 'unknown-class' if the ID is not found.
     """
+    if isinstance(labels, LabelMap):
+        return labels.name(class_id)
+
     if not isinstance(class_id, int):
         class_id = int(float(class_id))
         return labels.get(str(class_id), 'unknown-class')
@@ -76,14 +201,18 @@ def get_class_code(class_name, labels):
         - Description: The name of the class for which the function should return the corresponding class ID.
     
     :param labels: 
-        - Type: dict
-        - Description: A dictionary that maps class names to class IDs (as strings).
-                       This is the reverse mapping of the dictionary used in get_class_name.
+        - Type: dict or LabelMap
+        - Description: The dictionary that maps class IDs (as strings) to class names, as returned by get_labels,
+                       or a LabelMap. With a dictionary, the reverse mapping is rebuilt on every call: use a LabelMap
+                       (see `load_label_map`) when looking up many names.
     
     :return: 
         - Type: str
         - Description: The ID of the class corresponding to the provided class name. Returns 'unknown-class' if the name is not found.
     """
-    
+    if isinstance(labels, LabelMap):
+        class_id = labels.id(class_name)
+        return 'unknown-class' if class_id is None else str(class_id)
+
     labels = {value : key for key, value in labels.items()}
     return labels.get(class_name, 'unknown-class')
\ No newline at end of file
@@ -0,0 +1,315 @@
+"""
+The following module runs a YOLO model on CPU-only machines with an optimized runtime (ONNX Runtime or OpenVINO)
+instead of PyTorch eager mode, and spreads the images across several processes.
+
+The 'weights/best.pt' model is exported once with the Ultralytics exporter, and the exported model is cached next to
+the weights ('weights/cpu_exports/<format>_<imgsz>/'), with the SHA-256 hash of the weights it was exported from.
+The export is reused as long as the weights are unchanged, and done again when they change.
+
+The images are split into contiguous shards, one per worker process. Each worker is started from a fresh interpreter
+and sets its number of threads (OpenMP, MKL, OpenBLAS, PyTorch, OpenCV) before loading the model, and is pinned to its
+own CPU cores when the system allows it, so that the workers do not compete for the same cores. Each worker predicts
+its shard batch by batch with `predict_images_in_batches`, so the label files are the same as with the PyTorch model:
+<class_id> <x_center> <y_center> <width> <height> <confidence>
+
+Functions included:
+1. get_export_folder: Returns the cache folder of an exported model.
+2. export_cpu_model: Exports the weights of a model folder to ONNX or OpenVINO, or returns the cached export.
+3. load_exported_model: Loads (once per process) an exported model.
+4. shard_images: Splits a list of images into contiguous shards.
+5. predict_images_cpu: Predicts a list of images with an exported model, across a pool of pinned worker processes.
+"""
+
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+from instrumentation import count, get_logger, span
+from stage_manifest import hash_file
+
+
+logger = get_logger('cpu_inference')
+
+# Exported model name for each format, as written by the Ultralytics exporter next to 'best.pt'
+EXPORT_FORMATS = {'onnx': 'best.onnx', 'openvino': 'best_openvino_model'}
+
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+
+def get_export_folder(yolo_model_folder:str, export_format:str='onnx', imgsz:int=640) -> Path:
+    """
+    Returns the cache folder of the export of a model: '<yolo_model_folder>/weights/cpu_exports/<format>_<imgsz>'.
+
+    :param yolo_model_folder:
+        - Type: str
+        - Description: Path to the folder containing the YOLO model weights.
+
+    :param export_format:
+        - Type: str
+        - Description: 'onnx' or 'openvino'.
+
+    :param imgsz:
+        - Type: int
+        - Description: Inference image size of the export.
+
+    :return:
+        - Type: Path
+    """
+    return Path(yolo_model_folder) / 'weights' / 'cpu_exports' / f"{export_format}_{imgsz}"
+
+
+def _read_export_info(export_folder:Path) -> dict:
+    try:
+        with open(export_folder / 'export.json', 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def export_cpu_model(yolo_model_folder:str, export_format:str='onnx', imgsz:int=640, force:bool=False) -> str:
+    """
+    Exports '<yolo_model_folder>/weights/best.pt' to an optimized CPU format, or returns the cached export if the
+    weights did not change since it was made. The weights are only hashed again when their size or modification time
+    changed.
+
+    The export is done in a temporary folder, which replaces the cache folder once it succeeded, so an interrupted
+    export never leaves a broken model in the cache.
+
+    :param yolo_model_folder:
+        - Type: str
+        - Description: Path to the folder containing the YOLO model weights.
+
+    :param export_format:
+        - Type: str
+        - Description: 'onnx' (ONNX Runtime) or 'openvino'.
+
+    :param imgsz:
+        - Type: int
+        - Description: Inference image size.
+
+    :param force:
+        - Type: bool
+        - Description: If True, the model is exported again even if the cached export is up to date.
+
+    :return:
+        - Type: str
+        - Description: Path to the exported model (an '.onnx' file or an OpenVINO model folder).
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{export_format}', use one of {', '.join(EXPORT_FORMATS)}")
+
+    weights_file = Path(yolo_model_folder) / 'weights' / 'best.pt'
+    if not weights_file.exists():
+        raise FileNotFoundError(f"No model found at {weights_file}")
+
+    export_folder = get_export_folder(yolo_model_folder, export_format, imgsz)
+    exported_model = export_folder / EXPORT_FORMATS[export_format]
+    info = _read_export_info(export_folder)
+    stat = weights_file.stat()
+
+    if not force and info and exported_model.exists():
+        if info['size'] == stat.st_size and info['mtime_ns'] == stat.st_mtime_ns:
+            return str(exported_model)
+        weights_hash = hash_file(weights_file)
+        if info['sha256'] == weights_hash:
+            # Same weights, touched or copied: only the recorded size and time change
+            info.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            with open(export_folder / 'export.json', 'w', encoding='utf-8') as f:
+                json.dump(info, f, indent=2)
+            return str(exported_model)
+    else:
+        weights_hash = hash_file(weights_file)
+
+    from ultralytics import YOLO
+
+    logger.info(f"Exporting {weights_file} to {export_format} (image size {imgsz})...")
+    temporary_folder = export_folder.with_name(export_folder.name + '.tmp')
+    shutil.rmtree(temporary_folder, ignore_errors=True)
+    temporary_folder.mkdir(parents=True)
+    try:
+        with span('export'):
+            shutil.copy2(weights_file, temporary_folder / 'best.pt')
+            # Dynamic input shapes, so that the images can be sent to the model in batches
+            YOLO(str(temporary_folder / 'best.pt')).export(format=export_format, imgsz=imgsz, dynamic=True)
+        (temporary_folder / 'best.pt').unlink()
+
+        with open(temporary_folder / 'export.json', 'w', encoding='utf-8') as f:
+            json.dump({'format': export_format, 'imgsz': imgsz, 'sha256': weights_hash,
+                       'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}, f, indent=2)
+
+        shutil.rmtree(export_folder, ignore_errors=True)
+        temporary_folder.replace(export_folder)
+    finally:
+        shutil.rmtree(temporary_folder, ignore_errors=True)
+
+    logger.info(f"Model exported to {exported_model}")
+    return str(exported_model)
+
+
+@lru_cache(maxsize=None)
+def load_exported_model(model_path:str):
+    """
+    Loads an exported model (see `export_cpu_model`). The model is cached, so calling this function again with the
+    same path in the same process does not reload it.
+
+    :param model_path:
+        - Type: str
+        - Description: Path to the exported model.
+
+    :return:
+        - Type: ultralytics.YOLO
+        - Description: The model, used like a PyTorch YOLO model (`predict`).
+    """
+    from ultralytics import YOLO
+
+    return YOLO(model_path, task='detect')
+
+
+def shard_images(img_paths:list, n_shards:int) -> list:
+    """
+    Splits a list of images into `n_shards` contiguous shards of (almost) equal sizes. Contiguous shards keep the
+    images of a folder together on disk.
+
+    :param img_paths:
+        - Type: list
+        - Description: Paths of the images.
+
+    :param n_shards:
+        - Type: int
+        - Description: Number of shards.
+
+    :return:
+        - Type: list of lists
+        - Description: The non-empty shards, in the order of `img_paths`.
+    """
+    n_shards = max(1, min(n_shards, len(img_paths)))
+    size, remainder = divmod(len(img_paths), n_shards)
+    shards, start = [], 0
+    for index in range(n_shards):
+        end = start + size + (index < remainder)
+        shards.append(img_paths[start:end])
+        start = end
+    return [shard for shard in shards if shard]
+
+
+def _pin_worker(threads:int, cores:list) -> None:
+    # Done before the model (and its runtime) is loaded in the worker
+    if threads is None:
+        return
+    for variable in THREAD_ENV_VARS:
+        os.environ[variable] = str(threads)
+    if cores and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, cores)
+        except OSError:
+            pass
+
+    import cv2
+    cv2.setNumThreads(1)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def _predict_shard(args) -> dict:
+    from inference_functions import predict_images_in_batches
+
+    model_path, img_paths, labels_folder, batch_size, imgsz, threads, cores = args
+    _pin_worker(threads, cores)
+
+    model = load_exported_model(model_path)
+    return predict_images_in_batches(model, img_paths, labels_folder, 'cpu', batch_size=batch_size,
+                                     decode_workers=1, imgsz=imgsz)
+
+
+def predict_images_cpu(yolo_model_folder:str, img_paths:list, labels_folder:str, export_format:str='onnx',
+                       workers:int=None, threads_per_worker:int=None, batch_size:int=1, imgsz:int=640) -> dict:
+    """
+    Predicts a list of images on CPU with an exported model, and saves one label file per image with detections
+    (same format as `predict_images_in_batches`).
+
+    The model is exported (or its cached export is reused, see `export_cpu_model`), then the images are split into
+    one contiguous shard per worker process. Each worker uses `threads_per_worker` threads, and is pinned to its own
+    cores when there are enough of them (Linux only).
+
+    :param yolo_model_folder:
+        - Type: str
+        - Description: Path to the folder containing the YOLO model weights ('weights/best.pt').
+
+    :param img_paths:
+        - Type: list of Path
+        - Description: Paths of the images to process.
+
+    :param labels_folder:
+        - Type: str
+        - Description: Folder where the '<image_name>.txt' label files are saved.
+
+    :param export_format:
+        - Type: str
+        - Description: 'onnx' or 'openvino'.
+
+    :param workers:
+        - Type: int
+        - Description: Number of worker processes. None uses the number of cores divided by `threads_per_worker`.
+
+    :param threads_per_worker:
+        - Type: int
+        - Description: Number of threads of each worker. None shares the cores between the workers (at least 1).
+
+    :param batch_size:
+        - Type: int
+        - Description: Number of images sent to the model at once, in each worker.
+
+    :param imgsz:
+        - Type: int
+        - Description: Inference image size.
+
+    :return:
+        - Type: dict
+        - Description: Run statistics (see `predict_images_in_batches`), summed over the workers, plus 'workers'.
+    """
+    model_path = export_cpu_model(yolo_model_folder, export_format, imgsz)
+
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+    if workers is None:
+        workers = max(1, len(cores) // (threads_per_worker or 2))
+    threads_per_worker = threads_per_worker or max(1, len(cores) // workers)
+
+    shards = shard_images(list(img_paths), workers)
+    # Distinct cores for each worker, when there are enough of them
+    pinned = len(shards) * threads_per_worker <= len(cores)
+    tasks = [(model_path, shard, str(labels_folder), batch_size, imgsz, threads_per_worker,
+              cores[index * threads_per_worker:(index + 1) * threads_per_worker] if pinned else None)
+             for index, shard in enumerate(shards)]
+
+    Path(labels_folder).mkdir(parents=True, exist_ok=True)
+    stats = {'images': 0, 'images_with_detections': 0, 'unreadable_images': 0, 'boxes': 0, 'workers': len(tasks)}
+
+    start = time.perf_counter()
+    with span('predict_shards'):
+        if len(tasks) == 1:
+            # A single shard runs in the current process, whose thread settings are left as they are
+            shard_stats = [_predict_shard(tasks[0][:5] + (None, None))]
+        else:
+            # Fresh interpreters: the thread settings are applied before any runtime is loaded
+            with ProcessPoolExecutor(max_workers=len(tasks), mp_context=multiprocessing.get_context('spawn')) as executor:
+                shard_stats = list(executor.map(_predict_shard, tasks))
+
+    for result in shard_stats:
+        for key in ('images', 'images_with_detections', 'unreadable_images', 'boxes'):
+            stats[key] += result[key]
+    count('images_predicted', stats['images'])
+    count('boxes_written', stats['boxes'])
+
+    elapsed = time.perf_counter() - start
+    stats['elapsed_seconds'] = elapsed
+    stats['images_per_second'] = stats['images'] / elapsed if elapsed > 0 else 0.0
+
+    return stats
@@ -0,0 +1,242 @@
+"""
+The following module provides functions for preparing the train/val split of a training session without
+moving the dataset. The split is read from the 'traindata.txt' and 'valdata.txt' files and given to YOLO
+either as two list files of image paths, or as two trees of links (hard or symbolic) to the original
+images and labels. In both cases only metadata is written: the original files are never moved or copied.
+
+Split modes:
+    - 'list': 'train.txt' and 'val.txt' in the dataset folder list the absolute paths of the original images.
+              YOLO finds the label of '<data>/images/<name>.jpg' in '<data>/labels/<name>.txt'.
+    - 'hardlink': 'images/{train,val}' and 'labels/{train,val}' contain hard links to the original files
+                  (symbolic links when the dataset folder is on another file system).
+    - 'symlink': same layout, with symbolic links.
+    - 'move': the previous behaviour, the files are moved (see `split_data_for_training` in notebook 3).
+
+Functions included:
+1. read_split_file: Reads a 'traindata.txt'/'valdata.txt' file and returns the paths of the images in the dataset folder.
+2. write_image_list: Writes a YOLO list file of image paths.
+3. link_split: Creates the links of a split (images and labels).
+4. prepare_split: Prepares the train and val splits in a dataset folder and returns the YAML 'train'/'val' entries.
+5. restore_split_folder: Empties a split folder, moving its files back only if they were moved by the 'move' split mode.
+"""
+
+import os
+import shutil
+from pathlib import Path
+
+from file_index import IMG_EXTS, index_folder
+from instrumentation import get_logger
+
+
+logger = get_logger('dataset_split')
+
+SPLIT_MODES = ('list', 'hardlink', 'symlink', 'move')
+
+
+def read_split_file(split_file:str, img_folder:str) -> list:
+    """
+    Reads a split file ('traindata.txt' or 'valdata.txt', one image path per line) and returns the paths of
+    these images in `img_folder`. Images are matched by file name without extension, so a split file written for
+    another location (e.g. reused from a previous model) or for the original images of a training cache
+    (see `training_cache`) still works. The folder is listed once.
+
+    :param split_file:
+        - Type: str
+        - Description: Path to the split file.
+
+    :param img_folder:
+        - Type: str
+        - Description: Path to the folder containing the images of the dataset.
+
+    :return:
+        - Type: list of Path
+        - Description: Paths of the listed images that exist in `img_folder`, in the order of the file.
+    """
+    images = index_folder(img_folder, IMG_EXTS)
+    img_paths = []
+    with open(split_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            img_path = images.get(Path(line).stem)
+            if img_path is not None:
+                img_paths.append(Path(img_path))
+            else:
+                logger.warning(f"Image file {Path(img_folder) / Path(line).name} not found.")
+    return img_paths
+
+
+def write_image_list(img_paths:list, list_file:str) -> None:
+    """
+    Writes a YOLO list file: the absolute path of one image per line.
+
+    :param img_paths:
+        - Type: list of Path
+        - Description: Paths of the images.
+
+    :param list_file:
+        - Type: str
+        - Description: Path to the list file to write.
+    """
+    with open(list_file, 'w') as f:
+        for img_path in img_paths:
+            f.write(str(Path(img_path).resolve()) + "\n")
+
+
+def _link(source:Path, destination:Path, mode:str) -> None:
+    if destination.is_symlink() or destination.exists():
+        destination.unlink()
+
+    if mode == 'hardlink':
+        try:
+            os.link(source, destination)
+            return
+        except OSError:
+            # Hard links can't cross file systems
+            pass
+    os.symlink(source.resolve(), destination)
+
+
+def link_split(img_paths:list, labels_folder:str, output_img_folder:str, output_labels_folder:str, mode:str='hardlink') -> int:
+    """
+    Creates links to the images of a split and to their label files, in the YOLO folder structure.
+
+    :param img_paths:
+        - Type: list of Path
+        - Description: Paths of the images of the split.
+
+    :param labels_folder:
+        - Type: str
+        - Description: Path to the folder containing the corresponding YOLO label files.
+
+    :param output_img_folder:
+        - Type: str
+        - Description: Folder where the image links are created (e.g. images/train).
+
+    :param output_labels_folder:
+        - Type: str
+        - Description: Folder where the label links are created (e.g. labels/train).
+
+    :param mode:
+        - Type: str
+        - Description: 'hardlink' (falls back to symbolic links across file systems) or 'symlink'.
+
+    :return:
+        - Type: int
+        - Description: The number of images linked.
+    """
+    output_img_folder = Path(output_img_folder)
+    output_img_folder.mkdir(parents=True, exist_ok=True)
+    output_labels_folder = Path(output_labels_folder)
+    output_labels_folder.mkdir(parents=True, exist_ok=True)
+
+    for img_path in img_paths:
+        img_path = Path(img_path)
+        _link(img_path, output_img_folder / img_path.name, mode)
+
+        txt_file = Path(labels_folder) / f"{img_path.stem}.txt"
+        if txt_file.exists():
+            _link(txt_file, output_labels_folder / txt_file.name, mode)
+        else:
+            logger.warning(f'Text file {txt_file} does not exist')
+
+    return len(img_paths)
+
+
+def prepare_split(img_folder:str, labels_folder:str, dataset_folder:str, train_data:str, val_data:str, mode:str='list') -> dict:
+    """
+    Prepares the train and val splits of a training session in `dataset_folder`, from the split files,
+    without moving or copying the original images and labels.
+
+    :param img_folder:
+        - Type: str
+        - Description: Path to the folder containing the images of the dataset.
+
+    :param labels_folder:
+        - Type: str
+        - Description: Path to the folder containing the YOLO label files.
+
+    :param dataset_folder:
+        - Type: str
+        - Description: Path to the dataset folder of the training session ('datasets/<project>').
+
+    :param train_data:
+        - Type: str
+        - Description: Path to the 'traindata.txt' split file.
+
+    :param val_data:
+        - Type: str
+        - Description: Path to the 'valdata.txt' split file.
+
+    :param mode:
+        - Type: str
+        - Description: 'list', 'hardlink' or 'symlink' (see the module description).
+
+    :return:
+        - Type: dict
+        - Description: The 'train' and 'val' entries of the YAML file, relative to `dataset_folder`.
+    """
+    if mode not in ('list', 'hardlink', 'symlink'):
+        raise ValueError(f"Unknown split mode '{mode}', use 'list', 'hardlink' or 'symlink'")
+
+    dataset_folder = Path(dataset_folder)
+    dataset_folder.mkdir(parents=True, exist_ok=True)
+
+    entries = {}
+    for split, split_file in (('train', train_data), ('val', val_data)):
+        img_paths = read_split_file(split_file, img_folder)
+
+        if mode == 'list':
+            write_image_list(img_paths, dataset_folder / f"{split}.txt")
+            entries[split] = f"{split}.txt"
+        else:
+            link_split(img_paths, labels_folder, dataset_folder / 'images' / split, dataset_folder / 'labels' / split, mode)
+            entries[split] = f"images/{split}"
+
+        logger.info(f"{len(img_paths)} images in the {split} split ({mode})")
+
+    return entries
+
+
+def restore_split_folder(split_folder:str, original_folder:str, split_mode:str) -> int:
+    """
+    Empties a split folder (e.g. images/train). With the 'move' split mode, its files were moved from
+    `original_folder` and are moved back (a file whose original still exists is a duplicate and is just removed, the
+    original files are never overwritten). With the other modes, its files are links (or copies) and are removed,
+    whatever is in `original_folder`: nothing is ever moved into it.
+
+    :param split_folder:
+        - Type: str
+        - Description: Path to the split folder.
+
+    :param original_folder:
+        - Type: str
+        - Description: Path to the original folder of the files.
+
+    :param split_mode:
+        - Type: str
+        - Description: The split mode the split folder was prepared with: 'list', 'hardlink', 'symlink' or 'move'.
+
+    :return:
+        - Type: int
+        - Description: The number of files moved back to `original_folder`.
+    """
+    if split_mode not in SPLIT_MODES:
+        raise ValueError(f"Unknown split mode '{split_mode}', use one of {', '.join(SPLIT_MODES)}")
+
+    split_folder = Path(split_folder)
+    original_folder = Path(original_folder)
+    if not split_folder.exists():
+        return 0
+
+    moved = 0
+    for file in split_folder.iterdir():
+        original = original_folder / file.name
+        if split_mode != 'move' or file.is_symlink() or original.exists():
+            file.unlink()
+        else:
+            original_folder.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(file), str(original))
+            moved += 1
+    return moved
@@ -0,0 +1,317 @@
+"""
+The following module computes the descriptive statistics of a YOLO training dataset in a single pass.
+The 'images' and 'labels' folders are listed once each, and every label file is read once, by a pool of
+threads (the reads are I/O bound, especially on network file systems). In the same pass, the encoding of
+each label file is checked, its boxes are parsed and, optionally, the image header is read to get the image
+dimensions. All the outputs (CSV files and plots) are then computed in memory with NumPy and written at the end.
+
+Functions included:
+1. scan_dataset: Reads the whole dataset once and returns its images, annotation counts, encodings and boxes.
+2. compute_geometry_histograms: Computes box-size, aspect-ratio and per-class area histograms.
+3. write_dataset_statistics: Writes all the statistics files and plots of a scanned dataset.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from file_index import IMG_EXTS
+from instrumentation import count, get_logger, span
+
+
+logger = get_logger('dataset_statistics')
+
+# Relative box areas (width × height), from 1/100 000 of the image to the whole image
+AREA_BINS = np.logspace(-5, 0, 26)
+# Aspect ratios (width / height), from 1:20 to 20:1
+ASPECT_RATIO_BINS = np.logspace(np.log10(0.05), np.log10(20), 27)
+# Relative widths and heights
+SIZE_BINS = np.linspace(0, 1, 21)
+
+
+def _read_label_file(label_path:str, img_path:str, read_image_sizes:bool) -> tuple:
+    encoding = None
+    boxes = np.empty((0, 5))
+    if label_path is not None:
+        with span('read_labels'):
+            with open(label_path, 'rb') as f:
+                rawdata = f.read()
+        count('bytes_read', len(rawdata))
+        try:
+            text = rawdata.decode('utf-8')
+            encoding = 'utf-8'
+        except UnicodeDecodeError:
+            text = rawdata.decode('iso-8859-1')
+            encoding = 'iso-8859-1'
+
+        rows = []
+        for line in text.splitlines():
+            values = line.split()
+            if len(values) < 5:
+                continue
+            try:
+                rows.append([float(value) for value in values[:5]])
+            except ValueError:
+                logger.warning(f"Invalid line in {Path(label_path).name}: {line}")
+        boxes = np.array(rows, dtype=np.float64).reshape(-1, 5)
+
+    image_size = None
+    if read_image_sizes:
+        from PIL import Image
+
+        try:
+            with span('read_image_headers'):
+                with Image.open(img_path) as img:
+                    image_size = img.size
+        except Exception as e:
+            logger.warning(f"Failed to read image {Path(img_path).name}: {e}")
+
+    return encoding, boxes, image_size
+
+
+def _list_files(folder:Path, extensions:set) -> dict:
+    if not folder.exists():
+        return {}
+    return {Path(entry.name).stem: entry.path for entry in os.scandir(folder)
+            if entry.is_file() and Path(entry.name).suffix.lower() in extensions}
+
+
+def scan_dataset(img_folder:str, labels_folder:str, workers:int=8, read_image_sizes:bool=True) -> dict:
+    """
+    Reads a YOLO dataset once. Each folder is listed once, and the label file (and image header) of each image
+    is read by a pool of threads.
+
+    :param img_folder:
+        - Type: str
+        - Description: Path to the folder containing the images (.jpg, .jpeg, .png, .tif, .tiff).
+
+    :param labels_folder:
+        - Type: str
+        - Description: Path to the folder containing the YOLO label files.
+
+    :param workers:
+        - Type: int
+        - Description: Number of threads reading the files.
+
+    :param read_image_sizes:
+        - Type: bool
+        - Description: If True, the image headers are read to get the image dimensions, used for the aspect ratios
+                       of the boxes in pixels. If False, aspect ratios are computed in relative coordinates.
+
+    :return:
+        - Type: dict
+        - Description: A dictionary with the keys:
+                       'images' (dict image name -> image path),
+                       'annotations_per_image' (dict image path -> number of boxes, for images with a label file),
+                       'without_annotations' (list of image paths without label file or with an empty one),
+                       'encodings' (dict label file name -> encoding, for files that are not UTF-8),
+                       'class_id' (int array), 'xywh' (float array (N, 4)), 'image_id' (int array, index in 'images'),
+                       'image_sizes' (float array (n_images, 2) of widths and heights, NaN when unknown).
+    """
+    img_folder = Path(img_folder)
+    labels_folder = Path(labels_folder)
+
+    with span('list'):
+        images = dict(sorted(_list_files(img_folder, IMG_EXTS).items()))
+        label_files = _list_files(labels_folder, {'.txt'})
+    count('files_scanned', len(images) + len(label_files))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(lambda item: _read_label_file(label_files.get(item[0]), item[1], read_image_sizes),
+                                    images.items()))
+
+    annotations_per_image = {}
+    without_annotations = []
+    encodings = {}
+    boxes, image_ids = [], []
+    image_sizes = np.full((len(images), 2), np.nan)
+
+    for image_id, ((image_name, img_path), (encoding, image_boxes, image_size)) in enumerate(zip(images.items(), results)):
+        if image_size is not None:
+            image_sizes[image_id] = image_size
+
+        if encoding is None:
+            without_annotations.append(Path(img_path))
+            continue
+        if encoding != 'utf-8':
+            encodings[Path(label_files[image_name]).name] = encoding
+
+        annotations_per_image[Path(img_path)] = len(image_boxes)
+        if len(image_boxes) == 0:
+            without_annotations.append(Path(img_path))
+            continue
+
+        boxes.append(image_boxes)
+        image_ids.append(np.full(len(image_boxes), image_id))
+
+    boxes = np.concatenate(boxes) if boxes else np.empty((0, 5))
+
+    return {
+        'images': images,
+        'annotations_per_image': annotations_per_image,
+        'without_annotations': without_annotations,
+        'encodings': encodings,
+        'class_id': boxes[:, 0].astype(int),
+        'xywh': boxes[:, 1:5],
+        'image_id': np.concatenate(image_ids) if image_ids else np.empty(0, dtype=int),
+        'image_sizes': image_sizes
+    }
+
+
+def compute_geometry_histograms(stats:dict) -> dict:
+    """
+    Computes the geometry histograms of the boxes of a scanned dataset.
+
+    :param stats:
+        - Type: dict
+        - Description: The result of `scan_dataset`.
+
+    :return:
+        - Type: dict
+        - Description: A dictionary with the keys:
+                       'width' and 'height' (histograms of the relative box widths and heights, on `SIZE_BINS`),
+                       'area' (histogram of the relative box areas, on `AREA_BINS`),
+                       'aspect_ratio' (histogram of width / height, on `ASPECT_RATIO_BINS`; in pixels when the image
+                       dimensions are known),
+                       'class_area' (dict class ID -> histogram of the relative box areas of the class, on `AREA_BINS`).
+    """
+    xywh = stats['xywh']
+    widths, heights = xywh[:, 2], xywh[:, 3]
+    areas = widths * heights
+
+    # Aspect ratios in pixels when the image dimensions are known, in relative coordinates otherwise
+    image_sizes = stats['image_sizes'][stats['image_id']] if len(stats['image_id']) else np.empty((0, 2))
+    pixel_widths = np.where(np.isnan(image_sizes[:, 0]), widths, widths * image_sizes[:, 0])
+    pixel_heights = np.where(np.isnan(image_sizes[:, 1]), heights, heights * image_sizes[:, 1])
+    valid = pixel_heights > 0
+    aspect_ratios = pixel_widths[valid] / pixel_heights[valid]
+
+    class_area = {}
+    for class_id in np.unique(stats['class_id']).tolist():
+        class_area[class_id] = np.histogram(areas[stats['class_id'] == class_id], bins=AREA_BINS)[0]
+
+    return {
+        'width': np.histogram(widths, bins=SIZE_BINS)[0],
+        'height': np.histogram(heights, bins=SIZE_BINS)[0],
+        'area': np.histogram(areas, bins=AREA_BINS)[0],
+        'aspect_ratio': np.histogram(aspect_ratios, bins=ASPECT_RATIO_BINS)[0],
+        'class_area': class_area
+    }
+
+
+def _bins_frame(bins:np.ndarray, columns:dict):
+    import pandas as pd
+
+    df = pd.DataFrame({'bin_start': bins[:-1], 'bin_end': bins[1:]})
+    for name, counts in columns.items():
+        df[name] = counts
+    return df
+
+
+def write_dataset_statistics(stats:dict, label_dict:dict, stats_folder:str, show:bool=True) -> None:
+    """
+    Writes all the statistics files of a scanned dataset in the statistics folder:
+        - annotations_per_img.csv: number of annotations per image, sorted by decreasing number
+        - class_distribution.csv and class_distribution.png: number of annotations per class
+        - global_data.csv: number of images without annotations and total number of annotations
+        - box_size_histogram.csv: histograms of the relative box widths and heights
+        - box_area_histogram.csv: histogram of the relative box areas, globally and per class
+        - aspect_ratio_histogram.csv: histogram of the box aspect ratios (width / height)
+        - box_geometry.png: plots of the geometry histograms
+
+    :param stats:
+        - Type: dict
+        - Description: The result of `scan_dataset`.
+
+    :param label_dict:
+        - Type: dict or LabelMap
+        - Description: Dictionary mapping class IDs (as strings) to class names, or a LabelMap.
+
+    :param stats_folder:
+        - Type: str
+        - Description: Path to the 'dataset_statistics' folder.
+
+    :param show:
+        - Type: bool
+        - Description: If True, the plots are also displayed.
+    """
+    import pandas as pd
+    import matplotlib.pyplot as plt
+
+    from class_names_functions import get_class_name
+
+    stats_folder = Path(stats_folder)
+    stats_folder.mkdir(parents=True, exist_ok=True)
+
+    # Annotations per image
+    sorted_counts = sorted(stats['annotations_per_image'].items(), key=lambda x: x[1], reverse=True)
+    df = pd.DataFrame(sorted_counts, columns=['image_name', 'annotations_nb'])
+    csv_file_path = stats_folder / 'annotations_per_img.csv'
+    df.to_csv(csv_file_path, index=False, sep=';')
+    logger.info(f'{csv_file_path} created')
+
+    # Class distribution
+    class_ids, occurrences = np.unique(stats['class_id'], return_counts=True)
+    class_names = [get_class_name(int(class_id), label_dict).strip() for class_id in class_ids]
+    df = pd.DataFrame({'class_name': class_names, 'nb_occurrences': occurrences})
+    csv_file_path = stats_folder / 'class_distribution.csv'
+    df.to_csv(csv_file_path, index=False, sep=';')
+    logger.info(f'{csv_file_path} created')
+
+    plt.figure()
+    plt.barh(class_names, occurrences)
+    plt.xlabel('Nombre d\'occurrences')
+    plt.ylabel('Classes')
+    plt.title('Distribution des classes')
+    plt.savefig(stats_folder / 'class_distribution.png', bbox_inches='tight')
+    plt.show() if show else plt.close()
+
+    # Global data
+    metrics = {
+        'Number of files without annotations': len(stats['without_annotations']),
+        'Total number of annotations': len(stats['class_id'])
+    }
+    df = pd.DataFrame(metrics.items(), columns=['metric', 'value'])
+    csv_file_path = stats_folder / 'global_data.csv'
+    df.to_csv(csv_file_path, index=False, sep=';')
+    logger.info(f'{csv_file_path} created')
+
+    # Geometry histograms
+    histograms = compute_geometry_histograms(stats)
+
+    _bins_frame(SIZE_BINS, {'width': histograms['width'], 'height': histograms['height']}).to_csv(
+        stats_folder / 'box_size_histogram.csv', index=False, sep=';')
+
+    class_columns = {get_class_name(int(class_id), label_dict).strip(): counts
+                     for class_id, counts in histograms['class_area'].items()}
+    _bins_frame(AREA_BINS, {'all_classes': histograms['area'], **class_columns}).to_csv(
+        stats_folder / 'box_area_histogram.csv', index=False, sep=';')
+
+    _bins_frame(ASPECT_RATIO_BINS, {'aspect_ratio': histograms['aspect_ratio']}).to_csv(
+        stats_folder / 'aspect_ratio_histogram.csv', index=False, sep=';')
+    logger.info(f'Box geometry histograms created in {stats_folder}')
+
+    fig, axes = plt.subplots(1, 3, figsize=(18, 5))
+    axes[0].stairs(histograms['width'], SIZE_BINS, label='width')
+    axes[0].stairs(histograms['height'], SIZE_BINS, label='height')
+    axes[0].set_xlabel('Relative size')
+    axes[0].set_title('Box sizes')
+    axes[0].legend()
+
+    for class_name, counts in class_columns.items():
+        axes[1].stairs(counts, AREA_BINS, label=class_name)
+    axes[1].set_xscale('log')
+    axes[1].set_xlabel('Relative area')
+    axes[1].set_title('Box areas per class')
+    if class_columns:
+        axes[1].legend(fontsize='small')
+
+    axes[2].stairs(histograms['aspect_ratio'], ASPECT_RATIO_BINS, fill=True)
+    axes[2].set_xscale('log')
+    axes[2].set_xlabel('Width / height')
+    axes[2].set_title('Aspect ratios')
+
+    fig.savefig(stats_folder / 'box_geometry.png', bbox_inches='tight')
+    plt.show() if show else plt.close(fig)
@@ -1,34 +1,73 @@
-import torch
+"""
+The following module detects the device used by PyTorch for training and inference.
 
+The detection imports PyTorch (and tries PyTorch/XLA), which takes several seconds: it is done once per process,
+the first time `which_device` is called, and the result is reused by the following calls. The device can be forced
+with the TIAMAT_DEVICE environment variable (see `config.DEVICE`), e.g. TIAMAT_DEVICE=cpu or TIAMAT_DEVICE=cuda:1,
+in which case PyTorch is not probed at all.
+
+Functions included:
+1. which_device: Returns the best available device (detected once per process).
+"""
+
+import os
+from functools import lru_cache
+
+from instrumentation import get_logger
+
+
+logger = get_logger('device')
+
+
+def _device_override() -> str:
+    try:
+        import config
+        return config.DEVICE
+    except (ImportError, AttributeError):
+        # Modules used without the 'src' folder in the path
+        return os.getenv('TIAMAT_DEVICE') or None
+
+
+@lru_cache(maxsize=None)
 def which_device() -> str:
     """
     Detects the best available device for PyTorch-based inference (CUDA, MPS, XLA/TPU, or CPU).
+    The device is detected once per process: the following calls return the same device without probing again
+    (`which_device.cache_clear()` forgets it). If the TIAMAT_DEVICE environment variable is set, its value is
+    returned without probing.
 
     Returns
     -------
     str
-        The best available device, one of: 'cuda', 'mps', 'xla', or 'cpu'.
+        The best available device, one of: 'cuda', 'mps', 'xla', or 'cpu' (or the TIAMAT_DEVICE value).
     """
 
+    override = _device_override()
+    if override:
+        logger.info(f"✅ Using {override} (TIAMAT_DEVICE)")
+        return override
+
+    import torch
+
     # 1. CUDA (NVIDIA GPUs)
     if torch.cuda.is_available():
-        print(f"✅ Using CUDA GPU: {torch.cuda.get_device_name(0)}")
+        logger.info(f"✅ Using CUDA GPU: {torch.cuda.get_device_name(0)}")
         return "cuda"
 
     """# 2. MPS (Apple Silicon GPUs)
     if hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
-        print("✅ Using Apple Silicon GPU (MPS)")
+        logger.info("✅ Using Apple Silicon GPU (MPS)")
         return "mps"""
 
     # 3. TPU (XLA - PyTorch/XLA)
     try:
         import torch_xla.core.xla_model as xm
         dev = xm.xla_device()
-        print(f"✅ Using TPU: {dev}")
+        logger.info(f"✅ Using TPU: {dev}")
         return "xla"
     except ImportError:
         pass  # torch_xla not installed or no TPU available
 
     # 4. CPU fallback
-    print("⚠️ Using CPU")
+    logger.info("⚠️ Using CPU")
     return "cpu"
@@ -0,0 +1,435 @@
+"""
+The following module provides functions for matching YOLO predictions with corrected annotations and
+classifying each prediction as TP, FP or FP_class (and each missed correction as FN).
+Each label file is parsed once into a NumPy array, the IoU between all the predictions and all the
+corrections of an image is computed in a single vectorized operation, and predictions are assigned
+one-to-one to corrections, so a correction can't be claimed by two predictions.
+
+Functions included:
+1. read_yolo_boxes: Reads a YOLO label file into a NumPy array (and its raw lines).
+2. iou_matrix: Computes the IoU between every pair of boxes of two arrays of relative (x, y, w, h) boxes.
+3. match_boxes: Assigns predictions to corrections one-to-one (greedy by confidence or Hungarian).
+4. evaluate_image: Produces the evaluation rows (TP/FP/FP_class/FN) of one image.
+5. iter_evaluation_rows: Evaluates a set of images across a process pool, yielding the rows image by image.
+6. evaluate_images: Evaluates a set of images across a process pool.
+7. get_store_pairs: Lists the images (and their boxes) to evaluate from two annotation stores.
+8. evaluate_stores: Evaluates a prediction annotation store against a correction annotation store.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from class_names_functions import get_class_name
+from annotation_store import get_image_boxes
+from instrumentation import count, span
+
+
+# IoU of a TP (same class), and of a FP_class (another class)
+MATCH_IOU = 0.5
+CLASS_MATCH_IOU = 0.75
+
+
+def read_yolo_boxes(label_file) -> tuple:
+    """
+    Reads a YOLO label file once and returns its content as a float array.
+
+    :param label_file:
+        - Type: str or Path
+        - Description: Path to a YOLO label file. Each line contains `class_id x_center y_center width height`,
+                       optionally followed by a confidence score.
+
+    :return:
+        - Type: tuple (numpy.ndarray, list of str)
+        - Description: An array of shape (N, 6) with columns class_id, x_center, y_center, width, height and
+                       confidence (0.0 when the file has no confidence column), and the N stripped lines of the file.
+    """
+    lines = []
+    values = []
+    with open(label_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            row = [float(value) for value in line.split()]
+            values.append((row + [0.0] * 6)[:6])
+            lines.append(line)
+
+    boxes = np.array(values, dtype=np.float64).reshape(-1, 6)
+    return boxes, lines
+
+
+def iou_matrix(boxes1:np.ndarray, boxes2:np.ndarray) -> np.ndarray:
+    """
+    Computes the Intersection over Union (IoU) between every box of `boxes1` and every box of `boxes2`.
+    Boxes are given in relative YOLO format (x_center, y_center, width, height).
+
+    :param boxes1:
+        - Type: numpy.ndarray
+        - Description: Array of shape (N, 4) with relative (x_center, y_center, width, height) coordinates.
+
+    :param boxes2:
+        - Type: numpy.ndarray
+        - Description: Array of shape (M, 4) with relative (x_center, y_center, width, height) coordinates.
+
+    :return:
+        - Type: numpy.ndarray
+        - Description: Array of shape (N, M) where element (i, j) is the IoU between boxes1[i] and boxes2[j],
+                       between 0 (no overlap) and 1 (perfect overlap).
+    """
+    boxes1 = np.asarray(boxes1, dtype=np.float64).reshape(-1, 4)
+    boxes2 = np.asarray(boxes2, dtype=np.float64).reshape(-1, 4)
+
+    # Convert coordinates (x, y, w, h) in (x_min, y_min, x_max, y_max)
+    min1 = boxes1[:, :2] - boxes1[:, 2:] / 2
+    max1 = boxes1[:, :2] + boxes1[:, 2:] / 2
+    min2 = boxes2[:, :2] - boxes2[:, 2:] / 2
+    max2 = boxes2[:, :2] + boxes2[:, 2:] / 2
+
+    # Area of the overlap for every pair of boxes
+    overlap = np.clip(np.minimum(max1[:, None, :], max2[None, :, :]) - np.maximum(min1[:, None, :], min2[None, :, :]), 0, None)
+    intersection = overlap[..., 0] * overlap[..., 1]
+
+    area1 = boxes1[:, 2] * boxes1[:, 3]
+    area2 = boxes2[:, 2] * boxes2[:, 3]
+    union = area1[:, None] + area2[None, :] - intersection
+
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def match_boxes(predictions:np.ndarray, corrections:np.ndarray, method:str='greedy') -> list:
+    """
+    Assigns predicted boxes to corrected boxes one-to-one, based on their IoU and classes.
+
+    A prediction is only paired with a correction of the same class with IoU ≥ 0.5 (a TP in `evaluate_image`), or with
+    a correction of another class with IoU ≥ 0.75 (a FP_class). The same-class pairs are matched first, so a
+    correction is never taken by a prediction of the wrong class while a prediction of its class overlaps it enough,
+    and a correction is never consumed by a pair that would be a FP.
+
+    :param predictions:
+        - Type: numpy.ndarray
+        - Description: Array of shape (N, 6) as returned by `read_yolo_boxes` (class_id, x, y, w, h, confidence).
+
+    :param corrections:
+        - Type: numpy.ndarray
+        - Description: Array of shape (M, 6) as returned by `read_yolo_boxes`.
+
+    :param method:
+        - Type: str
+        - Description: 'greedy' (default): predictions are processed by decreasing confidence and each one takes
+                       the free same-class correction with the highest IoU, then the remaining predictions take the
+                       free corrections of another class the same way.
+                       'hungarian': the assignment maximizing the number of same-class pairs, then the total IoU
+                       (requires scipy).
+
+    :return:
+        - Type: list of tuples
+        - Description: One tuple (prediction_index, correction_index, iou) per prediction, in the order of `predictions`.
+                       correction_index is None (and iou 0.0) when the prediction has no free correction it can
+                       be paired with.
+    """
+    nb_predictions, nb_corrections = len(predictions), len(corrections)
+    assigned = [None] * nb_predictions
+    ious = [0.0] * nb_predictions
+
+    if method not in ('greedy', 'hungarian'):
+        raise ValueError(f"Unknown matching method '{method}', use 'greedy' or 'hungarian'")
+
+    if nb_predictions and nb_corrections:
+        iou = iou_matrix(predictions[:, 1:5], corrections[:, 1:5])
+        same_class = predictions[:, 0][:, None].astype(int) == corrections[:, 0][None, :].astype(int)
+        # Pairs counted as TP, and pairs counted as FP_class
+        tp_pairs = same_class & (iou >= MATCH_IOU)
+        fp_class_pairs = ~same_class & (iou >= CLASS_MATCH_IOU)
+
+        if method == 'hungarian':
+            from scipy.optimize import linear_sum_assignment
+
+            # A same-class pair outweighs any pair of another class; the other pairs are not allowed
+            weights = np.where(tp_pairs, iou + 2.0, np.where(fp_class_pairs, iou, 0.0))
+            rows, cols = linear_sum_assignment(weights, maximize=True)
+            for row, col in zip(rows, cols):
+                if tp_pairs[row, col] or fp_class_pairs[row, col]:
+                    assigned[row] = int(col)
+                    ious[row] = float(iou[row, col])
+
+        else:
+            free = np.ones(nb_corrections, dtype=bool)
+            # Stable sort, so predictions with the same confidence keep their order
+            order = np.argsort(-predictions[:, 5], kind='stable')
+            for allowed in (tp_pairs, fp_class_pairs):
+                for row in order:
+                    if assigned[row] is not None:
+                        continue
+                    candidates = np.where(free & allowed[row], iou[row], -1.0)
+                    col = int(np.argmax(candidates))
+                    if candidates[col] >= 0:
+                        free[col] = False
+                        assigned[row] = col
+                        ious[row] = float(iou[row, col])
+
+    return [(index, assigned[index], ious[index]) for index in range(nb_predictions)]
+
+
+def _read_boxes(source) -> np.ndarray:
+    # A label file path, or an array of boxes already read (e.g. from an annotation store)
+    if source is None:
+        return np.empty((0, 6))
+    if isinstance(source, np.ndarray):
+        return source.reshape(-1, 6)
+    return read_yolo_boxes(source)[0]
+
+
+def _box_columns(prefix, box):
+    # Numeric coordinate columns (None when there is no box)
+    names = [f'{prefix}_x_center', f'{prefix}_y_center', f'{prefix}_width', f'{prefix}_height']
+    return dict(zip(names, box[1:5] if box is not None else [None] * 4))
+
+
+def _fn_row(basename, box, label_dict):
+    return {
+        'Filename': basename,
+        'Predicted_class': None,
+        'TP/FP/FN': 'FN',
+        'Corrected_class': get_class_name(str(int(box[0])), label_dict),
+        'IoU': 0.0,
+        'Confidence_score': 0.0,
+        **_box_columns('Predicted', None),
+        **_box_columns('Corrected', box)
+    }
+
+
+def evaluate_image(basename:str, pred_path, corr_path, label_dict:dict, method:str='greedy') -> list:
+    """
+    Evaluates the predictions of one image against its corrected annotations.
+
+    Each prediction is evaluated as:
+        - TP (True Positive): matched with a correction of the same class with IoU ≥ 0.5
+        - FP_class: matched with a correction of another class with IoU ≥ 0.75
+        - FP (False Positive): any other prediction
+    Each correction that is not matched by a TP or FP_class prediction is a FN (False Negative).
+
+    :param basename:
+        - Type: str
+        - Description: Name of the label file ('<image_name>.txt'), stored in the 'Filename' column.
+
+    :param pred_path:
+        - Type: str or Path or numpy.ndarray or None
+        - Description: Path to the prediction file, or its (N, 6) array of boxes. If None, all corrections are FN.
+
+    :param corr_path:
+        - Type: str or Path or numpy.ndarray or None
+        - Description: Path to the correction file, or its (M, 6) array of boxes. If None, all predictions are FP.
+
+    :param label_dict:
+        - Type: dict or LabelMap
+        - Description: Dictionary mapping class IDs (as strings) to class names, or a LabelMap.
+
+    :param method:
+        - Type: str
+        - Description: Matching method, 'greedy' or 'hungarian' (see `match_boxes`).
+
+    :return:
+        - Type: list of dict
+        - Description: The evaluation rows of this image (see `results_writer.EVALUATION_COLUMNS`), with numeric
+                       relative coordinates; the empty values are None.
+    """
+    predictions = _read_boxes(pred_path)
+    corrections = _read_boxes(corr_path)
+
+    # Sort predictions by position, so the rows of an image are in reading order
+    order = np.lexsort((predictions[:, 2], predictions[:, 1]))
+    predictions = predictions[order]
+
+    rows = []
+    claimed = set()
+
+    for index, corr_index, iou in match_boxes(predictions, corrections, method):
+        pred_box = predictions[index].tolist()
+        cls_pred = int(pred_box[0])
+        cls_corr = int(corrections[corr_index, 0]) if corr_index is not None else None
+
+        if corr_index is not None and iou >= MATCH_IOU and cls_pred == cls_corr:
+            tp_fp_fn = 'TP'
+        elif corr_index is not None and iou >= CLASS_MATCH_IOU and cls_pred != cls_corr:
+            tp_fp_fn = 'FP_class'
+        else:
+            tp_fp_fn = 'FP'
+
+        if tp_fp_fn == 'FP':
+            rows.append({
+                'Filename': basename,
+                'Predicted_class': get_class_name(str(cls_pred), label_dict),
+                'TP/FP/FN': tp_fp_fn,
+                'Corrected_class': None,
+                'IoU': 0.0,
+                'Confidence_score': pred_box[5],
+                **_box_columns('Predicted', pred_box),
+                **_box_columns('Corrected', None)
+            })
+        else:
+            claimed.add(corr_index)
+            rows.append({
+                'Filename': basename,
+                'Predicted_class': get_class_name(str(cls_pred), label_dict),
+                'TP/FP/FN': tp_fp_fn,
+                'Corrected_class': get_class_name(str(cls_corr), label_dict),
+                'IoU': iou,
+                'Confidence_score': pred_box[5],
+                **_box_columns('Predicted', pred_box),
+                **_box_columns('Corrected', corrections[corr_index].tolist())
+            })
+
+    # Corrections that no prediction found
+    for corr_index, box in enumerate(corrections.tolist()):
+        if corr_index not in claimed:
+            rows.append(_fn_row(basename, box, label_dict))
+
+    return rows
+
+
+def _evaluate_image_args(args):
+    return evaluate_image(*args)
+
+
+def iter_evaluation_rows(pairs:list, label_dict:dict, method:str='greedy', workers:int=None):
+    """
+    Evaluates a set of images, spreading the per-image work across a process pool, and yields the rows of each image
+    as soon as they are ready (in the order of `pairs`), so that they can be written by chunks
+    (see `results_writer.ResultsWriter`) instead of being kept in memory.
+
+    :param pairs:
+        - Type: list of tuples
+        - Description: One tuple (basename, prediction_path, correction_path) per image; either path may be None,
+                       and paths may be replaced by arrays of boxes (see `evaluate_image`).
+
+    :param label_dict:
+        - Type: dict or LabelMap
+        - Description: Dictionary mapping class IDs (as strings) to class names, or a LabelMap.
+
+    :param method:
+        - Type: str
+        - Description: Matching method, 'greedy' or 'hungarian' (see `match_boxes`).
+
+    :param workers:
+        - Type: int
+        - Description: Number of worker processes. None uses all the CPU cores, 1 runs in the current process.
+
+    :return:
+        - Type: generator of list of dict
+        - Description: The evaluation rows of each image.
+    """
+    tasks = [(basename, pred_path, corr_path, label_dict, method) for basename, pred_path, corr_path in pairs]
+    count('images_evaluated', len(tasks))
+
+    with span('match'):
+        if workers == 1 or len(tasks) < 2:
+            yield from map(_evaluate_image_args, tasks)
+            return
+
+        workers = workers or os.cpu_count() or 1
+        chunksize = max(1, len(tasks) // (4 * workers))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(_evaluate_image_args, tasks, chunksize=chunksize)
+
+
+def evaluate_images(pairs:list, label_dict:dict, method:str='greedy', workers:int=None) -> list:
+    """
+    Evaluates a set of images, spreading the per-image work across a process pool.
+
+    :param pairs:
+        - Type: list of tuples
+        - Description: One tuple (basename, prediction_path, correction_path) per image; either path may be None,
+                       and paths may be replaced by arrays of boxes (see `evaluate_image`).
+
+    :param label_dict:
+        - Type: dict or LabelMap
+        - Description: Dictionary mapping class IDs (as strings) to class names, or a LabelMap.
+
+    :param method:
+        - Type: str
+        - Description: Matching method, 'greedy' or 'hungarian' (see `match_boxes`).
+
+    :param workers:
+        - Type: int
+        - Description: Number of worker processes. None uses all the CPU cores, 1 runs in the current process.
+
+    :return:
+        - Type: list of dict
+        - Description: The evaluation rows of all the images, in the order of `pairs`.
+    """
+    return [row for image_rows in iter_evaluation_rows(pairs, label_dict, method, workers) for row in image_rows]
+
+
+def get_store_pairs(prediction_store:dict, correction_store:dict, exclude:set=None) -> list:
+    """
+    Lists the images to evaluate from a prediction annotation store and a correction annotation store
+    (see `annotation_store`), as the pairs expected by `evaluate_images` and `iter_evaluation_rows`: images with
+    predictions first, then the images that only have corrections. The boxes are slices of the memory-mapped columns.
+
+    :param prediction_store:
+        - Type: dict
+        - Description: The opened annotation store of the predictions.
+
+    :param correction_store:
+        - Type: dict
+        - Description: The opened annotation store of the corrections.
+
+    :param exclude:
+        - Type: set of str
+        - Description: Names of the images (without extension) to leave out of the evaluation.
+
+    :return:
+        - Type: list of tuples
+        - Description: One tuple (basename, prediction boxes, correction boxes or None) per image.
+    """
+    exclude = exclude or set()
+    predicted = [name for name in prediction_store['images'] if name not in exclude]
+    corrected_only = [name for name in correction_store['images']
+                      if name not in exclude and name not in prediction_store['image_index']]
+
+    pairs = [(f"{name}.txt", get_image_boxes(prediction_store, name),
+              get_image_boxes(correction_store, name) if name in correction_store['image_index'] else None)
+             for name in predicted]
+    pairs += [(f"{name}.txt", None, get_image_boxes(correction_store, name)) for name in corrected_only]
+    return pairs
+
+
+def evaluate_stores(prediction_store:dict, correction_store:dict, label_dict:dict, method:str='greedy',
+                    workers:int=None, exclude:set=None) -> list:
+    """
+    Evaluates the predictions of an annotation store against the corrections of another annotation store
+    (see `annotation_store`). The boxes are sliced from the memory-mapped columns, no label file is parsed.
+
+    :param prediction_store:
+        - Type: dict
+        - Description: The opened annotation store of the predictions.
+
+    :param correction_store:
+        - Type: dict
+        - Description: The opened annotation store of the corrections.
+
+    :param label_dict:
+        - Type: dict or LabelMap
+        - Description: Dictionary mapping class IDs (as strings) to class names, or a LabelMap.
+
+    :param method:
+        - Type: str
+        - Description: Matching method, 'greedy' or 'hungarian' (see `match_boxes`).
+
+    :param workers:
+        - Type: int
+        - Description: Number of worker processes. None uses all the CPU cores, 1 runs in the current process.
+
+    :param exclude:
+        - Type: set of str
+        - Description: Names of the images (without extension) to leave out of the evaluation.
+
+    :return:
+        - Type: list of dict
+        - Description: The evaluation rows of all the images: images with predictions first, then the images
+                       that only have corrections (all FN).
+    """
+    pairs = get_store_pairs(prediction_store, correction_store, exclude)
+    return evaluate_images(pairs, label_dict, method=method, workers=workers)
@@ -0,0 +1,494 @@
+"""
+The following module computes the evaluation metrics of a model from the match results of notebook 5
+('results/results_for_evaluation.parquet', one row per prediction or missed correction, see `evaluation_functions`
+and `results_writer`).
+
+The results are loaded once, as typed arrays (class codes, status codes, IoU, confidence). The TP/FP/FN counts of
+all the classes are computed with grouped vectorized operations (`np.bincount`), and the predictions are sorted
+once by decreasing confidence: a cumulative sum over this order gives the full precision-recall curve of every
+class, at every IoU threshold at once. From these curves come the average precision (AP) of each class, the mAP at
+each IoU threshold, and the confidence threshold giving the best F1 score. The confusion matrix is computed from the
+same arrays, and all the reports (text, CSV, PNG) are written from the single in-memory result.
+
+A prediction is a TP at an IoU threshold when it was matched with a correction of the same class (status 'TP') with
+an IoU greater or equal to the threshold. The matching itself uses an IoU of 0.5 (see `evaluate_image`), so the
+IoU thresholds must be ≥ 0.5.
+
+Functions included:
+1. load_match_results: Loads the match results (Parquet dataset, CSV file or DataFrame) as typed arrays.
+2. average_precision: Computes the 101-point interpolated average precision of precision-recall curves.
+3. compute_metrics: Computes counts, precision-recall curves, AP/mAP, best-F1 thresholds and the confusion matrix.
+4. write_metrics_txt: Writes the text summary of the metrics.
+5. write_metrics_csv: Writes the metrics of every class as a CSV file.
+6. plot_metrics_table: Saves the table of the metrics as a PNG file.
+7. plot_pr_curves: Saves the precision-recall curves as a PNG file.
+8. plot_confusion_matrix: Saves the confusion matrix as a PNG file.
+9. write_evaluation_reports: Writes all the reports of the metrics.
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+from instrumentation import get_logger, span
+
+
+logger = get_logger('evaluation_metrics')
+
+STATUSES = ('TP', 'FP', 'FP_class', 'FN')
+TP, FP, FP_CLASS, FN = range(len(STATUSES))
+
+# COCO IoU thresholds: 0.5, 0.55, ..., 0.95
+IOU_THRESHOLDS = np.round(np.arange(0.5, 0.951, 0.05), 2)
+
+MATCH_COLUMNS = ['Predicted_class', 'TP/FP/FN', 'Corrected_class', 'IoU', 'Confidence_score']
+
+
+def load_match_results(source) -> dict:
+    """
+    Loads the match results as typed arrays. Only the columns used by the metrics are read from the file.
+
+    :param source:
+        - Type: str or Path or pandas.DataFrame
+        - Description: Path to 'results_for_evaluation.parquet' (or to a 'results_for_evaluation.csv' export),
+                       or the DataFrame of its rows.
+
+    :return:
+        - Type: dict
+        - Description: 'class_names' (sorted list of the class names found in the results),
+                       'status' (int8 array, index in STATUSES), 'predicted' and 'corrected' (int32 arrays, index in
+                       'class_names', -1 when empty), 'iou' and 'confidence' (float64 arrays).
+    """
+    import pandas as pd
+
+    if isinstance(source, pd.DataFrame):
+        df = source[MATCH_COLUMNS].replace('', np.nan)
+    elif Path(source).suffix.lower() == '.csv':
+        df = pd.read_csv(source, sep=';', usecols=MATCH_COLUMNS,
+                         dtype={'Predicted_class': str, 'Corrected_class': str, 'TP/FP/FN': str})
+    else:
+        from results_writer import read_results
+
+        df = read_results(source, columns=MATCH_COLUMNS)
+
+    class_names = sorted(set(df['Predicted_class'].dropna().unique()) | set(df['Corrected_class'].dropna().unique()))
+
+    return {
+        'class_names': class_names,
+        'status': pd.Categorical(df['TP/FP/FN'], categories=STATUSES).codes.astype(np.int8),
+        'predicted': pd.Categorical(df['Predicted_class'], categories=class_names).codes.astype(np.int32),
+        'corrected': pd.Categorical(df['Corrected_class'], categories=class_names).codes.astype(np.int32),
+        'iou': df['IoU'].to_numpy(dtype=np.float64, na_value=0.0),
+        'confidence': df['Confidence_score'].to_numpy(dtype=np.float64, na_value=0.0)
+    }
+
+
+def _ratio(numerator:np.ndarray, denominator:np.ndarray) -> np.ndarray:
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator != 0)
+
+
+def _f1(precision:np.ndarray, recall:np.ndarray) -> np.ndarray:
+    return _ratio(2 * precision * recall, precision + recall)
+
+
+def average_precision(recall:np.ndarray, precision:np.ndarray) -> np.ndarray:
+    """
+    Computes the 101-point interpolated average precision (as in COCO) of precision-recall curves.
+
+    :param recall:
+        - Type: numpy.ndarray
+        - Description: (K, T) array, the recall after each of the K predictions sorted by decreasing confidence,
+                       for T IoU thresholds.
+
+    :param precision:
+        - Type: numpy.ndarray
+        - Description: (K, T) array, the precision after each prediction.
+
+    :return:
+        - Type: numpy.ndarray
+        - Description: (T,) array, the average precision at each IoU threshold (0 when K is 0).
+    """
+    if len(recall) == 0:
+        return np.zeros(recall.shape[1])
+
+    # Precision envelope: the best precision reachable at this recall or beyond
+    envelope = np.flip(np.maximum.accumulate(np.flip(precision, axis=0), axis=0), axis=0)
+    envelope = np.vstack([envelope, np.zeros((1, envelope.shape[1]))])
+
+    points = np.linspace(0, 1, 101)
+    ap = np.empty(recall.shape[1])
+    for t in range(recall.shape[1]):
+        index = np.searchsorted(recall[:, t], points, side='left')
+        ap[t] = envelope[index, t].mean()
+    return ap
+
+
+def _curve(hits:np.ndarray, confidence:np.ndarray, support:int) -> dict:
+    true_positives = np.cumsum(hits, axis=0)
+    ranks = np.arange(1, len(hits) + 1)[:, None]
+    precision = true_positives / ranks
+    recall = true_positives / support if support else np.zeros_like(precision)
+    return {'confidence': confidence, 'precision': precision, 'recall': recall}
+
+
+def _best_f1(curve:dict) -> dict:
+    # Best F1 along the curve at the first IoU threshold
+    if len(curve['confidence']) == 0:
+        return {'f1': 0.0, 'confidence': None, 'precision': 0.0, 'recall': 0.0}
+    precision, recall = curve['precision'][:, 0], curve['recall'][:, 0]
+    f1 = _f1(precision, recall)
+    best = int(np.argmax(f1))
+    return {'f1': float(f1[best]), 'confidence': float(curve['confidence'][best]),
+            'precision': float(precision[best]), 'recall': float(recall[best])}
+
+
+def compute_metrics(results:dict, iou_thresholds=IOU_THRESHOLDS, labels:list=None) -> dict:
+    """
+    Computes all the metrics of a set of match results in one pass.
+
+    :param results:
+        - Type: dict
+        - Description: The match results (see `load_match_results`).
+
+    :param iou_thresholds:
+        - Type: sequence of float
+        - Description: IoU thresholds (≥ 0.5) of the AP (default: 0.5, 0.55, ..., 0.95).
+
+    :param labels:
+        - Type: list of str
+        - Description: Classes of the confusion matrix, in order (e.g. the names of 'labels.txt'). A 'Background'
+                       class is appended for the FP and FN. None uses the classes found in the results.
+
+    :return:
+        - Type: dict
+        - Description: 'class_names',
+                       'per_class' and 'overall' (TP, FP, FN, support, precision, recall and F1; arrays per class),
+                       'iou_thresholds', 'ap' ((n_classes, T) array, NaN for classes without corrections),
+                       'map' ((T,) array), 'map50' and 'map50_95',
+                       'curves' (per class name and 'all': confidence, precision and recall of each prediction
+                       sorted by decreasing confidence, (K, T) arrays),
+                       'best_f1' (per class name and 'all': best F1 at the first IoU threshold, with its confidence
+                       threshold, precision and recall),
+                       'confusion_matrix' ('labels' and (L, L) 'matrix', rows are corrections, columns predictions).
+    """
+    class_names = results['class_names']
+    n_classes = len(class_names)
+    status, predicted, corrected = results['status'], results['predicted'], results['corrected']
+    iou_thresholds = np.asarray(iou_thresholds, dtype=np.float64)
+    if iou_thresholds.min() < 0.5:
+        raise ValueError("The IoU thresholds must be greater or equal to 0.5, the IoU used to match the boxes")
+
+    with span('counts'):
+        has_prediction = (predicted >= 0) & (status != FN)
+        has_correction = (corrected >= 0) & ((status == FN) | (status == FP_CLASS) | (status == TP))
+        tp = np.bincount(predicted[has_prediction & (status == TP)], minlength=n_classes)
+        fp = np.bincount(predicted[has_prediction & (status != TP)], minlength=n_classes)
+        fn = np.bincount(corrected[has_correction & (status != TP)], minlength=n_classes)
+        support = tp + fn
+        precision = _ratio(tp, tp + fp)
+        recall = _ratio(tp, support)
+
+        total_tp, total_fp, total_fn = int(tp.sum()), int(fp.sum()), int(fn.sum())
+        total_precision = float(_ratio(total_tp, total_tp + total_fp))
+        total_recall = float(_ratio(total_tp, total_tp + total_fn))
+
+    with span('pr_curves'):
+        # One sort of the predictions by decreasing confidence, then a stable grouping by class keeps that order
+        prediction_index = np.flatnonzero(has_prediction)
+        order = prediction_index[np.argsort(-results['confidence'][prediction_index], kind='stable')]
+        confidence = results['confidence'][order]
+        classes = predicted[order]
+        hits = (status[order] == TP)[:, None] & (results['iou'][order][:, None] >= iou_thresholds[None, :] - 1e-9)
+
+        curves = {'all': _curve(hits, confidence, int(support.sum()))}
+        by_class = np.argsort(classes, kind='stable')
+        bounds = np.searchsorted(classes[by_class], np.arange(n_classes + 1))
+
+        ap = np.full((n_classes, len(iou_thresholds)), np.nan)
+        for class_id, class_name in enumerate(class_names):
+            rows = by_class[bounds[class_id]:bounds[class_id + 1]]
+            curve = _curve(hits[rows], confidence[rows], int(support[class_id]))
+            curves[class_name] = curve
+            if support[class_id]:
+                ap[class_id] = average_precision(curve['recall'], curve['precision'])
+
+        mean_ap = np.nanmean(ap, axis=0) if np.any(support) else np.zeros(len(iou_thresholds))
+        best_f1 = {name: _best_f1(curve) for name, curve in curves.items()}
+
+    with span('confusion_matrix'):
+        labels = list(class_names if labels is None else labels) + ['Background']
+        label_index = {name: index for index, name in enumerate(labels)}
+        background = len(labels) - 1
+        # Index -1 (no class) maps to the last entry: 'Background'; classes missing from `labels` are dropped (-1)
+        lookup = np.array([label_index.get(name, -1) for name in class_names] + [background], dtype=np.int64)
+        rows, cols = lookup[corrected], lookup[predicted]
+        kept = (rows >= 0) & (cols >= 0)
+        matrix = np.bincount(rows[kept] * len(labels) + cols[kept],
+                             minlength=len(labels) ** 2).reshape(len(labels), len(labels))
+
+    return {
+        'class_names': class_names,
+        'per_class': {'tp': tp, 'fp': fp, 'fn': fn, 'support': support,
+                      'precision': precision, 'recall': recall, 'f1': _f1(precision, recall)},
+        'overall': {'tp': total_tp, 'fp': total_fp, 'fn': total_fn, 'support': total_tp + total_fn,
+                    'precision': total_precision, 'recall': total_recall,
+                    'f1': float(_f1(np.float64(total_precision), np.float64(total_recall)))},
+        'iou_thresholds': iou_thresholds,
+        'ap': ap,
+        'map': mean_ap,
+        'map50': float(mean_ap[np.argmin(np.abs(iou_thresholds - 0.5))]),
+        'map50_95': float(mean_ap.mean()),
+        'curves': curves,
+        'best_f1': best_f1,
+        'confusion_matrix': {'labels': labels, 'matrix': matrix}
+    }
+
+
+def _format_decimals(tp:int, fp:int, fn:int, *values) -> list:
+    # As many decimals as the longest count, plus one, so that the table columns line up
+    decimals = max(len(str(tp)), len(str(fp)), len(str(fn))) + 1
+    return ["{:.{}f}".format(value, decimals) for value in values]
+
+
+def _class_rows(metrics:dict) -> list:
+    per_class = metrics['per_class']
+    rows = []
+    for class_id, class_name in enumerate(metrics['class_names']):
+        rows.append({'class_name': class_name,
+                     **{key: per_class[key][class_id].item() for key in ('tp', 'fp', 'fn', 'support', 'precision', 'recall', 'f1')},
+                     'ap50': float(metrics['ap'][class_id, 0]),
+                     'ap50_95': float(np.mean(metrics['ap'][class_id])),
+                     'best_f1': metrics['best_f1'][class_name]['f1'],
+                     'best_f1_confidence': metrics['best_f1'][class_name]['confidence']})
+    return rows
+
+
+def write_metrics_txt(metrics:dict, output_file:str) -> None:
+    """
+    Writes the text summary of the metrics: overall and per class counts, precision, recall, F1 score and support,
+    then the AP of each class, the mAP at each IoU threshold and the confidence thresholds giving the best F1.
+
+    :param metrics:
+        - Type: dict
+        - Description: The result of `compute_metrics`.
+
+    :param output_file:
+        - Type: str
+        - Description: Path to the text file.
+    """
+    overall = metrics['overall']
+    with open(output_file, 'w') as file:
+        file.write("Overall results :\n")
+        file.write("Number of TP: {}\n".format(overall['tp']))
+        file.write("Number of FP : {}\n".format(overall['fp']))
+        file.write("Number of FN: {}\n".format(overall['fn']))
+        file.write("Recall (Recall) : {}\n".format(overall['recall']))
+        file.write("Precision : {}\n".format(overall['precision']))
+        file.write("Score F1 global : {}\n".format(overall['f1']))
+        file.write(f"Support : {overall['support']}\n")
+        file.write(f"mAP@0.5 : {metrics['map50']}\n")
+        file.write(f"mAP@0.5:0.95 : {metrics['map50_95']}\n")
+        best = metrics['best_f1']['all']
+        if best['confidence'] is not None:
+            file.write(f"Best F1 : {best['f1']} (confidence ≥ {best['confidence']})\n")
+        file.write("\n")
+
+        file.write("Results per class :\n")
+        for row in _class_rows(metrics):
+            file.write("Class {}\n".format(row['class_name']))
+            file.write("Number of TP: {}\n".format(row['tp']))
+            file.write("Number of FP : {}\n".format(row['fp']))
+            file.write("Number of FN: {}\n".format(row['fn']))
+            file.write("Recall (Recall): {}\n".format(row['recall']))
+            file.write("Precision : {}\n".format(row['precision']))
+            file.write("Score F1 : {}\n".format(row['f1']))
+            file.write(f"Support : {row['support']}\n")
+            file.write(f"AP@0.5 : {row['ap50']}\n")
+            file.write(f"AP@0.5:0.95 : {row['ap50_95']}\n")
+            if row['best_f1_confidence'] is not None:
+                file.write(f"Best F1 : {row['best_f1']} (confidence ≥ {row['best_f1_confidence']})\n")
+            file.write("\n")
+
+        file.write("mAP per IoU threshold :\n")
+        for threshold, value in zip(metrics['iou_thresholds'], metrics['map']):
+            file.write(f"mAP@{threshold:.2f} : {value}\n")
+
+    logger.info(f"The {output_file} file has been created.")
+
+
+def write_metrics_csv(metrics:dict, output_file:str) -> None:
+    """
+    Writes the metrics of every class (counts, precision, recall, F1, AP@0.5, AP@0.5:0.95 and best-F1 confidence
+    threshold) as a CSV file, with a last 'Overall' row.
+
+    :param metrics:
+        - Type: dict
+        - Description: The result of `compute_metrics`.
+
+    :param output_file:
+        - Type: str
+        - Description: Path to the CSV file.
+    """
+    import pandas as pd
+
+    overall = metrics['overall']
+    rows = _class_rows(metrics)
+    rows.append({'class_name': 'Overall', **overall, 'ap50': metrics['map50'], 'ap50_95': metrics['map50_95'],
+                 'best_f1': metrics['best_f1']['all']['f1'], 'best_f1_confidence': metrics['best_f1']['all']['confidence']})
+    pd.DataFrame(rows).to_csv(output_file, sep=';', index=False)
+    logger.info(f"The {output_file} file has been created.")
+
+
+def plot_metrics_table(metrics:dict, output_file:str, show:bool=True) -> None:
+    """
+    Saves the table of the metrics (counts, precision, recall, F1 score, AP and support of every class) as a PNG file.
+
+    :param metrics:
+        - Type: dict
+        - Description: The result of `compute_metrics`.
+
+    :param output_file:
+        - Type: str
+        - Description: Path to the PNG file.
+
+    :param show:
+        - Type: bool
+        - Description: If True, the table is also displayed.
+    """
+    import matplotlib.pyplot as plt
+
+    table_data = []
+    for row in _class_rows(metrics):
+        table_data.append([row['class_name'], row['tp'], row['fp'], row['fn'],
+                           *_format_decimals(row['tp'], row['fp'], row['fn'], row['precision'], row['recall'], row['f1']),
+                           '' if np.isnan(row['ap50']) else f"{row['ap50']:.3f}", row['support']])
+    overall = metrics['overall']
+    table_data.append(['Overall', overall['tp'], overall['fp'], overall['fn'],
+                       *_format_decimals(overall['tp'], overall['fp'], overall['fn'],
+                                         overall['precision'], overall['recall'], overall['f1']),
+                       f"{metrics['map50']:.3f}", overall['support']])
+
+    fig, ax = plt.subplots()
+    ax.axis('off')
+    ax.axis('tight')
+
+    table = ax.table(cellText=table_data,
+                     colLabels=['Classes', 'Nb TP', 'Nb FP', 'Nb FN', 'Precision', 'Rappel', 'Score F1', 'AP@0.5', 'Support'],
+                     loc='center', cellLoc='center')
+    table.auto_set_font_size(False)
+    table.set_fontsize(10)
+    table.auto_set_column_width(list(range(9)))
+
+    plt.savefig(output_file, bbox_inches='tight')
+    plt.show() if show else plt.close(fig)
+    logger.info(f"The {output_file} file has been created.")
+
+
+def plot_pr_curves(metrics:dict, output_file:str, show:bool=True) -> None:
+    """
+    Saves the precision-recall curves of every class, and of all the classes together, at the first IoU threshold.
+
+    :param metrics:
+        - Type: dict
+        - Description: The result of `compute_metrics`.
+
+    :param output_file:
+        - Type: str
+        - Description: Path to the PNG file.
+
+    :param show:
+        - Type: bool
+        - Description: If True, the plot is also displayed.
+    """
+    import matplotlib.pyplot as plt
+
+    threshold = metrics['iou_thresholds'][0]
+    fig, ax = plt.subplots(figsize=(10, 8))
+    for class_id, class_name in enumerate(metrics['class_names']):
+        curve = metrics['curves'][class_name]
+        if len(curve['confidence']) and metrics['per_class']['support'][class_id]:
+            ax.plot(curve['recall'][:, 0], curve['precision'][:, 0], linewidth=1,
+                    label=f"{class_name} (AP {metrics['ap'][class_id, 0]:.3f})")
+    curve = metrics['curves']['all']
+    if len(curve['confidence']):
+        ax.plot(curve['recall'][:, 0], curve['precision'][:, 0], color='black', linewidth=2,
+                label=f"All classes (mAP {metrics['map'][0]:.3f})")
+
+    ax.set_xlim(0, 1)
+    ax.set_ylim(0, 1.05)
+    ax.set_xlabel('Recall')
+    ax.set_ylabel('Precision')
+    ax.set_title(f'Precision-recall curves (IoU ≥ {threshold:.2f})')
+    ax.legend(loc='lower left', fontsize='small')
+
+    plt.tight_layout()
+    plt.savefig(output_file)
+    plt.show() if show else plt.close(fig)
+    logger.info(f"The {output_file} file has been created.")
+
+
+def plot_confusion_matrix(metrics:dict, output_file:str, show:bool=True) -> None:
+    """
+    Saves the confusion matrix (rows are corrected classes, columns predicted classes, 'Background' for the FP and FN).
+
+    :param metrics:
+        - Type: dict
+        - Description: The result of `compute_metrics`.
+
+    :param output_file:
+        - Type: str
+        - Description: Path to the PNG file.
+
+    :param show:
+        - Type: bool
+        - Description: If True, the plot is also displayed.
+    """
+    import matplotlib.pyplot as plt
+    from sklearn import metrics as sklearn_metrics
+
+    confusion_matrix = metrics['confusion_matrix']
+    cm_display = sklearn_metrics.ConfusionMatrixDisplay(confusion_matrix=confusion_matrix['matrix'],
+                                                        display_labels=confusion_matrix['labels'])
+
+    fig, ax = plt.subplots(figsize=(10, 8))
+    cm_display.plot(ax=ax, xticks_rotation=90, cmap='autumn', values_format='d')
+    plt.title('Confusion matrice')
+
+    plt.tight_layout()
+    plt.savefig(output_file)
+    plt.show() if show else plt.close(fig)
+    logger.info(f"The {output_file} file has been created.")
+
+
+def write_evaluation_reports(metrics:dict, results_folder:str, show:bool=True) -> None:
+    """
+    Writes all the reports of the metrics in the 'results' folder of a prediction run:
+        - results_for_evaluation.txt: text summary (see `write_metrics_txt`)
+        - results_for_evaluation.png: table of the metrics
+        - metrics_per_class.csv: metrics of every class
+        - pr_curves.png: precision-recall curves
+        - confusion_matrix.png: confusion matrix
+
+    :param metrics:
+        - Type: dict
+        - Description: The result of `compute_metrics`.
+
+    :param results_folder:
+        - Type: str
+        - Description: Path to the 'results' folder.
+
+    :param show:
+        - Type: bool
+        - Description: If True, the plots are also displayed.
+    """
+    results_folder = Path(results_folder)
+    results_folder.mkdir(parents=True, exist_ok=True)
+
+    with span('reports'):
+        write_metrics_txt(metrics, results_folder / 'results_for_evaluation.txt')
+        write_metrics_csv(metrics, results_folder / 'metrics_per_class.csv')
+        plot_metrics_table(metrics, results_folder / 'results_for_evaluation.png', show)
+        plot_pr_curves(metrics, results_folder / 'pr_curves.png', show)
+        plot_confusion_matrix(metrics, results_folder / 'confusion_matrix.png', show)
@@ -0,0 +1,242 @@
+"""
+The following module indexes the files of a folder by stem (file name without extension), so that images, predictions
+and corrections can be joined with dictionary lookups instead of scanning lists or probing the file system
+for each image.
+
+Each folder is listed with a single `os.scandir` walk. The hidden-file rules of `process_images_with_yolo` are applied:
+hidden files and the content of hidden folders (names starting with '.') are ignored.
+
+`IMG_EXTS` is the set of image extensions listed by all the stages (extraction, statistics, split, cache, inference):
+'.tif' and '.tiff' pages are images like the others.
+
+Functions included:
+1. FileIndex: A mapping from file stems to file paths.
+2. scan_folder: Lists the files of a folder in one `os.scandir` walk.
+3. index_folder: Indexes the files of a folder by stem.
+4. get_folder_index: Returns the index of a folder, listed again only when the folder changed.
+5. join_indexes: Joins two indexes on the file stems.
+"""
+
+import os
+
+from instrumentation import count, get_logger, span
+
+
+logger = get_logger('file_index')
+
+# Extensions of the image files, in lower case
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".tif", ".tiff"}
+
+_folder_indexes = {}
+
+
+class FileIndex:
+    """
+    A mapping from file stems to file paths, built by `index_folder`. `get(stem)` and `stem in index` are
+    dictionary lookups.
+
+    When several files share a stem (e.g. 'page.jpg' and 'page.png', or two sub-folders with a 'page.jpg'),
+    the first path in sorted order is indexed and the others are kept in `duplicates`.
+
+    :param paths:
+        - Type: dict
+        - Description: A dictionary mapping file stems to file paths.
+
+    :param duplicates:
+        - Type: dict
+        - Description: A dictionary mapping the stems shared by several files to the paths that were not indexed.
+    """
+
+    def __init__(self, paths:dict=None, duplicates:dict=None):
+        self._paths = dict(paths or {})
+        self.duplicates = dict(duplicates or {})
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __contains__(self, stem):
+        return stem in self._paths
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def __repr__(self):
+        return f"FileIndex({len(self._paths)} files)"
+
+    def get(self, stem:str, default=None) -> str:
+        """
+        Returns the path of the file with this stem, or `default` if there is none.
+        """
+        return self._paths.get(stem, default)
+
+    def stems(self) -> list:
+        """
+        Returns the indexed stems, sorted.
+        """
+        return sorted(self._paths)
+
+    def paths(self) -> list:
+        """
+        Returns the indexed paths, sorted by stem.
+        """
+        return [self._paths[stem] for stem in sorted(self._paths)]
+
+    def items(self):
+        """
+        Returns the (stem, path) pairs.
+        """
+        return self._paths.items()
+
+    def exclude(self, stems) -> 'FileIndex':
+        """
+        Returns a new FileIndex without the files whose stem is in `stems` (any iterable, read once into a set).
+        """
+        stems = set(stems)
+        return FileIndex({stem: path for stem, path in self._paths.items() if stem not in stems},
+                         {stem: paths for stem, paths in self.duplicates.items() if stem not in stems})
+
+
+def scan_folder(folder:str, extensions:set=None, recursive:bool=False) -> list:
+    """
+    Lists the files of a folder in one `os.scandir` walk. Hidden files and hidden folders (names starting with '.')
+    are ignored, as well as the content of hidden folders.
+
+    :param folder:
+        - Type: str or Path
+        - Description: Path to the folder. A missing folder has no files.
+
+    :param extensions:
+        - Type: set of str
+        - Description: Lower-case extensions to keep (e.g. {'.jpg', '.png'}). None keeps all the files.
+
+    :param recursive:
+        - Type: bool
+        - Description: If True, the sub-folders are listed too.
+
+    :return:
+        - Type: list of str
+        - Description: The paths of the files, in the order of the walk (not sorted).
+    """
+    files = []
+    folders = [str(folder)]
+
+    while folders:
+        try:
+            entries = os.scandir(folders.pop())
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    if recursive:
+                        folders.append(entry.path)
+                elif entry.is_file() and (extensions is None or os.path.splitext(entry.name)[1].lower() in extensions):
+                    files.append(entry.path)
+
+    return files
+
+
+def index_folder(folder:str, extensions:set=None, recursive:bool=False) -> FileIndex:
+    """
+    Indexes the files of a folder by stem, with a single walk of the folder (see `scan_folder`).
+
+    :param folder:
+        - Type: str or Path
+        - Description: Path to the folder. A missing folder gives an empty index.
+
+    :param extensions:
+        - Type: set of str
+        - Description: Lower-case extensions to keep (e.g. {'.txt'}). None keeps all the files.
+
+    :param recursive:
+        - Type: bool
+        - Description: If True, the files of the sub-folders are indexed too.
+
+    :return:
+        - Type: FileIndex
+    """
+    paths, duplicates = {}, {}
+
+    with span('index_files'):
+        files = sorted(scan_folder(folder, extensions, recursive))
+        for path in files:
+            stem = os.path.splitext(os.path.basename(path))[0]
+            if stem in paths:
+                duplicates.setdefault(stem, []).append(path)
+            else:
+                paths[stem] = path
+    count('files_indexed', len(files))
+
+    if duplicates:
+        logger.debug(f"{len(duplicates)} file name(s) used several times in {folder}, the first file is indexed")
+
+    return FileIndex(paths, duplicates)
+
+
+def get_folder_index(folder:str, extensions:set=None) -> FileIndex:
+    """
+    Returns the index of the files of a folder (not recursive), kept in memory between calls.
+    The folder is listed again only when its modification time changed, i.e. when files were added,
+    removed or renamed, so looking up many files of the same folder costs one `stat` call per lookup.
+
+    :param folder:
+        - Type: str or Path
+        - Description: Path to the folder.
+
+    :param extensions:
+        - Type: set of str
+        - Description: Lower-case extensions to keep. None keeps all the files.
+
+    :return:
+        - Type: FileIndex
+    """
+    key = (os.path.abspath(folder), frozenset(extensions) if extensions is not None else None)
+    try:
+        mtime_ns = os.stat(folder).st_mtime_ns
+    except OSError:
+        _folder_indexes.pop(key, None)
+        return FileIndex()
+
+    cached = _folder_indexes.get(key)
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+
+    index = index_folder(folder, extensions)
+    _folder_indexes[key] = (mtime_ns, index)
+    return index
+
+
+def join_indexes(left:FileIndex, right:FileIndex, how:str='outer') -> list:
+    """
+    Joins two indexes on the file stems, in a single pass over each index.
+
+    :param left:
+        - Type: FileIndex
+        - Description: First index (e.g. the predictions).
+
+    :param right:
+        - Type: FileIndex
+        - Description: Second index (e.g. the corrections).
+
+    :param how:
+        - Type: str
+        - Description: 'outer' (every stem of either index, default), 'left' (the stems of `left`),
+                       or 'inner' (the stems of both indexes).
+
+    :return:
+        - Type: list of tuples
+        - Description: One (stem, left_path, right_path) tuple per stem, sorted by stem. A path is None when
+                       the stem is missing from its index.
+    """
+    if how == 'outer':
+        stems = set(left) | set(right)
+    elif how == 'left':
+        stems = set(left)
+    elif how == 'inner':
+        stems = set(left) & set(right)
+    else:
+        raise ValueError(f"Unknown join '{how}', use 'outer', 'left' or 'inner'")
+
+    return [(stem, left.get(stem), right.get(stem)) for stem in sorted(stems)]
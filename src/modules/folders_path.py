@@ -9,6 +9,14 @@ Functions included:
 3. ground_truth_folder_training: Returns the path to the folder containing annotation files.
 4. corrections_folder_inference: Returns the path to the folder containing correction files.
 5. get_results_folder: Constructs and returns the path to the results folder based on the provided YOLO model and image dataset folders.
+6. get_image_metadata_file: Returns the path to the image metadata index of the project.
+7. get_ground_truth_manifest_file: Returns the path to the manifest of the ground-truth annotation IDs.
+8. get_ground_truth_journal_file: Returns the path to the journal of the moves into the ground truth.
+9. get_image_cache_folder: Returns the path to the cache of resized training images.
+10. get_image_hash_file: Returns the path to the perceptual hash index of the project images.
+11. get_blob_store_folder: Returns the path to the content-addressed store of the images.
+12. get_training_queue_file: Returns the path to the queue (and run registry) of the training jobs.
+13. get_ls_sync_file: Returns the path to the state of the synchronizations with the Label Studio API.
 """
 
 from pathlib import Path
@@ -150,3 +158,148 @@ def get_correctedLabels_folder(project_folder:str, yolo_model_folder:str) -> str
     correctedLabels_folder = runs_folder / 'predict' / f"{project_name}_{model_name}" / 'correctedLabels'
     
     return str(correctedLabels_folder)
+
+
+def get_image_metadata_file(project_folder:str) -> str:
+    """
+    This function recomposes the path to the SQLite index storing the metadata (format, width, height)
+    of the project images, shared by all the stages of the pipeline.
+
+    :param project_folder:
+        - Type: str
+        - Description: Absolute path to the folder named after your project.
+
+    :return:
+        - Type: str
+        - Description: Absolute path to the 'image_metadata.sqlite' file in the 'image_inputs' folder.
+    """
+
+    metadata_file = Path(project_folder) / 'image_inputs' / 'image_metadata.sqlite'
+    return str(metadata_file)
+
+
+def get_ground_truth_manifest_file(project_folder:str) -> str:
+    """
+    This function recomposes the path to the manifest keeping the next free ID of the ground-truth annotation files
+    (see `ground_truth_manifest`).
+
+    :param project_folder:
+        - Type: str
+        - Description: Absolute path to the folder named after your project.
+
+    :return:
+        - Type: str
+        - Description: Absolute path to the 'ground_truth_manifest.json' file in the 'annotations' folder.
+    """
+
+    manifest_file = Path(project_folder) / 'annotations' / 'ground_truth_manifest.json'
+    return str(manifest_file)
+
+
+def get_ground_truth_journal_file(project_folder:str) -> str:
+    """
+    This function recomposes the path to the journal of the move of the corrections into the ground truth,
+    which only exists while a move is being committed (see `ground_truth_manifest`).
+
+    :param project_folder:
+        - Type: str
+        - Description: Absolute path to the folder named after your project.
+
+    :return:
+        - Type: str
+        - Description: Absolute path to the 'ground_truth_journal.json' file in the 'annotations' folder.
+    """
+
+    journal_file = Path(project_folder) / 'annotations' / 'ground_truth_journal.json'
+    return str(journal_file)
+
+
+def get_image_cache_folder(project_folder:str) -> str:
+    """
+    This function recomposes the path to the cache of the training images resized to the training image size
+    (see `training_cache`), kept between training sessions.
+
+    :param project_folder:
+        - Type: str
+        - Description: Absolute path to the folder named after your project.
+
+    :return:
+        - Type: str
+        - Description: Absolute path to the 'image_cache' folder in the data folder of the project.
+    """
+
+    cache_folder = Path(get_data_folder(project_folder)) / 'image_cache'
+    return str(cache_folder)
+
+
+def get_image_hash_file(project_folder:str) -> str:
+    """
+    This function recomposes the path to the SQLite index storing the perceptual hash of the project images,
+    used to find the near-duplicate images (see `near_duplicates`).
+
+    :param project_folder:
+        - Type: str
+        - Description: Absolute path to the folder named after your project.
+
+    :return:
+        - Type: str
+        - Description: Absolute path to the 'image_hashes.sqlite' file in the 'image_inputs' folder.
+    """
+
+    hash_file = Path(project_folder) / 'image_inputs' / 'image_hashes.sqlite'
+    return str(hash_file)
+
+
+def get_blob_store_folder(project_folder:str) -> str:
+    """
+    This function recomposes the path to the content-addressed store of the images (see `blob_store`). The store is
+    shared by all the projects of the same root folder, next to their data folders, so that the images of the project
+    folders and of the data folders are hard links to the same files.
+
+    :param project_folder:
+        - Type: str
+        - Description: Absolute path to the folder named after your project.
+
+    :return:
+        - Type: str
+        - Description: Absolute path to the '.blob_store' folder in the 'data' folder of the root folder.
+    """
+
+    store_folder = Path(get_data_folder(project_folder)).parent / '.blob_store'
+    return str(store_folder)
+
+
+def get_training_queue_file(project_folder:str) -> str:
+    """
+    This function recomposes the path to the SQLite queue of the training jobs, which is also the registry of the
+    training runs (see `training_queue`). It is stored with the models, in the training output folder.
+
+    :param project_folder:
+        - Type: str
+        - Description: Absolute path to the folder named after your project.
+
+    :return:
+        - Type: str
+        - Description: Absolute path to the 'training_queue.sqlite' file in the 'output/runs/train' folder.
+    """
+
+    queue_file = Path(project_folder).parent / 'output' / 'runs' / 'train' / 'training_queue.sqlite'
+    return str(queue_file)
+
+
+def get_ls_sync_file(project_folder:str) -> str:
+    """
+    This function recomposes the path to the state of the synchronizations with the Label Studio API: the time of the
+    last annotations pulled from each Label Studio project (see `ls_client`).
+
+    :param project_folder:
+        - Type: str
+        - Description: Absolute path to the folder named after your project.
+
+    :return:
+        - Type: str
+        - Description: Absolute path to the 'ls_sync_state.json' file in the 'annotations' folder.
+    """
+
+    sync_file = Path(project_folder) / 'annotations' / 'ls_sync_state.json'
+    return str(sync_file)
@@ -0,0 +1,261 @@
+"""
+The following module moves the evaluation images and their correction files into the ground truth of a project,
+as one transaction.
+
+The ground-truth annotation files are named after an integer ID ('annotations/ground_truth/<id>'), which is also
+their 'id' field. A manifest ('annotations/ground_truth_manifest.json') keeps the next free ID, so that a batch of
+IDs is handed out without looking for free file names. The manifest records the modification time of the
+ground-truth folder: if the folder was changed by hand since, the next free ID is computed again from the folder,
+once.
+
+A move is done in three steps:
+1. Staging: each correction file is read once, its 'id' field is set to its new ID, and it is written to a hidden
+   staging folder inside the ground-truth folder ('.staging'). Nothing is moved yet.
+2. Journal: the list of the renames to do (staged annotations, images) is written atomically to
+   'annotations/ground_truth_journal.json'. Once the journal exists, the move is committed.
+3. Commit: the staged files are renamed to their final names (atomic renames on the same file system), the images are
+   moved, the correction files are removed, then the manifest is updated and the journal removed.
+
+If the process stops during step 1, the staging folder is discarded at the next move and the sources are untouched.
+If it stops during step 3, the next move (or `recover_ground_truth_move`) finishes the renames of the journal first.
+
+Functions included:
+1. load_ground_truth_manifest: Reads the manifest, rebuilt from the ground-truth folder if it is missing or stale.
+2. allocate_ground_truth_ids: Hands out the next free IDs.
+3. recover_ground_truth_move: Finishes a move interrupted during its commit.
+4. move_corrections_to_ground_truth: Moves the evaluation images and the correction files into the ground truth.
+"""
+
+import json
+import os
+import shutil
+from pathlib import Path
+
+from file_index import IMG_EXTS, scan_folder
+from instrumentation import count, get_logger, span
+
+
+logger = get_logger('ground_truth')
+
+MANIFEST_VERSION = 1
+
+STAGING_FOLDER = '.staging'
+
+
+def _write_json_atomic(json_file:Path, data:dict, indent:int=2) -> None:
+    tmp_file = json_file.with_name(json_file.name + '.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, json_file)
+
+
+def _folder_mtime_ns(folder:Path) -> int:
+    try:
+        return os.stat(folder).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def load_ground_truth_manifest(manifest_file:str, ground_truth_folder:str) -> dict:
+    """
+    Reads the ground-truth manifest. If it does not exist, was written by another version, or the ground-truth folder
+    was modified since it was written, the next free ID is computed again from the file names of the folder
+    (the largest integer name plus one).
+
+    :param manifest_file:
+        - Type: str
+        - Description: Path to the manifest JSON file (see `folders_path.get_ground_truth_manifest_file`).
+
+    :param ground_truth_folder:
+        - Type: str
+        - Description: Path to the folder containing the ground-truth annotation files.
+
+    :return:
+        - Type: dict
+        - Description: The manifest: {'version', 'next_id', 'files' (number of annotation files),
+                       'folder_mtime_ns' (modification time of the folder when the manifest was written)}.
+    """
+    manifest = {}
+    if Path(manifest_file).exists():
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    mtime_ns = _folder_mtime_ns(Path(ground_truth_folder))
+    if manifest.get('version') == MANIFEST_VERSION and manifest.get('folder_mtime_ns') == mtime_ns:
+        return manifest
+
+    # Missing or stale manifest: one walk of the folder
+    with span('scan_ids'):
+        names = [Path(path).stem for path in scan_folder(ground_truth_folder)]
+    ids = [int(name) for name in names if name.isdigit()]
+    count('files_scanned', len(names))
+
+    return {'version': MANIFEST_VERSION, 'next_id': max(ids, default=0) + 1, 'files': len(names),
+            'folder_mtime_ns': mtime_ns}
+
+
+def allocate_ground_truth_ids(manifest:dict, n:int) -> list:
+    """
+    Hands out the next `n` free IDs of a manifest, and moves its 'next_id' past them. The manifest is only modified
+    in memory: it is saved when the move using the IDs is committed.
+
+    :param manifest:
+        - Type: dict
+        - Description: The manifest (see `load_ground_truth_manifest`).
+
+    :param n:
+        - Type: int
+        - Description: Number of IDs.
+
+    :return:
+        - Type: list of int
+    """
+    first_id = manifest['next_id']
+    manifest['next_id'] = first_id + n
+    return list(range(first_id, first_id + n))
+
+
+def _move(source:str, destination:str) -> None:
+    try:
+        # Atomic on the same file system
+        os.replace(source, destination)
+    except OSError:
+        shutil.move(source, destination)
+
+
+def _commit(journal_file:Path, journal:dict) -> None:
+    for source, destination in journal['annotations'] + journal['images']:
+        # Renames already done before an interruption are skipped
+        if os.path.exists(source):
+            _move(source, destination)
+    for source in journal['sources']:
+        if os.path.exists(source):
+            os.remove(source)
+
+    ground_truth_folder = Path(journal['ground_truth_folder'])
+    shutil.rmtree(ground_truth_folder / STAGING_FOLDER, ignore_errors=True)
+
+    manifest = journal['manifest']
+    manifest['folder_mtime_ns'] = _folder_mtime_ns(ground_truth_folder)
+    _write_json_atomic(Path(journal['manifest_file']), manifest)
+    journal_file.unlink()
+
+
+def recover_ground_truth_move(journal_file:str) -> bool:
+    """
+    Finishes a move interrupted during its commit: the renames recorded in the journal that were not done yet are
+    done, then the manifest is saved and the journal removed. Does nothing if there is no journal.
+
+    :param journal_file:
+        - Type: str
+        - Description: Path to the journal (see `folders_path.get_ground_truth_journal_file`).
+
+    :return:
+        - Type: bool
+        - Description: True if an interrupted move was finished.
+    """
+    journal_file = Path(journal_file)
+    if not journal_file.exists():
+        return False
+
+    with open(journal_file, 'r', encoding='utf-8') as f:
+        journal = json.load(f)
+
+    logger.warning(f"Finishing the interrupted move of {len(journal['annotations'])} annotation(s) "
+                   f"and {len(journal['images'])} image(s) recorded in {journal_file}")
+    _commit(journal_file, journal)
+    return True
+
+
+def move_corrections_to_ground_truth(eval_folder:str, corrections_folder:str, ground_truth_img_folder:str,
+                                     ground_truth_folder:str, manifest_file:str, journal_file:str,
+                                     img_exts:set=None) -> dict:
+    """
+    Moves the evaluation images into the ground-truth image folder, and the correction files into the ground-truth
+    annotation folder under new IDs, as one transaction (see the module description). The 'id' field of each
+    correction is set to its new ID while it is moved.
+
+    :param eval_folder:
+        - Type: str
+        - Description: Path to the folder containing the evaluation images.
+
+    :param corrections_folder:
+        - Type: str
+        - Description: Path to the folder containing the Label Studio correction files (JSON).
+
+    :param ground_truth_img_folder:
+        - Type: str
+        - Description: Path to the ground-truth image folder. Images with the same name are replaced.
+
+    :param ground_truth_folder:
+        - Type: str
+        - Description: Path to the ground-truth annotation folder.
+
+    :param manifest_file:
+        - Type: str
+        - Description: Path to the ground-truth manifest.
+
+    :param journal_file:
+        - Type: str
+        - Description: Path to the journal of the move.
+
+    :param img_exts:
+        - Type: set of str
+        - Description: Lower-case extensions of the images to move. None moves the image files (see `file_index.IMG_EXTS`).
+
+    :return:
+        - Type: dict
+        - Description: {'images': number of images moved, 'annotations': number of correction files moved,
+                       'ids': the IDs given to the correction files, in the order of their sorted names}.
+    """
+    img_exts = img_exts or IMG_EXTS
+    ground_truth_img_folder, ground_truth_folder = Path(ground_truth_img_folder), Path(ground_truth_folder)
+    ground_truth_img_folder.mkdir(parents=True, exist_ok=True)
+    ground_truth_folder.mkdir(parents=True, exist_ok=True)
+
+    recover_ground_truth_move(journal_file)
+
+    # Leftovers of a move interrupted before its journal was written: the sources were not touched
+    staging_folder = ground_truth_folder / STAGING_FOLDER
+    shutil.rmtree(staging_folder, ignore_errors=True)
+
+    images = sorted(scan_folder(eval_folder, img_exts))
+    corrections = sorted(scan_folder(corrections_folder))
+    if not images and not corrections:
+        return {'images': 0, 'annotations': 0, 'ids': []}
+
+    manifest = load_ground_truth_manifest(manifest_file, ground_truth_folder)
+    ids = allocate_ground_truth_ids(manifest, len(corrections))
+    manifest['files'] += len(corrections)
+
+    # 1. Staging: each correction is read and written once, with its new ID
+    staging_folder.mkdir()
+    annotations = []
+    with span('stage'):
+        for correction_file, annotation_id in zip(corrections, ids):
+            with open(correction_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            data['id'] = str(annotation_id)
+
+            staged_file = staging_folder / str(annotation_id)
+            with open(staged_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            annotations.append((str(staged_file), str(ground_truth_folder / str(annotation_id))))
+
+    # 2. Journal: from here on, the move is committed
+    journal = {'ground_truth_folder': str(ground_truth_folder), 'manifest_file': str(manifest_file),
+               'manifest': manifest, 'annotations': annotations, 'sources': corrections,
+               'images': [(path, str(ground_truth_img_folder / os.path.basename(path))) for path in images]}
+    _write_json_atomic(Path(journal_file), journal)
+
+    # 3. Commit
+    with span('commit'):
+        _commit(Path(journal_file), journal)
+    count('annotations_moved', len(corrections))
+    count('images_moved', len(images))
+
+    return {'images': len(images), 'annotations': len(corrections), 'ids': ids}
@@ -0,0 +1,271 @@
+"""
+The following module provides a persistent index of image metadata (format, width, height), shared by all
+the stages of the pipeline. The index is a SQLite database keyed by the absolute path of each image, and
+every entry records the size and modification time of the file it was read from: an image header is only
+read again when the file is new or has changed. Headers are read in parallel with PIL, which only decodes
+the header of the file, not the pixels.
+
+The CSV files with image data (`<project>_data.csv` in 'ground_truth_images' and `<project>.csv` in
+'eval_images') are generated from this index.
+
+Functions included:
+1. refresh_image_metadata: Updates the index for a folder (only new or changed images are read) and returns its entries.
+2. get_image_metadata: Returns the metadata of a single image, reading it only if it is not indexed yet.
+3. get_image_size: Returns the (width, height) of an image from the index.
+4. metadata_to_rows: Converts index entries into the rows of the image data CSV files.
+5. write_metadata_csv: Writes the image data CSV file of a list of index entries.
+"""
+
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from file_index import IMG_EXTS, scan_folder
+from instrumentation import count, get_logger, span
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path     TEXT PRIMARY KEY,
+    name     TEXT NOT NULL,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    format   TEXT,
+    width    INTEGER,
+    height   INTEGER
+);
+CREATE INDEX IF NOT EXISTS images_by_file ON images (name, size, mtime_ns);
+"""
+
+
+def _connect(db_path) -> sqlite3.Connection:
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(str(db_path))
+    connection.row_factory = sqlite3.Row
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def _read_header(img_path:str) -> tuple:
+    from PIL import Image
+
+    try:
+        with Image.open(img_path) as img:
+            width, height = img.size
+            return img.format, width, height
+    except Exception as e:
+        get_logger('image_metadata').warning(f"Failed to read image {Path(img_path).name}: {e}")
+        return None
+
+
+def _list_folder(img_folder:Path, recursive:bool) -> list:
+    return [Path(path) for path in scan_folder(img_folder, IMG_EXTS, recursive=recursive)]
+
+
+def _index_images(connection:sqlite3.Connection, img_paths:list, workers:int) -> dict:
+    """
+    Makes sure every image of `img_paths` has an up-to-date entry in the index and returns the entries by path.
+    """
+    entries = {}
+    to_read = []
+
+    for img_path in img_paths:
+        path = str(Path(img_path).resolve())
+        stat = os.stat(path)
+        row = connection.execute("SELECT * FROM images WHERE path = ?", (path,)).fetchone()
+        if row is not None and row['size'] == stat.st_size and row['mtime_ns'] == stat.st_mtime_ns:
+            entries[path] = dict(row)
+            continue
+
+        # A file moved from another indexed folder keeps its name, size and modification time
+        moved = connection.execute(
+            "SELECT * FROM images WHERE name = ? AND size = ? AND mtime_ns = ? AND format IS NOT NULL LIMIT 1",
+            (Path(path).name, stat.st_size, stat.st_mtime_ns)).fetchone()
+        if moved is not None:
+            entry = dict(moved)
+            entry['path'] = path
+            entries[path] = entry
+            connection.execute("INSERT OR REPLACE INTO images VALUES (:path, :name, :size, :mtime_ns, :format, :width, :height)", entry)
+            continue
+
+        to_read.append((path, stat))
+
+    count('headers_cached', len(entries))
+    count('headers_read', len(to_read))
+    if to_read:
+        with span('read_headers'), ThreadPoolExecutor(max_workers=workers) as executor:
+            headers = executor.map(_read_header, [path for path, _ in to_read])
+            for (path, stat), header in zip(to_read, headers):
+                img_format, width, height = header if header else (None, None, None)
+                entry = {'path': path, 'name': Path(path).name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                         'format': img_format, 'width': width, 'height': height}
+                connection.execute("INSERT OR REPLACE INTO images VALUES (:path, :name, :size, :mtime_ns, :format, :width, :height)", entry)
+                entries[path] = entry
+
+    connection.commit()
+    return entries
+
+
+def refresh_image_metadata(img_folder:str, db_path:str, recursive:bool=False, workers:int=8) -> list:
+    """
+    Updates the metadata index for all the images of a folder and returns their entries.
+
+    Only new or changed images (different size or modification time) have their header read, in parallel.
+    Entries of images that no longer exist in the folder are removed from the index.
+    Hidden files and images inside hidden directories (whose names start with '.') are ignored.
+
+    :param img_folder:
+        - Type: str
+        - Description: Path to the folder containing the images.
+
+    :param db_path:
+        - Type: str
+        - Description: Path to the SQLite metadata index (created if it does not exist).
+
+    :param recursive:
+        - Type: bool
+        - Description: If True, images in subfolders are indexed too.
+
+    :param workers:
+        - Type: int
+        - Description: Number of threads used to read the image headers.
+
+    :return:
+        - Type: list of dict
+        - Description: One entry per readable image, sorted by path, with the keys
+                       'path', 'name', 'size', 'mtime_ns', 'format', 'width' and 'height'.
+    """
+    img_folder = Path(img_folder)
+    if not img_folder.exists():
+        raise FileNotFoundError(f"Image folder not found: {img_folder}")
+
+    with span('list'):
+        img_paths = _list_folder(img_folder, recursive)
+    count('files_scanned', len(img_paths))
+
+    connection = _connect(db_path)
+    try:
+        with span('index'):
+            entries = _index_images(connection, img_paths, workers)
+
+        # Forget the images that were removed from the folder
+        prefix = str(img_folder.resolve()).rstrip(os.sep) + os.sep
+        indexed = connection.execute("SELECT path FROM images WHERE substr(path, 1, ?) = ?", (len(prefix), prefix)).fetchall()
+        removed = [(row['path'],) for row in indexed
+                   if row['path'] not in entries and (recursive or str(Path(row['path']).parent) + os.sep == prefix)]
+        if removed:
+            connection.executemany("DELETE FROM images WHERE path = ?", removed)
+            connection.commit()
+    finally:
+        connection.close()
+
+    return [entries[path] for path in sorted(entries) if entries[path]['format'] is not None]
+
+
+def get_image_metadata(img_path:str, db_path:str) -> dict:
+    """
+    Returns the metadata of a single image from the index. The image header is only read if the image
+    is not indexed yet or has changed since it was indexed.
+
+    :param img_path:
+        - Type: str
+        - Description: Path to the image.
+
+    :param db_path:
+        - Type: str
+        - Description: Path to the SQLite metadata index.
+
+    :return:
+        - Type: dict
+        - Description: The index entry of the image ('path', 'name', 'size', 'mtime_ns', 'format', 'width', 'height').
+                       'format', 'width' and 'height' are None if the image could not be read.
+    """
+    connection = _connect(db_path)
+    try:
+        entries = _index_images(connection, [img_path], workers=1)
+    finally:
+        connection.close()
+
+    return next(iter(entries.values()))
+
+
+def get_image_size(img_path:str, db_path:str) -> tuple:
+    """
+    Returns the dimensions of an image, from the metadata index.
+
+    :param img_path:
+        - Type: str
+        - Description: Path to the image.
+
+    :param db_path:
+        - Type: str
+        - Description: Path to the SQLite metadata index.
+
+    :return:
+        - Type: tuple of int
+        - Description: (width, height) of the image in pixels.
+    """
+    entry = get_image_metadata(img_path, db_path)
+    if entry['format'] is None:
+        raise OSError(f"Could not read image {img_path}")
+    return entry['width'], entry['height']
+
+
+def metadata_to_rows(entries:list, folder:str=None) -> list:
+    """
+    Converts metadata index entries into the rows of the image data CSV files.
+
+    :param entries:
+        - Type: list of dict
+        - Description: Index entries, as returned by `refresh_image_metadata`.
+
+    :param folder:
+        - Type: str
+        - Description: Value of the 'Folder' column. If None, the parent folder of each image is used.
+
+    :return:
+        - Type: list of dict
+        - Description: One row per image with the columns Image_name, Folder, Absolute_path, Format, Width,
+                       Height and Image_size (width × height).
+    """
+    return [_metadata_row(entry, folder) for entry in entries]
+
+
+def _metadata_row(entry:dict, folder:str=None) -> dict:
+    path = Path(entry['path'])
+    return {
+        'Image_name': path.stem,
+        'Folder': folder if folder is not None else str(path.parent),
+        'Absolute_path': str(path),
+        'Format': entry['format'],
+        'Width': entry['width'],
+        'Height': entry['height'],
+        'Image_size': int(entry['width']) * int(entry['height'])
+    }
+
+
+def write_metadata_csv(entries:list, csv_file:str, folder:str=None) -> None:
+    """
+    Writes the image data CSV file (';' separated) of a list of metadata index entries.
+    The rows are written one by one, without building a DataFrame of the whole folder.
+
+    :param entries:
+        - Type: list of dict
+        - Description: Index entries, as returned by `refresh_image_metadata`.
+
+    :param csv_file:
+        - Type: str
+        - Description: Path to the CSV file to write.
+
+    :param folder:
+        - Type: str
+        - Description: Value of the 'Folder' column. If None, the parent folder of each image is used.
+    """
+    import csv
+
+    columns = ['Image_name', 'Folder', 'Absolute_path', 'Format', 'Width', 'Height', 'Image_size']
+    with open(csv_file, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, delimiter=';', lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(_metadata_row(entry, folder) for entry in entries)
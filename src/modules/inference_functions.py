@@ -0,0 +1,252 @@
+"""
+The following module provides functions for running a YOLO model over a large set of images.
+The model is loaded once per run and the images are sent to the model in batches: while a batch
+is being predicted, the next one is decoded on a thread pool, and the label files are written
+by a background thread. The phases of a run (list, decode, forward, postprocess, write) and its counters
+are reported to `instrumentation`.
+
+Functions included:
+1. list_images: Recursively lists the image files of a folder, ignoring hidden files and folders.
+2. load_yolo_model: Loads (once per process) the 'weights/best.pt' model of a YOLO model folder.
+3. read_images: Starts decoding a list of images with OpenCV on a thread pool.
+4. format_yolo_predictions: Formats the boxes of a YOLO result as lines of a YOLO label file.
+5. predict_images_in_batches: Runs the model over a list of images and writes one label file per image.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+from file_index import IMG_EXTS, scan_folder
+from instrumentation import count, get_logger, span
+
+
+logger = get_logger('inference')
+
+
+def list_images(img_folder) -> list:
+    """
+    Recursively lists the image files (.jpg, .jpeg, .png, .tif, .tiff) of a folder.
+    Hidden files and images located inside hidden directories (whose names start with '.') are ignored.
+
+    :param img_folder:
+        - Type: str or Path
+        - Description: Path to the folder containing the images.
+
+    :return:
+        - Type: list of Path
+        - Description: The sorted list of image paths.
+    """
+    with span('list'):
+        # A single os.scandir walk: no stat call per path, and hidden folders are not entered
+        images = [Path(path) for path in scan_folder(img_folder, IMG_EXTS, recursive=True)]
+    count('files_scanned', len(images))
+
+    return sorted(images)
+
+
+@lru_cache(maxsize=None)
+def load_yolo_model(yolo_model_folder:str):
+    """
+    Loads the YOLO model stored in '<yolo_model_folder>/weights/best.pt'.
+    The model is cached, so calling this function again with the same folder does not reload the weights.
+
+    :param yolo_model_folder:
+        - Type: str
+        - Description: Path to the folder containing the YOLO model weights.
+
+    :return:
+        - Type: ultralytics.YOLO
+        - Description: The loaded YOLO model.
+    """
+    from ultralytics import YOLO
+
+    model_path = Path(yolo_model_folder) / 'weights' / 'best.pt'
+    if not model_path.exists():
+        raise FileNotFoundError(f"No model found at {model_path}")
+
+    return YOLO(model_path)
+
+
+def _read_image(img_path):
+    import cv2
+
+    with span('decode'):
+        image = cv2.imread(str(img_path))
+    if image is not None:
+        count('images_decoded')
+    return image
+
+
+def read_images(img_paths:list, executor:ThreadPoolExecutor) -> list:
+    """
+    Starts decoding a list of images with OpenCV on the threads of the given executor.
+
+    :param img_paths:
+        - Type: list of Path
+        - Description: Paths of the images to decode.
+
+    :param executor:
+        - Type: concurrent.futures.ThreadPoolExecutor
+        - Description: The thread pool used to decode the images.
+
+    :return:
+        - Type: list of concurrent.futures.Future
+        - Description: One future per image, in the same order as `img_paths`. The result of a future is the
+                       decoded image (numpy.ndarray), or None if the image cannot be read.
+    """
+    return [executor.submit(_read_image, img_path) for img_path in img_paths]
+
+
+def format_yolo_predictions(boxes) -> list:
+    """
+    Formats the boxes predicted by YOLO for one image as lines of a YOLO label file:
+    <class_id> <x_center> <y_center> <width> <height> <confidence>
+
+    :param boxes:
+        - Type: ultralytics.engine.results.Boxes
+        - Description: The boxes of a YOLO result (`results[0].boxes`).
+
+    :return:
+        - Type: list of str
+        - Description: One line per box, with relative coordinates and confidence rounded to 4 decimals.
+    """
+    xywhn = boxes.xywhn.cpu().tolist()
+    classes = boxes.cls.cpu().tolist()
+    confidences = boxes.conf.cpu().tolist()
+
+    lines = []
+    for xywh, class_id, confidence in zip(xywhn, classes, confidences):
+        coordinates = " ".join([f"{value:.4f}" for value in xywh])
+        lines.append(f"{int(class_id)} {coordinates} {confidence:.4f}\n")
+
+    return lines
+
+
+def _label_writer(write_queue:queue.Queue) -> None:
+    while True:
+        item = write_queue.get()
+        if item is None:
+            break
+        label_path, lines = item
+        try:
+            with span('write'):
+                with open(label_path, 'w') as label_file:
+                    label_file.writelines(lines)
+            count('boxes_written', len(lines))
+        except OSError as e:
+            logger.warning(f"Could not write {label_path}: {e}")
+
+
+def predict_images_in_batches(yolo_model, img_paths:list, labels_folder:str, device:str,
+                              batch_size:int=16, decode_workers:int=4, imgsz:int=640) -> dict:
+    """
+    Runs YOLO object detection on a list of images, batch by batch, and saves one label file per image.
+
+    The next batch of images is decoded on a thread pool while the current batch is predicted,
+    and the label files are written by a background thread, so the model is never waiting on disk I/O.
+    Images without detections do not get a label file.
+
+    :param yolo_model:
+        - Type: ultralytics.YOLO
+        - Description: The loaded YOLO model (see `load_yolo_model`).
+
+    :param img_paths:
+        - Type: list of Path
+        - Description: Paths of the images to process.
+
+    :param labels_folder:
+        - Type: str
+        - Description: Folder where the '<image_name>.txt' label files are saved.
+
+    :param device:
+        - Type: str
+        - Description: The device used for inference ('cuda', 'cpu', ...).
+
+    :param batch_size:
+        - Type: int
+        - Description: Number of images sent to the model at once.
+
+    :param decode_workers:
+        - Type: int
+        - Description: Number of threads used to decode the images.
+
+    :param imgsz:
+        - Type: int
+        - Description: Inference image size.
+
+    :return:
+        - Type: dict
+        - Description: Run statistics: number of images processed, images with detections, unreadable images,
+                       number of boxes, elapsed time (seconds) and throughput (images per second).
+    """
+    labels_folder = Path(labels_folder)
+    labels_folder.mkdir(parents=True, exist_ok=True)
+
+    batch_size = max(1, int(batch_size))
+    batches = [img_paths[i:i + batch_size] for i in range(0, len(img_paths), batch_size)]
+
+    stats = {'images': 0, 'images_with_detections': 0, 'unreadable_images': 0, 'boxes': 0}
+
+    write_queue = queue.Queue(maxsize=4 * batch_size)
+    writer = threading.Thread(target=_label_writer, args=(write_queue,), daemon=True)
+    writer.start()
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, decode_workers)) as executor:
+            next_images = read_images(batches[0], executor) if batches else []
+
+            for batch_index, batch in enumerate(batches):
+                with span('wait_decode'):
+                    images = [future.result() for future in next_images]
+
+                # Decode the next batch while the current one is being predicted
+                if batch_index + 1 < len(batches):
+                    next_images = read_images(batches[batch_index + 1], executor)
+
+                readable = []
+                for img_path, image in zip(batch, images):
+                    if image is None:
+                        logger.warning(f"Could not read image {img_path}")
+                        stats['unreadable_images'] += 1
+                        continue
+                    readable.append((img_path, image))
+
+                if not readable:
+                    continue
+
+                with span('forward'):
+                    results = yolo_model.predict(source=[image for _, image in readable],
+                                                 device=device,
+                                                 agnostic_nms=True,
+                                                 imgsz=imgsz,
+                                                 save_txt=False,
+                                                 save_conf=False,
+                                                 verbose=False
+                                                 )
+
+                for (img_path, _), result in zip(readable, results):
+                    stats['images'] += 1
+                    boxes = result.boxes
+                    if boxes is None or len(boxes) == 0:
+                        logger.debug(f"No detections found in {img_path}")
+                        continue
+
+                    with span('postprocess'):
+                        lines = format_yolo_predictions(boxes)
+                    stats['images_with_detections'] += 1
+                    stats['boxes'] += len(lines)
+                    write_queue.put((labels_folder / f"{Path(img_path).stem}.txt", lines))
+    finally:
+        write_queue.put(None)
+        writer.join()
+
+    elapsed = time.perf_counter() - start
+    stats['elapsed_seconds'] = elapsed
+    stats['images_per_second'] = stats['images'] / elapsed if elapsed > 0 else 0.0
+
+    return stats
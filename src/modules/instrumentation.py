@@ -0,0 +1,364 @@
+"""
+The following module provides the instrumentation and the logging of the pipeline.
+
+Instrumentation: the modules report timers (spans) and counters into it, grouped by stage (e.g. 'predict') and
+by phase (e.g. 'decode', 'forward', 'write'). A run can then be exported as a JSON trace, or as a Chrome trace
+(open it in chrome://tracing or https://ui.perfetto.dev), and summarized as a table. Instrumentation is disabled
+by default, and then costs a single boolean test per call: enable it with `enable_instrumentation()`, or by
+setting the environment variable TIAMAT_PROFILE=1.
+
+    enable_instrumentation()
+    with stage('predict'):
+        with span('forward'):
+            ...
+        count('boxes_written', len(lines))
+    print(format_summary())
+    write_trace('predict_trace.json', trace_format='chrome')
+
+Logging: the modules log their messages in the 'tiamat' logger hierarchy instead of printing them. By default,
+messages of level INFO and above are written to the standard output without decoration (like `print`);
+`configure_logging` changes the level (e.g. 'WARNING' for large runs, to skip the per-image messages) and can
+write them to a file.
+
+Functions included:
+1. enable_instrumentation: Enables or disables the instrumentation.
+2. is_instrumentation_enabled: Tells whether the instrumentation is enabled.
+3. reset_instrumentation: Clears the recorded spans and counters.
+4. stage: Context manager running a block as a stage of the pipeline.
+5. span: Context manager timing a phase of the current stage.
+6. timed: Decorator timing each call of a function as a phase of the current stage.
+7. count: Adds a value to a counter of the current stage.
+8. get_summary: Returns the total time per stage and phase, and the counters.
+9. format_summary: Formats the summary as a table.
+10. write_trace: Writes the recorded run as a JSON or Chrome trace.
+11. get_logger: Returns a logger of the 'tiamat' hierarchy.
+12. configure_logging: Sets the level and the destinations of the log messages.
+"""
+
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+
+LOGGER_NAME = 'tiamat'
+MAX_EVENTS = 1_000_000
+
+_enabled = os.getenv('TIAMAT_PROFILE', '0').lower() in ('1', 'true', 'yes')
+_lock = threading.Lock()
+_current_stage = None
+_start_ns = time.perf_counter_ns()
+_start_time = time.time()
+_spans = {}
+_counters = {}
+_events = []
+
+_NULL_SPAN = nullcontext()
+
+
+def enable_instrumentation(enabled:bool=True, reset:bool=True) -> None:
+    """
+    Enables or disables the instrumentation.
+
+    :param enabled:
+        - Type: bool
+        - Description: True to record spans and counters, False to stop recording.
+
+    :param reset:
+        - Type: bool
+        - Description: If True, the spans and counters recorded before are cleared.
+    """
+    global _enabled
+    if reset:
+        reset_instrumentation()
+    _enabled = enabled
+
+
+def is_instrumentation_enabled() -> bool:
+    """
+    Tells whether the instrumentation is enabled.
+    """
+    return _enabled
+
+
+def reset_instrumentation() -> None:
+    """
+    Clears the recorded spans, counters and trace events, and restarts the clock of the trace.
+    """
+    global _start_ns, _start_time
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _events.clear()
+        _start_ns = time.perf_counter_ns()
+        _start_time = time.time()
+
+
+class _Span:
+    __slots__ = ('stage', 'phase', 'start')
+
+    def __init__(self, stage_name, phase):
+        self.stage = stage_name
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        duration = end - self.start
+        key = (self.stage, self.phase)
+        with _lock:
+            total = _spans.get(key)
+            if total is None:
+                _spans[key] = [1, duration]
+            else:
+                total[0] += 1
+                total[1] += duration
+            if len(_events) < MAX_EVENTS:
+                _events.append(('X', self.stage, self.phase, self.start - _start_ns, duration, threading.get_ident()))
+        return False
+
+
+class _Stage(_Span):
+    __slots__ = ('previous',)
+
+    def __enter__(self):
+        global _current_stage
+        self.previous = _current_stage
+        _current_stage = self.stage
+        return super().__enter__()
+
+    def __exit__(self, *exc):
+        global _current_stage
+        super().__exit__(*exc)
+        _current_stage = self.previous
+        return False
+
+
+def stage(name:str):
+    """
+    Context manager running a block as a stage of the pipeline: the spans and counters recorded in the block
+    (including by other threads) are grouped under this stage, and the whole block is timed as its 'total' phase.
+
+    :param name:
+        - Type: str
+        - Description: Name of the stage (e.g. 'extract', 'predict').
+
+    :return:
+        - Type: context manager
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Stage(name, 'total')
+
+
+def span(phase:str):
+    """
+    Context manager timing a phase of the current stage (e.g. 'list', 'decode', 'forward', 'postprocess', 'write').
+
+    :param phase:
+        - Type: str
+        - Description: Name of the phase.
+
+    :return:
+        - Type: context manager
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(_current_stage, phase)
+
+
+def timed(phase:str):
+    """
+    Decorator timing each call of a function as a phase of the current stage.
+
+    :param phase:
+        - Type: str
+        - Description: Name of the phase.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Span(_current_stage, phase):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name:str, value:int=1) -> None:
+    """
+    Adds a value to a counter of the current stage (e.g. 'files_scanned', 'images_decoded', 'boxes_written',
+    'bytes_read').
+
+    :param name:
+        - Type: str
+        - Description: Name of the counter.
+
+    :param value:
+        - Type: int
+        - Description: Value added to the counter.
+    """
+    if not _enabled:
+        return
+    key = (_current_stage, name)
+    with _lock:
+        total = _counters.get(key, 0) + value
+        _counters[key] = total
+        if len(_events) < MAX_EVENTS:
+            _events.append(('C', key[0], name, time.perf_counter_ns() - _start_ns, total, threading.get_ident()))
+
+
+def get_summary() -> dict:
+    """
+    Returns the summary of the recorded run.
+
+    :return:
+        - Type: dict
+        - Description: {'spans': list of {'stage', 'phase', 'calls', 'seconds'}, 'counters': list of
+                       {'stage', 'name', 'value'}}, in the order in which they were first recorded.
+    """
+    with _lock:
+        spans = [{'stage': stage_name, 'phase': phase, 'calls': calls, 'seconds': duration / 1e9}
+                 for (stage_name, phase), (calls, duration) in _spans.items()]
+        counters = [{'stage': stage_name, 'name': name, 'value': value}
+                    for (stage_name, name), value in _counters.items()]
+    return {'spans': spans, 'counters': counters}
+
+
+def format_summary() -> str:
+    """
+    Formats the summary of the recorded run as a table: the time of each phase, with its share of the time
+    of its stage, then the counters.
+
+    :return:
+        - Type: str
+        - Description: The table.
+    """
+    summary = get_summary()
+    stage_totals = {entry['stage']: entry['seconds'] for entry in summary['spans'] if entry['phase'] == 'total'}
+
+    lines = [f"{'stage':<16}{'phase':<22}{'calls':>10}{'seconds':>12}{'% stage':>10}"]
+    for entry in sorted(summary['spans'], key=lambda entry: (str(entry['stage']), entry['phase'] != 'total')):
+        total = stage_totals.get(entry['stage'])
+        share = f"{100 * entry['seconds'] / total:.1f}" if total else ''
+        lines.append(f"{str(entry['stage']):<16}{entry['phase']:<22}{entry['calls']:>10}{entry['seconds']:>12.3f}{share:>10}")
+
+    if summary['counters']:
+        lines.append('')
+        lines.append(f"{'stage':<16}{'counter':<26}{'value':>16}")
+        for entry in sorted(summary['counters'], key=lambda entry: (str(entry['stage']), entry['name'])):
+            lines.append(f"{str(entry['stage']):<16}{entry['name']:<26}{entry['value']:>16}")
+
+    return '\n'.join(lines)
+
+
+def write_trace(trace_file:str, trace_format:str='json') -> None:
+    """
+    Writes the recorded run.
+
+    :param trace_file:
+        - Type: str
+        - Description: Path to the trace file.
+
+    :param trace_format:
+        - Type: str
+        - Description: 'json' writes the summary and the events ({'started', 'summary', 'events'});
+                       'chrome' writes the Chrome trace event format (chrome://tracing, Perfetto).
+    """
+    if trace_format not in ('json', 'chrome'):
+        raise ValueError(f"Unknown trace format '{trace_format}', use 'json' or 'chrome'")
+
+    with _lock:
+        events = list(_events)
+
+    if trace_format == 'chrome':
+        pid = os.getpid()
+        trace_events = []
+        for kind, stage_name, name, start, value, thread_id in events:
+            event = {'name': name, 'cat': str(stage_name), 'ph': kind, 'ts': start / 1000, 'pid': pid, 'tid': thread_id}
+            if kind == 'X':
+                event['dur'] = value / 1000
+            else:
+                event['name'] = f"{stage_name}.{name}"
+                event['args'] = {name: value}
+            trace_events.append(event)
+        data = {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+    else:
+        data = {'started': _start_time,
+                'summary': get_summary(),
+                'events': [{'type': 'span' if kind == 'X' else 'counter', 'stage': stage_name, 'name': name,
+                            'start_us': start / 1000, ('duration_us' if kind == 'X' else 'value'): value / 1000 if kind == 'X' else value,
+                            'thread': thread_id}
+                           for kind, stage_name, name, start, value, thread_id in events]}
+
+    Path(trace_file).parent.mkdir(parents=True, exist_ok=True)
+    with open(trace_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+def get_logger(name:str=None) -> logging.Logger:
+    """
+    Returns a logger of the 'tiamat' hierarchy. If logging was not configured, messages of level INFO and above
+    are written to the standard output, like `print`.
+
+    :param name:
+        - Type: str
+        - Description: Name of the child logger (e.g. 'inference'), or None for the 'tiamat' logger.
+
+    :return:
+        - Type: logging.Logger
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger.getChild(name) if name else logger
+
+
+def configure_logging(level='INFO', log_file:str=None, console:bool=True) -> None:
+    """
+    Sets the level and the destinations of the messages of the 'tiamat' loggers.
+
+    :param level:
+        - Type: str or int
+        - Description: 'DEBUG', 'INFO', 'WARNING' or 'ERROR'. With 'WARNING', the per-image messages are skipped.
+
+    :param log_file:
+        - Type: str
+        - Description: Path to a file where the messages are also written, with their time and level.
+
+    :param console:
+        - Type: bool
+        - Description: If True, the messages are written to the standard output.
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+    if console:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+    if log_file:
+        Path(log_file).parent.mkdir(parents=True, exist_ok=True)
+        handler = logging.FileHandler(log_file, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        logger.addHandler(handler)
+    if not logger.handlers:
+        logger.addHandler(logging.NullHandler())
+
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
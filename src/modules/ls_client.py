@@ -0,0 +1,427 @@
+"""
+The following module exchanges tasks and annotations with a running Label Studio server through its REST API, instead
+of import files uploaded by hand and export files copied into the project.
+
+- The predictions are pushed in batches (`push_tasks`): the tasks (with their predictions) are sent as they are
+  produced, `batch_size` tasks per request to '/api/projects/<id>/import', so a large export is a few requests of
+  bounded size and the tasks are never all kept in memory.
+- The annotations are pulled incrementally (`pull_annotations`): only the tasks updated since the last pull are listed,
+  page by page, and each finished annotation is written as one JSON file, in the layout of the Label Studio export
+  storage read by the notebooks ('annotations/prediction_corrections/<annotation id>', or 'annotations/ground_truth').
+  The time of the last annotation pulled from each Label Studio project is kept in 'annotations/ls_sync_state.json'.
+
+All the requests go through one `requests` session, whose connection pool keeps the connections to the server open
+(keep-alive) from one request to the next. Failed requests are retried with an exponential backoff (and the delay of
+the 'Retry-After' header, if any): connection errors and the statuses 429, 502, 503 and 504 for all the requests,
+read timeouts and the other 5xx statuses for the requests that can be sent twice only (an import that timed out may
+have been done, sending it again would duplicate its tasks).
+
+The server, port and access token come from `config.py` (LS_HOST, LS_PORT and LS_API_KEY, see `.env`).
+`ls_mock_server` provides a local stand-in of the Label Studio API, to try the client without Label Studio.
+
+Functions included:
+1. LabelStudioClient: Pooled session on the Label Studio API, with retries and backoff.
+2. iter_batches: Groups tasks into lists of at most `batch_size` tasks.
+3. push_tasks: Imports tasks into a Label Studio project, in batches.
+4. iter_updated_tasks: Lists the tasks of a Label Studio project updated since a given time, page by page.
+5. pull_annotations: Writes the annotations finished since the last pull as one JSON file each.
+"""
+
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from pathlib import Path
+
+from instrumentation import count, get_logger, span
+
+
+logger = get_logger('ls_client')
+
+# Statuses retried for all the requests: the server did not process the request
+RETRY_STATUSES = {429, 502, 503, 504}
+# Requests that can be sent twice without side effects
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+
+def _ls_settings() -> tuple:
+    try:
+        import config
+        return config.LS_HOST, config.LS_PORT, config.LS_API_KEY
+    except (ImportError, AttributeError):
+        # Modules used without the 'src' folder in the path
+        return os.getenv('LS_HOST', 'localhost'), int(os.getenv('LS_PORT', 8080)), os.getenv('LS_API_KEY', '')
+
+
+def _parse_time(value:str) -> datetime:
+    # Label Studio dates are ISO 8601, in UTC ('2025-01-31T12:00:00.123456Z')
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _format_time(value:datetime) -> str:
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _write_json(path:Path, data) -> None:
+    # Written next to the file then renamed, so a file is never read half written
+    tmp_file = path.with_name(f".{path.name}.tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_file, path)
+
+
+class LabelStudioClient:
+    """
+    Session on the Label Studio API: the connections to the server are pooled and kept open between the requests,
+    and failed requests are retried with an exponential backoff. Use it as a context manager:
+
+        with LabelStudioClient() as client:
+            push_tasks(client, project_id, tasks)
+
+    :param url:
+        - Type: str
+        - Description: URL of the Label Studio server, e.g. 'http://localhost:8080'.
+                       Default is built from LS_HOST and LS_PORT (see `config.py`).
+
+    :param api_key:
+        - Type: str
+        - Description: Access token of the Label Studio account (Account & Settings > Access Token).
+                       Default is LS_API_KEY (see `config.py`).
+
+    :param pool_size:
+        - Type: int
+        - Description: Maximum number of connections kept open to the server.
+
+    :param timeout:
+        - Type: float
+        - Description: Seconds to wait for the server to answer a request.
+
+    :param retries:
+        - Type: int
+        - Description: Number of times a failed request is sent again.
+
+    :param backoff_factor:
+        - Type: float
+        - Description: Delay (seconds) before the first retry; it doubles at each retry, with some jitter.
+
+    :param max_backoff:
+        - Type: float
+        - Description: Longest delay (seconds) between two retries.
+    """
+
+    def __init__(self, url:str=None, api_key:str=None, pool_size:int=4, timeout:float=60.0, retries:int=5,
+                 backoff_factor:float=0.5, max_backoff:float=30.0):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        host, port, default_key = _ls_settings()
+        self.url = (url or f"http://{host}:{port}").rstrip('/')
+        self.timeout = timeout
+        self.retries = max(0, int(retries))
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.stats = {'requests': 0, 'retries': 0}
+
+        self.session = requests.Session()
+        # The retries are done by `request`, which knows which requests can be sent twice
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        api_key = default_key if api_key is None else api_key
+        if api_key:
+            self.session.headers['Authorization'] = f"Token {api_key}"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def close(self) -> None:
+        """
+        Closes the connections of the pool.
+        """
+        self.session.close()
+
+    def _backoff(self, attempt:int, response=None) -> float:
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff)
+        # Jitter: clients retrying at the same time do not hit the server again together
+        return min(self.backoff_factor * 2 ** attempt, self.max_backoff) * random.uniform(0.5, 1.0)
+
+    def request(self, method:str, path:str, **kwargs):
+        """
+        Sends a request to the API and returns its response, retrying it with an exponential backoff when it fails
+        (see the module description for the errors retried).
+
+        :param method:
+            - Type: str
+            - Description: HTTP method ('GET', 'POST'...).
+
+        :param path:
+            - Type: str
+            - Description: Path of the endpoint, e.g. '/api/projects/1/import'.
+
+        :param kwargs:
+            - Description: Arguments of `requests.Session.request` (params, json...).
+
+        :return:
+            - Type: requests.Response
+            - Description: The response. Raises `requests.HTTPError` for an error status that is not retried, or
+                           still returned after the last retry.
+        """
+        import requests
+
+        method = method.upper()
+        idempotent = method in IDEMPOTENT_METHODS
+        kwargs.setdefault('timeout', self.timeout)
+
+        for attempt in range(self.retries + 1):
+            self.stats['requests'] += 1
+            response = None
+            try:
+                response = self.session.request(method, self.url + path, **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                # Also the connections of the pool closed by the server: the request was not received
+                if attempt == self.retries:
+                    raise
+                reason = e.__class__.__name__
+            except requests.exceptions.Timeout as e:
+                if not idempotent or attempt == self.retries:
+                    raise
+                reason = e.__class__.__name__
+            else:
+                status = response.status_code
+                if not (status in RETRY_STATUSES or (idempotent and status >= 500)) or attempt == self.retries:
+                    response.raise_for_status()
+                    return response
+                reason = f"HTTP {status}"
+                response.close()
+
+            delay = self._backoff(attempt, response)
+            self.stats['retries'] += 1
+            count('ls_retries')
+            logger.warning(f"{method} {path} failed ({reason}), retry {attempt + 1}/{self.retries} in {delay:.1f} s")
+            time.sleep(delay)
+
+
+def iter_batches(items, batch_size:int):
+    """
+    Groups items (e.g. tasks from a generator) into lists of at most `batch_size` items, as they are produced.
+    """
+    items = iter(items)
+    batch_size = max(1, int(batch_size))
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def push_tasks(client:LabelStudioClient, project_id:int, tasks, batch_size:int=500) -> dict:
+    """
+    Imports tasks (with their predictions) into a Label Studio project, `batch_size` tasks per request.
+
+    The tasks are read as they are produced, so a generator of tasks (e.g. `get_ls_for_local_files` in notebook 4)
+    is never kept in memory as a whole. The tasks of the batches sent before an error stay in the project: pushing the
+    same tasks again would create them twice.
+
+    :param client:
+        - Type: LabelStudioClient
+        - Description: Session on the Label Studio API.
+
+    :param project_id:
+        - Type: int
+        - Description: ID of the Label Studio project (as in its URL, '/projects/<id>').
+
+    :param tasks:
+        - Type: iterable of dict
+        - Description: The Label Studio tasks, in the format of the import files (see `ls_export.write_ls_tasks`).
+
+    :param batch_size:
+        - Type: int
+        - Description: Number of tasks sent per request.
+
+    :return:
+        - Type: dict
+        - Description: {'tasks', 'predictions', 'batches'}: numbers of tasks and predictions imported and of requests.
+    """
+    stats = {'tasks': 0, 'predictions': 0, 'batches': 0}
+    with span('push_tasks'):
+        for batch in iter_batches(tasks, batch_size):
+            imported = client.request('POST', f"/api/projects/{project_id}/import", json=batch).json()
+            stats['tasks'] += imported.get('task_count', len(batch))
+            stats['predictions'] += imported.get('prediction_count', 0)
+            stats['batches'] += 1
+            logger.debug(f"Batch {stats['batches']}: {len(batch)} task(s) imported into project {project_id}")
+
+    count('ls_tasks_pushed', stats['tasks'])
+    logger.info(f"{stats['tasks']} task(s) and {stats['predictions']} prediction(s) imported into project "
+                f"{project_id} in {stats['batches']} request(s)")
+    return stats
+
+
+def iter_updated_tasks(client:LabelStudioClient, project_id:int, updated_after:str=None, page_size:int=100):
+    """
+    Lists the tasks of a Label Studio project, with their annotations, page by page ('/api/tasks'). The tasks are
+    ordered by ID, so that the pages do not shift when tasks are annotated during the listing.
+
+    :param client:
+        - Type: LabelStudioClient
+        - Description: Session on the Label Studio API.
+
+    :param project_id:
+        - Type: int
+        - Description: ID of the Label Studio project.
+
+    :param updated_after:
+        - Type: str
+        - Description: ISO 8601 date: only the tasks updated after it are listed. None lists all the tasks.
+
+    :param page_size:
+        - Type: int
+        - Description: Number of tasks per request.
+
+    :return:
+        - Type: generator of dict
+        - Description: The tasks, as returned by the API ('id', 'data', 'annotations', 'updated_at'...).
+    """
+    import requests
+
+    items = []
+    if updated_after:
+        items.append({'filter': 'filter:tasks:updated_at', 'operator': 'greater', 'type': 'Datetime',
+                      'value': updated_after})
+    query = json.dumps({'filters': {'conjunction': 'and', 'items': items}, 'ordering': ['tasks:id']})
+
+    page = 1
+    while True:
+        params = {'project': project_id, 'page': page, 'page_size': page_size, 'fields': 'all', 'query': query}
+        try:
+            listed = client.request('GET', '/api/tasks', params=params).json()
+        except requests.HTTPError as e:
+            # Label Studio answers 404 after the last page
+            if page > 1 and e.response is not None and e.response.status_code == 404:
+                return
+            raise
+
+        # A list of tasks in the older versions of Label Studio
+        tasks = listed['tasks'] if isinstance(listed, dict) else listed
+        yield from tasks
+        if len(tasks) < page_size:
+            return
+        page += 1
+
+
+def _load_sync_state(sync_file:Path) -> dict:
+    if not sync_file.exists():
+        return {}
+    with open(sync_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def pull_annotations(client:LabelStudioClient, project_id:int, output_folder:str, sync_file:str,
+                     full:bool=False, overlap_seconds:float=300, page_size:int=100) -> dict:
+    """
+    Writes the annotations of a Label Studio project finished since the last pull as one JSON file each, named after
+    the annotation ID, in the format of the Label Studio export storage (the annotation with its 'task'): the files
+    read by the notebooks 1 (ground truth), 5 (corrections) and 6.
+
+    Only the tasks updated since the last annotation pulled are listed. As the clocks and the updates of the tasks are
+    not exactly in order, the tasks updated `overlap_seconds` before it are listed again; the annotations already
+    pulled with the same update time are skipped. An annotation updated again is written again (replacing its file);
+    the file of an annotation cancelled (task skipped) is removed.
+
+    :param client:
+        - Type: LabelStudioClient
+        - Description: Session on the Label Studio API.
+
+    :param project_id:
+        - Type: int
+        - Description: ID of the Label Studio project.
+
+    :param output_folder:
+        - Type: str
+        - Description: Folder of the annotation files, e.g. `get_corrections_folder_inference(project_folder)` or
+                       `get_ground_truth_folder_training(project_folder)`.
+
+    :param sync_file:
+        - Type: str
+        - Description: Path to the state of the previous pulls (see `folders_path.get_ls_sync_file`).
+
+    :param full:
+        - Type: bool
+        - Description: If True, all the annotations of the project are pulled again.
+
+    :param overlap_seconds:
+        - Type: float
+        - Description: Seconds before the last annotation pulled from which the tasks are listed again.
+
+    :param page_size:
+        - Type: int
+        - Description: Number of tasks per request.
+
+    :return:
+        - Type: dict
+        - Description: {'tasks': tasks listed, 'written': annotation files written, 'unchanged': annotations already
+                       pulled, 'cancelled': annotations cancelled}.
+    """
+    output_folder = Path(output_folder)
+    output_folder.mkdir(parents=True, exist_ok=True)
+    sync_file = Path(sync_file)
+
+    # One entry per Label Studio server and project
+    state = _load_sync_state(sync_file)
+    key = f"{client.url}/projects/{project_id}"
+    entry = {} if full else state.get(key, {})
+    last_updated_at = _parse_time(entry['last_updated_at']) if entry.get('last_updated_at') else None
+    pulled = dict(entry.get('annotations', {}))
+
+    updated_after = None
+    if last_updated_at is not None:
+        updated_after = _format_time(last_updated_at - timedelta(seconds=overlap_seconds))
+
+    stats = {'tasks': 0, 'written': 0, 'unchanged': 0, 'cancelled': 0}
+    with span('pull_annotations'):
+        for task in iter_updated_tasks(client, project_id, updated_after, page_size=page_size):
+            stats['tasks'] += 1
+            task_fields = {name: value for name, value in task.items()
+                           if name not in ('annotations', 'predictions', 'drafts')}
+
+            for annotation in task.get('annotations') or []:
+                annotation_id = str(annotation['id'])
+                updated_at = annotation.get('updated_at') or annotation.get('created_at')
+                if updated_at and (last_updated_at is None or _parse_time(updated_at) > last_updated_at):
+                    last_updated_at = _parse_time(updated_at)
+                if annotation_id in pulled and pulled[annotation_id] == updated_at:
+                    stats['unchanged'] += 1
+                    continue
+
+                annotation_file = output_folder / annotation_id
+                if annotation.get('was_cancelled'):
+                    annotation_file.unlink(missing_ok=True)
+                    stats['cancelled'] += 1
+                else:
+                    _write_json(annotation_file, {**annotation, 'task': task_fields})
+                    stats['written'] += 1
+                pulled[annotation_id] = updated_at
+
+    # The annotations older than the overlap cannot be listed again with the same update time
+    if last_updated_at is not None:
+        oldest = last_updated_at - timedelta(seconds=overlap_seconds)
+        pulled = {annotation_id: updated_at for annotation_id, updated_at in pulled.items()
+                  if updated_at is None or _parse_time(updated_at) >= oldest}
+    state[key] = {'last_updated_at': _format_time(last_updated_at) if last_updated_at else None,
+                  'annotations': pulled}
+    sync_file.parent.mkdir(parents=True, exist_ok=True)
+    _write_json(sync_file, state)
+
+    count('ls_annotations_pulled', stats['written'])
+    logger.info(f"{stats['written']} annotation(s) written to {output_folder} from project {project_id} "
+                f"({stats['tasks']} task(s) updated, {stats['unchanged']} annotation(s) already pulled, "
+                f"{stats['cancelled']} cancelled)")
+    return stats
@@ -0,0 +1,222 @@
+"""
+The following module converts Label Studio JSON annotation files (one file per task, as exported in
+'annotations/ground_truth') into YOLO label files and a 'labels.txt' file, in a single pass.
+
+Each JSON file is read once: its class names and boxes are collected together, and the files are parsed
+in parallel. A manifest records the SHA-256 hash of every converted file, so a later run only parses the
+files that were added or changed since the previous one, only rewrites the label files of those files, and
+removes the label files of deleted annotation files. Class IDs are stable across runs: new classes are
+appended to the existing 'labels.txt'.
+
+Functions included:
+1. parse_ls_annotation: Reads one Label Studio JSON file and returns its hash, image name and boxes.
+2. load_conversion_manifest: Reads the manifest of a previous conversion.
+3. convert_ls_annotations: Converts a folder of Label Studio JSON files into YOLO label files, incrementally.
+"""
+
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from class_names_functions import LabelMap, load_label_map
+from instrumentation import count, get_logger, span
+from transform_coordinates_functions import from_ls_to_yolo
+
+
+MANIFEST_VERSION = 1
+
+
+def parse_ls_annotation(annotation_file:str) -> dict:
+    """
+    Reads a Label Studio JSON annotation file once and returns its content hash, the name of its image and its boxes
+    converted to YOLO coordinates (see `from_ls_to_yolo`).
+
+    :param annotation_file:
+        - Type: str
+        - Description: Path to the JSON annotation file.
+
+    :return:
+        - Type: dict
+        - Description: A dictionary with the keys 'hash' (SHA-256 of the file), 'image' (image name without extension)
+                       and 'boxes' (list of [class_name, x_center, y_center, width, height], relative coordinates).
+    """
+    with open(annotation_file, 'rb') as f:
+        content = f.read()
+
+    annotations = json.loads(content)
+    img_name = Path(annotations['task']['data']['image']).stem
+
+    boxes = []
+    for result in annotations.get('result', []):
+        value = result.get('value', {})
+        class_names = value.get('rectanglelabels')
+        if not class_names:
+            continue
+        # from_ls_to_yolo returns the coordinates as strings, which give back the same floats
+        boxes.append([class_names[0]] + [float(coordinate) for coordinate in
+                                         from_ls_to_yolo(value['x'], value['y'], value['width'], value['height'])])
+
+    return {'hash': hashlib.sha256(content).hexdigest(), 'image': img_name, 'boxes': boxes}
+
+
+def _parse_ls_annotation_args(annotation_file):
+    try:
+        return parse_ls_annotation(annotation_file)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        get_logger('ls_conversion').warning(f"Could not convert {Path(annotation_file).name}: {e}")
+        return None
+
+
+def load_conversion_manifest(manifest_file:str) -> dict:
+    """
+    Reads the manifest of a previous conversion.
+
+    :param manifest_file:
+        - Type: str
+        - Description: Path to the manifest JSON file.
+
+    :return:
+        - Type: dict
+        - Description: The manifest: {'version', 'labels' (class names by ID), 'files'}, where 'files' maps each
+                       annotation file name to its 'size', 'mtime_ns', 'hash', 'image' and 'classes'.
+                       An empty manifest if the file does not exist or was written by another version.
+    """
+    empty = {'version': MANIFEST_VERSION, 'labels': {}, 'files': {}}
+    if not Path(manifest_file).exists():
+        return empty
+
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    return manifest if manifest.get('version') == MANIFEST_VERSION else empty
+
+
+def convert_ls_annotations(annotation_folder:str, labels_folder:str, labels_file:str, manifest_file:str,
+                           workers:int=None, force:bool=False) -> dict:
+    """
+    Converts the Label Studio JSON files of a folder into one YOLO label file per image and a 'labels.txt' file.
+
+    Only the files that are new or changed since the previous run (according to the manifest) are parsed
+    and have their label file rewritten. A file whose size or modification time changed but whose content
+    hash is unchanged is not rewritten. The label files of annotation files that were deleted are removed.
+    If 'labels.txt' was modified outside of this function, all the label files are rewritten.
+
+    :param annotation_folder:
+        - Type: str
+        - Description: Path to the folder containing the Label Studio JSON files (hidden files are ignored).
+
+    :param labels_folder:
+        - Type: str
+        - Description: Path to the folder where the YOLO label files are written.
+
+    :param labels_file:
+        - Type: str
+        - Description: Path to the 'labels.txt' file. Existing class IDs are kept and new classes are appended.
+
+    :param manifest_file:
+        - Type: str
+        - Description: Path to the manifest JSON file of the conversion.
+
+    :param workers:
+        - Type: int
+        - Description: Number of worker processes parsing the JSON files. None uses all the CPU cores,
+                       1 runs in the current process.
+
+    :param force:
+        - Type: bool
+        - Description: If True, the manifest is ignored and all the files are converted.
+
+    :return:
+        - Type: dict
+        - Description: Statistics of the run: number of annotation files, files converted, files unchanged,
+                       label files removed and new classes.
+    """
+    annotation_folder = Path(annotation_folder)
+    labels_folder = Path(labels_folder)
+    labels_folder.mkdir(parents=True, exist_ok=True)
+    labels_file = Path(labels_file)
+
+    manifest = {'version': MANIFEST_VERSION, 'labels': {}, 'files': {}} if force else load_conversion_manifest(manifest_file)
+    previous_files = manifest['files']
+    label_map = load_label_map(labels_file) if labels_file.exists() else LabelMap()
+
+    # labels.txt changed since the last run: the class IDs of all the label files may be wrong
+    if label_map.to_dict() != manifest['labels']:
+        previous_files = {}
+
+    files = {}
+    to_parse = []
+    with span('scan'):
+        entries = sorted(os.scandir(annotation_folder), key=lambda entry: entry.name)
+        for entry in entries:
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            stat = entry.stat()
+            previous = previous_files.get(entry.name)
+            if (previous is not None and previous['size'] == stat.st_size and previous['mtime_ns'] == stat.st_mtime_ns
+                    and (labels_folder / f"{previous['image']}.txt").exists()):
+                files[entry.name] = previous
+            else:
+                to_parse.append((entry.name, entry.path, stat))
+    count('files_scanned', len(entries))
+
+    # Parse the new and changed files, in parallel
+    paths = [path for _, path, _ in to_parse]
+    with span('parse'):
+        if workers == 1 or len(paths) < 2:
+            parsed = list(map(_parse_ls_annotation_args, paths))
+        else:
+            workers = workers or os.cpu_count() or 1
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                parsed = list(executor.map(_parse_ls_annotation_args, paths, chunksize=max(1, len(paths) // (4 * workers))))
+    count('files_parsed', len(paths))
+    count('bytes_read', sum(stat.st_size for _, _, stat in to_parse))
+
+    converted = {}
+    for (name, _, stat), result in zip(to_parse, parsed):
+        previous = previous_files.get(name)
+        if result is None:
+            # Keep the label file of the previous version of an unreadable file
+            if previous is not None:
+                files[name] = previous
+            continue
+        files[name] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': result['hash'],
+                       'image': result['image'], 'classes': sorted({box[0] for box in result['boxes']})}
+        # Touched but identical files keep their label file
+        if previous is not None and previous['hash'] == result['hash'] and (labels_folder / f"{result['image']}.txt").exists():
+            continue
+        converted[name] = result
+
+    # New classes get the next IDs, existing IDs never change
+    all_classes = sorted({class_name for entry in files.values() for class_name in entry['classes']})
+    new_label_map = label_map.merge(all_classes)
+    new_classes = new_label_map.names()[len(label_map):]
+    if new_classes or not labels_file.exists():
+        new_label_map.save(labels_file)
+        get_logger('ls_conversion').info(f"Labels file written in {labels_file}")
+
+    with span('write'):
+        for result in converted.values():
+            with open(labels_folder / f"{result['image']}.txt", 'w') as yolo_annotation:
+                for class_name, x, y, w, h in result['boxes']:
+                    yolo_annotation.write(f"{new_label_map.id(class_name)} {x} {y} {w} {h}\n")
+    count('label_files_written', len(converted))
+    count('boxes_written', sum(len(result['boxes']) for result in converted.values()))
+
+    # Remove the label files of deleted annotation files (unless another annotation file has the same image)
+    images = {entry['image'] for entry in files.values()}
+    removed = 0
+    for name, entry in manifest['files'].items():
+        if name not in files and entry['image'] not in images:
+            label_path = labels_folder / f"{entry['image']}.txt"
+            if label_path.exists():
+                label_path.unlink()
+                removed += 1
+
+    Path(manifest_file).parent.mkdir(parents=True, exist_ok=True)
+    with open(manifest_file, 'w', encoding='utf-8') as f:
+        json.dump({'version': MANIFEST_VERSION, 'labels': new_label_map.to_dict(), 'files': files}, f)
+
+    return {'files': len(files), 'converted': len(converted), 'unchanged': len(files) - len(converted),
+            'removed': removed, 'new_classes': new_classes}
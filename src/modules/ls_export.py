@@ -0,0 +1,195 @@
+"""
+The following module writes Label Studio import files as a stream: tasks are written as soon as they are
+produced, instead of being collected in memory and dumped at the end, so the memory used by an export
+does not depend on the number of images. The output is split into shards of bounded size, which Label
+Studio imports faster than one huge file.
+
+Two formats are supported:
+    - 'json': each shard is a JSON list of tasks (the format of `label-studio import tasks --format json`).
+    - 'ndjson': each shard contains one task per line (JSON Lines).
+
+Functions included:
+1. get_local_files_prefix: Returns the Label Studio local-files URL prefix of a folder, for a given port.
+2. to_local_files_url: Rewrites the absolute path of an image as a Label Studio local-files URL.
+3. write_ls_tasks: Streams tasks into size-bounded JSON/NDJSON shards.
+4. read_ls_tasks: Reads the tasks of import files back, file by file.
+"""
+
+import json
+from pathlib import Path
+
+
+def get_local_files_prefix(root:str, port:int, host:str='localhost') -> str:
+    """
+    Returns the URL under which Label Studio serves the local files of a folder.
+
+    :param root:
+        - Type: str
+        - Description: Absolute path to the folder served as local files (LOCAL_FILES_DOCUMENT_ROOT or below).
+
+    :param port:
+        - Type: int
+        - Description: Port of the Label Studio server (see `config.LS_PORT`).
+
+    :param host:
+        - Type: str
+        - Description: Host of the Label Studio server.
+
+    :return:
+        - Type: str
+        - Description: The prefix, e.g. 'http://localhost:8080/data/local-files/?d=home/user/project/eval_images'.
+    """
+    return f"http://{host}:{port}/data/local-files/?d=" + str(root).lstrip('/')
+
+
+def to_local_files_url(img_path:str, root:str, prefix:str) -> str:
+    """
+    Rewrites the absolute path of an image located in `root` as a Label Studio local-files URL.
+
+    :param img_path:
+        - Type: str
+        - Description: Absolute path to the image.
+
+    :param root:
+        - Type: str
+        - Description: Absolute path to the folder served as local files.
+
+    :param prefix:
+        - Type: str
+        - Description: URL prefix of `root` (see `get_local_files_prefix`).
+
+    :return:
+        - Type: str
+        - Description: The URL of the image.
+    """
+    return str(img_path).replace(str(root), prefix, 1)
+
+
+def _shard_path(output_file:Path, index:int) -> Path:
+    return output_file.with_name(f"{output_file.stem}_{index:03d}{output_file.suffix}")
+
+
+def write_ls_tasks(tasks, output_file:str, output_format:str='json', max_shard_bytes:int=100 * 1024 * 1024,
+                   compact:bool=True) -> list:
+    """
+    Writes Label Studio tasks as they are produced, in shards of at most `max_shard_bytes` bytes
+    (a shard always contains at least one task).
+
+    The shards are named '<name>_001.json', '<name>_002.json'... next to `output_file`. When the whole export
+    fits in one shard, it is written to `output_file` itself.
+
+    :param tasks:
+        - Type: iterable of dict
+        - Description: The Label Studio tasks, e.g. a generator.
+
+    :param output_file:
+        - Type: str
+        - Description: Path to the output file ('.json' or '.ndjson').
+
+    :param output_format:
+        - Type: str
+        - Description: 'json' (each shard is a JSON list) or 'ndjson' (one task per line).
+
+    :param max_shard_bytes:
+        - Type: int
+        - Description: Maximum size of a shard in bytes.
+
+    :param compact:
+        - Type: bool
+        - Description: If True, the JSON is written without indentation or spaces (smaller and faster to import).
+                       If False, 'json' shards are indented like before. 'ndjson' is always one line per task.
+
+    :return:
+        - Type: list of str
+        - Description: Paths to the files written, in order.
+    """
+    if output_format not in ('json', 'ndjson'):
+        raise ValueError(f"Unknown output format '{output_format}', use 'json' or 'ndjson'")
+
+    output_file = Path(output_file)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+
+    # Shards of a previous export would be imported with the new ones
+    for old_shard in output_file.parent.glob(f"{output_file.stem}_[0-9][0-9][0-9]{output_file.suffix}"):
+        old_shard.unlink()
+
+    if compact or output_format == 'ndjson':
+        dumps = lambda task: json.dumps(task, separators=(',', ':'), ensure_ascii=False)
+    else:
+        dumps = lambda task: '\n'.join('  ' + line for line in json.dumps(task, indent=2, ensure_ascii=False).splitlines())
+
+    if output_format == 'json':
+        opening, separator, closing = ('[', ',', ']') if compact else ('[\n', ',\n', '\n]')
+    else:
+        opening, separator, closing = '', '\n', '\n'
+
+    shards = []
+    shard = None
+    size = 0
+    tasks_in_shard = 0
+
+    try:
+        for task in tasks:
+            data = dumps(task).encode('utf-8')
+
+            if shard is not None and tasks_in_shard and size + len(separator) + len(data) + len(closing) > max_shard_bytes:
+                shard.write(closing.encode('utf-8'))
+                shard.close()
+                shard = None
+
+            if shard is None:
+                shards.append(_shard_path(output_file, len(shards) + 1))
+                shard = open(shards[-1], 'wb')
+                shard.write(opening.encode('utf-8'))
+                size = len(opening)
+                tasks_in_shard = 0
+
+            if tasks_in_shard:
+                shard.write(separator.encode('utf-8'))
+                size += len(separator)
+            shard.write(data)
+            size += len(data)
+            tasks_in_shard += 1
+
+        if shard is None:
+            # No task: write an empty import file
+            shards.append(_shard_path(output_file, 1))
+            shard = open(shards[-1], 'wb')
+            shard.write(opening.encode('utf-8'))
+            if output_format == 'json':
+                shard.write(closing.encode('utf-8'))
+        else:
+            shard.write(closing.encode('utf-8'))
+    finally:
+        if shard is not None:
+            shard.close()
+
+    if len(shards) == 1:
+        shards[0].replace(output_file)
+        shards = [output_file]
+
+    return [str(shard_path) for shard_path in shards]
+
+
+def read_ls_tasks(import_files:list):
+    """
+    Reads the tasks of Label Studio import files written by `write_ls_tasks`, file by file, e.g. to push them to
+    Label Studio through its API (see `ls_client.push_tasks`). Only one shard is in memory at a time ('ndjson' files
+    are read line by line).
+
+    :param import_files:
+        - Type: list of str
+        - Description: Paths to the import files ('.json' lists of tasks or '.ndjson' files).
+
+    :return:
+        - Type: generator of dict
+        - Description: The tasks, in the order of the files.
+    """
+    for import_file in import_files:
+        with open(import_file, 'r', encoding='utf-8') as f:
+            if Path(import_file).suffix.lower() == '.ndjson':
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+            else:
+                yield from json.load(f)
@@ -0,0 +1,319 @@
+"""
+The following module provides a small local stand-in of the Label Studio API, to try `ls_client` offline, without
+Label Studio installed: the projects, tasks and annotations are kept in memory, and the server runs in a background
+thread of the current process, on a free port.
+
+It serves the endpoints used by the client, with the same answers as Label Studio, over keep-alive (HTTP/1.1)
+connections:
+    - GET  /api/projects/<id>: the project.
+    - POST /api/projects/<id>/import: imports a list of tasks (with their predictions and annotations).
+    - GET  /api/tasks?project=<id>&page=<n>&page_size=<n>&query=<json>: the tasks of a project, page by page, with
+      their annotations; the 'filter:tasks:updated_at' filter and the ordering by 'tasks:id' or 'tasks:updated_at'
+      of the query are applied, and a page after the last one is answered with 404.
+    - POST /api/tasks/<id>/annotations and PATCH /api/annotations/<id>: creates or updates an annotation.
+
+The annotations of an annotator are added with `annotate`, and `fail_next` answers the next requests with an error
+status, to check the retries. `stats` counts the connections opened and the requests received:
+
+    with LabelStudioMockServer(api_key='token') as server, LabelStudioClient(server.url, api_key='token') as client:
+        project_id = server.create_project('Corrections')
+        push_tasks(client, project_id, tasks, batch_size=100)
+        server.annotate(task_id=1, result=[...])
+        pull_annotations(client, project_id, corrections_folder, sync_file)
+
+Functions included:
+1. LabelStudioMockServer: In-memory Label Studio API, served from a background thread.
+"""
+
+import json
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from instrumentation import get_logger
+
+
+logger = get_logger('ls_mock_server')
+
+
+def _parse_time(value:str) -> datetime:
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive connections, as Label Studio behind its web server
+    protocol_version = 'HTTP/1.1'
+    mock = None
+
+    def setup(self):
+        super().setup()
+        with self.mock._lock:
+            self.mock.stats['connections'] += 1
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send(self, status:int, body=None, headers:dict=None) -> None:
+        data = json.dumps(body if body is not None else {}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method:str) -> None:
+        # The body is always read, so that the connection can be used for the next request
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = self.rfile.read(length) if length else b''
+        mock = self.mock
+
+        with mock._lock:
+            mock.stats['requests'] += 1
+            failure = mock._failures.pop(0) if mock._failures else None
+        if failure is not None:
+            status, retry_after = failure
+            self._send(status, {'detail': 'Failure of the mock server'},
+                       {'Retry-After': str(retry_after)} if retry_after is not None else None)
+            return
+
+        if mock.api_key and self.headers.get('Authorization') != f"Token {mock.api_key}":
+            self._send(401, {'detail': 'Authentication credentials were not provided.'})
+            return
+
+        url = urlsplit(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            body = json.loads(payload) if payload else None
+        except ValueError:
+            self._send(400, {'detail': 'JSON parse error'})
+            return
+
+        for route_method, pattern, action in mock._routes:
+            match = re.fullmatch(pattern, url.path.rstrip('/'))
+            if route_method == method and match:
+                status, answer = action(*[int(group) for group in match.groups()], params=params, body=body)
+                self._send(status, answer)
+                return
+        self._send(404, {'detail': 'Not found.'})
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+
+class LabelStudioMockServer:
+    """
+    In-memory stand-in of the Label Studio API, served from a background thread. Use it as a context manager, which
+    starts and stops the server.
+
+    :param host:
+        - Type: str
+        - Description: Address the server listens on.
+
+    :param port:
+        - Type: int
+        - Description: Port of the server. Default is 0: a free port is chosen (see `url`).
+
+    :param api_key:
+        - Type: str
+        - Description: Access token expected in the 'Authorization: Token <key>' header, or None to accept all the
+                       requests.
+    """
+
+    def __init__(self, host:str='127.0.0.1', port:int=0, api_key:str=None):
+        self.api_key = api_key
+        self.projects = {}
+        self.tasks = {}
+        self.annotations = {}
+        self.stats = {'connections': 0, 'requests': 0}
+        self._failures = []
+        self._lock = threading.RLock()
+        self._next_ids = {'project': 1, 'task': 1, 'annotation': 1, 'prediction': 1}
+        self._last_time = None
+        self._routes = [
+            ('GET', r'/api/projects/(\d+)', self._get_project),
+            ('POST', r'/api/projects/(\d+)/import', self._import_tasks),
+            ('GET', r'/api/tasks', self._list_tasks),
+            ('POST', r'/api/tasks/(\d+)/annotations', self._create_annotation),
+            ('PATCH', r'/api/annotations/(\d+)', self._update_annotation),
+        ]
+
+        handler = type('Handler', (_Handler,), {'mock': self})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """
+        URL of the server, e.g. 'http://127.0.0.1:54321'.
+        """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.stop()
+
+    def start(self):
+        """
+        Starts serving the requests in a background thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, name='ls_mock_server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops the server and closes its socket.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def fail_next(self, requests:int=1, status:int=503, retry_after:int=None) -> None:
+        """
+        Answers the next `requests` requests with the error `status` (and a 'Retry-After' header, in seconds).
+        """
+        with self._lock:
+            self._failures.extend([(status, retry_after)] * requests)
+
+    def _new_id(self, kind:str) -> int:
+        new_id = self._next_ids[kind]
+        self._next_ids[kind] += 1
+        return new_id
+
+    def _now(self) -> str:
+        # Strictly increasing dates, as two updates within the same microsecond would have the same date
+        now = datetime.now(timezone.utc)
+        if self._last_time is not None and now <= self._last_time:
+            now = self._last_time + timedelta(microseconds=1)
+        self._last_time = now
+        return now.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+    def create_project(self, title:str='project') -> int:
+        """
+        Creates an empty project and returns its ID.
+        """
+        with self._lock:
+            project_id = self._new_id('project')
+            self.projects[project_id] = {'id': project_id, 'title': title, 'created_at': self._now()}
+            return project_id
+
+    def annotate(self, task_id:int, result:list, was_cancelled:bool=False, annotation_id:int=None) -> dict:
+        """
+        Adds an annotation to a task, or updates the annotation `annotation_id`, as an annotator would in Label Studio.
+
+        :return:
+            - Type: dict
+            - Description: The annotation.
+        """
+        with self._lock:
+            if annotation_id is None:
+                return self._create_annotation(task_id, body={'result': result, 'was_cancelled': was_cancelled})[1]
+            return self._update_annotation(annotation_id, body={'result': result, 'was_cancelled': was_cancelled})[1]
+
+    def _get_project(self, project_id:int, params:dict=None, body=None) -> tuple:
+        with self._lock:
+            project = self.projects.get(project_id)
+            if project is None:
+                return 404, {'detail': 'Not found.'}
+            task_count = sum(1 for task in self.tasks.values() if task['project'] == project_id)
+            return 200, {**project, 'task_number': task_count}
+
+    def _import_tasks(self, project_id:int, params:dict=None, body=None) -> tuple:
+        if project_id not in self.projects:
+            return 404, {'detail': 'Not found.'}
+        if not isinstance(body, list):
+            body = [body] if isinstance(body, dict) else []
+
+        counts = {'task_count': 0, 'annotation_count': 0, 'prediction_count': 0}
+        with self._lock:
+            for item in body:
+                # Label Studio also accepts the data of the task alone
+                data = item['data'] if 'data' in item else item
+                now = self._now()
+                task = {'id': self._new_id('task'), 'data': data, 'meta': item.get('meta', {}), 'project': project_id,
+                        'created_at': now, 'updated_at': now, 'is_labeled': False, 'annotations': [],
+                        'predictions': []}
+                for prediction in item.get('predictions', []) if 'data' in item else []:
+                    task['predictions'].append({**prediction, 'id': self._new_id('prediction'), 'task': task['id'],
+                                                'created_at': now, 'updated_at': now})
+                    counts['prediction_count'] += 1
+                self.tasks[task['id']] = task
+                for annotation in item.get('annotations', []) if 'data' in item else []:
+                    self._create_annotation(task['id'], body=annotation)
+                    counts['annotation_count'] += 1
+                counts['task_count'] += 1
+        return 201, {**counts, 'duration': 0.0, 'file_upload_ids': [], 'could_be_tasks_list': False,
+                     'found_formats': [], 'data_columns': []}
+
+    def _list_tasks(self, params:dict=None, body=None) -> tuple:
+        params = params or {}
+        query = json.loads(params.get('query') or '{}')
+        page, page_size = int(params.get('page', 1)), int(params.get('page_size', 100))
+
+        with self._lock:
+            tasks = [task for task in self.tasks.values()
+                     if 'project' not in params or task['project'] == int(params['project'])]
+            for item in (query.get('filters') or {}).get('items', []):
+                if item.get('filter') == 'filter:tasks:updated_at' and item.get('operator') == 'greater':
+                    after = _parse_time(item['value'])
+                    tasks = [task for task in tasks if _parse_time(task['updated_at']) > after]
+            for ordering in reversed(query.get('ordering') or ['tasks:id']):
+                field = ordering.lstrip('-').split(':')[-1]
+                tasks.sort(key=lambda task: task[field], reverse=ordering.startswith('-'))
+
+            start = (page - 1) * page_size
+            if page < 1 or (page > 1 and start >= len(tasks)):
+                return 404, {'detail': 'Invalid page.'}
+            page_tasks = json.loads(json.dumps(tasks[start:start + page_size]))
+            return 200, {'tasks': page_tasks, 'total': len(tasks),
+                         'total_annotations': sum(len(task['annotations']) for task in tasks),
+                         'total_predictions': sum(len(task['predictions']) for task in tasks)}
+
+    def _create_annotation(self, task_id:int, params:dict=None, body=None) -> tuple:
+        body = body or {}
+        with self._lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                return 404, {'detail': 'Not found.'}
+            now = self._now()
+            annotation = {'id': self._new_id('annotation'), 'result': body.get('result', []),
+                          'was_cancelled': bool(body.get('was_cancelled', False)), 'ground_truth': False,
+                          'created_at': now, 'updated_at': now, 'lead_time': body.get('lead_time', 0.0),
+                          'completed_by': body.get('completed_by', 1), 'task': task_id, 'project': task['project']}
+            task['annotations'].append(annotation)
+            self.annotations[annotation['id']] = annotation
+            self._touch(task, now)
+            return 201, annotation
+
+    def _update_annotation(self, annotation_id:int, params:dict=None, body=None) -> tuple:
+        body = body or {}
+        with self._lock:
+            annotation = self.annotations.get(annotation_id)
+            if annotation is None:
+                return 404, {'detail': 'Not found.'}
+            now = self._now()
+            annotation.update({name: body[name] for name in ('result', 'was_cancelled', 'lead_time') if name in body})
+            annotation['updated_at'] = now
+            self._touch(self.tasks[annotation['task']], now)
+            return 200, annotation
+
+    @staticmethod
+    def _touch(task:dict, now:str) -> None:
+        task['updated_at'] = now
+        task['is_labeled'] = any(not annotation['was_cancelled'] for annotation in task['annotations'])
@@ -9,12 +9,16 @@ Functions included:
 3. change_id: Modifies the 'id' field in a JSON file to reflect the file's basename.
 4. get_files: Retrieves a list of files with a specified extension from a folder.
 5. exclude_training_images: Filters out images used for training from a list of file paths.
+6. load_data_from_files: Reads the lines of a list of text files.
+7. find_image_path: Finds an image of a folder from its base name, whatever its extension.
 """
 
 import glob
 import json
 from pathlib import Path
 
+from file_index import IMG_EXTS, get_folder_index
+
 def open_json_file(file_name:str) -> dict:
     """
     This function opens corrected annotation files retrieved from Label Studio, in JSON format.
@@ -149,11 +153,12 @@ def find_image_path(img_folder: Path, image_name: str) -> Path:
 
     Notes
     -----
-    Supported extensions are: .jpg, .jpeg, .png, .tiff
+    Supported extensions are: .jpg, .jpeg, .png, .tif, .tiff (see `file_index.IMG_EXTS`)
+    The folder is indexed once by stem (see `file_index.get_folder_index`), and indexed again only when its content
+    changed, so finding many images of the same folder does not probe the file system for each extension.
     """
 
-    for ext in {'.jpg', '.jpeg', '.png', '.tiff'}:
-        candidate = img_folder / f"{image_name}{ext}"
-        if candidate.exists():
-            return candidate
+    image_path = get_folder_index(img_folder, IMG_EXTS).get(image_name)
+    if image_path is not None:
+        return Path(image_path)
     raise FileNotFoundError(f"No image found for '{image_name}' in {img_folder}")
@@ -0,0 +1,351 @@
+"""
+The following module finds the near-duplicate images of a project (the same folio scanned again, re-encoded or
+slightly cropped) with a perceptual hash.
+
+The perceptual hash (pHash) of an image is a 64-bit integer computed from the low frequencies of its discrete cosine
+transform: two scans of the same page have hashes that differ by a few bits only, whatever their file format or
+resolution. The number of different bits (Hamming distance) is looked up in a BK-tree, so that finding the hashes
+within a distance of a hash does not compare it with every hash of the project.
+
+The hashes are kept in a SQLite index ('image_inputs/image_hashes.sqlite') keyed by the absolute path of each image,
+with the size and modification time of the file: an image is only hashed again when it is new or has changed.
+The new images are hashed in parallel, by several processes.
+
+Functions included:
+1. compute_phash: Computes the perceptual hash of an image.
+2. hamming_distance: Returns the number of different bits between two hashes.
+3. BKTree: Finds the hashes within a Hamming distance of a hash.
+4. refresh_image_hashes: Updates the hash index for a folder (only new or changed images are hashed) and returns its hashes.
+5. find_near_duplicates: Finds, for each image, the closest near-duplicate in a set of reference images.
+6. group_near_duplicates: Groups the near-duplicate images of a set under one representative image.
+7. copy_duplicate_labels: Copies the label file of each representative image to its near-duplicates.
+"""
+
+import os
+import shutil
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from file_index import IMG_EXTS, scan_folder
+from instrumentation import count, get_logger, span
+
+
+logger = get_logger('near_duplicates')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    path     TEXT PRIMARY KEY,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    phash    TEXT
+);
+"""
+
+
+def compute_phash(img_path:str, hash_size:int=8, highfreq_factor:int=4) -> int:
+    """
+    Computes the perceptual hash of an image: the image is converted to grayscale and reduced to
+    (hash_size * highfreq_factor) pixels square, and each bit of the hash tells whether a coefficient of the
+    top-left (lowest frequencies) hash_size x hash_size block of its DCT is above the median of the block.
+
+    :param img_path:
+        - Type: str
+        - Description: Path to the image.
+
+    :param hash_size:
+        - Type: int
+        - Description: Side of the DCT block kept; the hash has hash_size * hash_size bits.
+
+    :param highfreq_factor:
+        - Type: int
+        - Description: Ratio between the side of the reduced image and the side of the DCT block.
+
+    :return:
+        - Type: int
+        - Description: The hash, or None if the image could not be read.
+    """
+    import cv2
+    import numpy as np
+
+    # JPEG files are decoded directly at a quarter of their size
+    image = cv2.imread(str(img_path), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if image is None:
+        image = cv2.imread(str(img_path), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        logger.warning(f"Could not read image {img_path}")
+        return None
+
+    side = hash_size * highfreq_factor
+    reduced = cv2.resize(image, (side, side), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_frequencies = cv2.dct(reduced)[:hash_size, :hash_size]
+
+    bits = (low_frequencies > np.median(low_frequencies)).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distance(hash_a:int, hash_b:int) -> int:
+    """
+    Returns the number of different bits between two hashes.
+    """
+    return bin(hash_a ^ hash_b).count('1')
+
+
+class BKTree:
+    """
+    A BK-tree of hashes, for the Hamming distance. Each node keeps its children by their distance to the node: as the
+    distance is a metric, the search for the hashes within `radius` of a hash only visits the children whose
+    distance to the node is within `radius` of the distance between the node and the hash.
+
+    Each hash is stored with the keys (e.g. image paths) it was added with.
+    """
+
+    def __init__(self, items=None):
+        # Node: [hash, keys, {distance: child node}]
+        self._root = None
+        self._size = 0
+        for value, key in items or []:
+            self.add(value, key)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, value:int, key) -> None:
+        """
+        Adds a hash with its key.
+        """
+        self._size += 1
+        if self._root is None:
+            self._root = [value, [key], {}]
+            return
+
+        node = self._root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                node[1].append(key)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [key], {}]
+                return
+            node = child
+
+    def search(self, value:int, radius:int) -> list:
+        """
+        Returns the (distance, key) pairs of the hashes within `radius` of `value`, sorted by distance then key.
+        """
+        if self._root is None:
+            return []
+
+        matches = []
+        nodes = [self._root]
+        while nodes:
+            node = nodes.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= radius:
+                matches.extend((distance, key) for key in node[1])
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    nodes.append(child)
+
+        return sorted(matches, key=lambda match: (match[0], str(match[1])))
+
+
+def _connect(db_path) -> sqlite3.Connection:
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(str(db_path))
+    connection.row_factory = sqlite3.Row
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def _hash_images(img_paths:list, workers:int) -> list:
+    if workers == 1 or len(img_paths) < 2:
+        return [compute_phash(path) for path in img_paths]
+
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(img_paths) // (4 * workers))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(compute_phash, img_paths, chunksize=chunksize))
+
+
+def refresh_image_hashes(img_folder:str, db_path:str, recursive:bool=True, workers:int=None) -> dict:
+    """
+    Updates the hash index for all the images of a folder and returns their hashes.
+
+    Only new or changed images (different size or modification time) are hashed, in parallel.
+    Entries of images that no longer exist in the folder are removed from the index.
+    Hidden files and images inside hidden directories (whose names start with '.') are ignored.
+
+    :param img_folder:
+        - Type: str
+        - Description: Path to the folder containing the images.
+
+    :param db_path:
+        - Type: str
+        - Description: Path to the SQLite hash index (created if it does not exist).
+
+    :param recursive:
+        - Type: bool
+        - Description: If True (default), images in subfolders are hashed too.
+
+    :param workers:
+        - Type: int
+        - Description: Number of processes used to hash the new images. None uses all the CPU cores,
+                       1 disables multiprocessing.
+
+    :return:
+        - Type: dict
+        - Description: The hash (int) of each readable image, by absolute path.
+    """
+    img_folder = Path(img_folder)
+    if not img_folder.exists():
+        return {}
+
+    with span('list'):
+        img_paths = [str(Path(path).resolve()) for path in scan_folder(img_folder, IMG_EXTS, recursive=recursive)]
+    count('files_scanned', len(img_paths))
+
+    connection = _connect(db_path)
+    try:
+        prefix = str(img_folder.resolve()).rstrip(os.sep) + os.sep
+        indexed = {row['path']: row for row in connection.execute(
+            "SELECT * FROM hashes WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))}
+
+        hashes, to_hash = {}, []
+        for path in img_paths:
+            stat = os.stat(path)
+            row = indexed.get(path)
+            if row is not None and row['size'] == stat.st_size and row['mtime_ns'] == stat.st_mtime_ns:
+                if row['phash'] is not None:
+                    hashes[path] = int(row['phash'], 16)
+                continue
+            to_hash.append((path, stat))
+
+        count('hashes_cached', len(img_paths) - len(to_hash))
+        count('images_hashed', len(to_hash))
+        if to_hash:
+            with span('hash'):
+                values = _hash_images([path for path, _ in to_hash], workers)
+            rows = []
+            for (path, stat), value in zip(to_hash, values):
+                rows.append((path, stat.st_size, stat.st_mtime_ns, None if value is None else f"{value:016x}"))
+                if value is not None:
+                    hashes[path] = value
+            connection.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)", rows)
+
+        # Forget the images that were removed from the folder
+        listed = set(img_paths)
+        removed = [(path,) for path in indexed
+                   if path not in listed and (recursive or str(Path(path).parent) + os.sep == prefix)]
+        if removed:
+            connection.executemany("DELETE FROM hashes WHERE path = ?", removed)
+        connection.commit()
+    finally:
+        connection.close()
+
+    return hashes
+
+
+def find_near_duplicates(hashes:dict, reference_hashes:dict, radius:int=4) -> dict:
+    """
+    Finds, for each image of `hashes`, the closest image of `reference_hashes` whose hash is within `radius` bits
+    (e.g. the evaluation images that are near-duplicates of training images). An image is not compared with itself.
+
+    :param hashes:
+        - Type: dict
+        - Description: Hashes of the images to look up, by path (see `refresh_image_hashes`).
+
+    :param reference_hashes:
+        - Type: dict
+        - Description: Hashes of the reference images, by path.
+
+    :param radius:
+        - Type: int
+        - Description: Largest Hamming distance between near-duplicates (out of 64 bits). Default is 4.
+
+    :return:
+        - Type: dict
+        - Description: (distance, reference path) of the closest reference image, by path of the images
+                       that have at least one near-duplicate.
+    """
+    with span('bk_tree'):
+        tree = BKTree((value, path) for path, value in reference_hashes.items())
+
+    duplicates = {}
+    with span('lookup'):
+        for path, value in hashes.items():
+            matches = [match for match in tree.search(value, radius) if match[1] != path]
+            if matches:
+                duplicates[path] = matches[0]
+
+    count('near_duplicates', len(duplicates))
+    return duplicates
+
+
+def group_near_duplicates(hashes:dict, radius:int=4) -> dict:
+    """
+    Groups the near-duplicate images of a set: the images are taken in the order of their paths, and an image
+    whose hash is within `radius` bits of an earlier representative image is attached to the closest one,
+    otherwise it becomes a representative itself.
+
+    :param hashes:
+        - Type: dict
+        - Description: Hashes of the images, by path (see `refresh_image_hashes`).
+
+    :param radius:
+        - Type: int
+        - Description: Largest Hamming distance between near-duplicates (out of 64 bits). Default is 4.
+
+    :return:
+        - Type: dict
+        - Description: The representative path of each near-duplicate image, by path.
+                       Representative images are not keys of the dict.
+    """
+    tree = BKTree()
+    duplicates = {}
+    with span('group'):
+        for path in sorted(hashes):
+            matches = tree.search(hashes[path], radius)
+            if matches:
+                duplicates[path] = matches[0][1]
+            else:
+                tree.add(hashes[path], path)
+
+    count('near_duplicates', len(duplicates))
+    return duplicates
+
+
+def copy_duplicate_labels(duplicates:dict, labels_folder:str) -> int:
+    """
+    Copies the label file of each representative image ('<labels_folder>/<stem>.txt') to each of its near-duplicates,
+    so that the near-duplicates get the predictions of their representative without being predicted.
+    The near-duplicates of a representative without a label file (no detections) do not get one either.
+
+    :param duplicates:
+        - Type: dict
+        - Description: The representative path of each near-duplicate image (see `group_near_duplicates`).
+
+    :param labels_folder:
+        - Type: str
+        - Description: Folder of the label files.
+
+    :return:
+        - Type: int
+        - Description: Number of label files copied.
+    """
+    labels_folder = Path(labels_folder)
+    copied = 0
+    for path, representative in duplicates.items():
+        source = labels_folder / f"{Path(representative).stem}.txt"
+        destination = labels_folder / f"{Path(path).stem}.txt"
+        if source.exists():
+            shutil.copyfile(source, destination)
+            copied += 1
+        elif destination.exists():
+            # Predictions of a previous run
+            destination.unlink()
+
+    count('labels_reused', copied)
+    return copied
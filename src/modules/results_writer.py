@@ -0,0 +1,287 @@
+"""
+The following module writes the prediction and evaluation results as typed, columnar Parquet files, streamed by
+row groups, instead of building one pandas DataFrame of all the rows at the end of a run.
+
+The rows are buffered and written every `row_group_size` rows, so the memory used does not depend on the number of
+detections. The columns are typed: the coordinates are numeric columns (no space-joined strings to parse again), the
+class names and statuses are dictionary-encoded (categorical), and a results file can be read back column by column
+(`read_results`): computing the metrics only reads the class, status, IoU and confidence columns.
+
+A results file is a Parquet dataset folder ('<name>.parquet/'), optionally partitioned by one column
+('<column>=<value>/part-00000.parquet', Hive layout, readable by pandas, pyarrow, DuckDB or Spark). It is written in
+a temporary folder and replaces the previous one when the writer is closed. The ';'-separated CSV file of the
+previous versions can still be exported, streamed by row group too.
+
+Functions included:
+1. PREDICTION_COLUMNS / EVALUATION_COLUMNS: Columns and types of the prediction and evaluation results.
+2. ResultsWriter: Streams rows to a Parquet dataset (and optionally a CSV file), by row groups.
+3. read_results: Reads some columns of a Parquet results dataset (or of a CSV results file) as a DataFrame.
+"""
+
+import os
+import shutil
+from pathlib import Path
+from urllib.parse import quote
+
+from instrumentation import count, get_logger, span
+
+
+logger = get_logger('results_writer')
+
+# Column types: 'string', 'category' (dictionary-encoded string), 'int' (int32) and 'float' (float64), all nullable
+PREDICTION_COLUMNS = [
+    ('Image_Path', 'string'), ('Image_Width', 'int'), ('Image_Height', 'int'), ('YOLO_Results_File', 'string'),
+    ('Class_Id', 'int'), ('Class_Name', 'category'),
+    ('X_center', 'float'), ('Y_center', 'float'), ('Width', 'float'), ('Height', 'float'),
+    ('Abs_X', 'int'), ('Abs_Y', 'int'), ('Abs_Width', 'int'), ('Abs_Height', 'int'),
+    ('Confidence', 'float'),
+]
+
+EVALUATION_COLUMNS = [
+    ('Filename', 'string'), ('Predicted_class', 'category'), ('TP/FP/FN', 'category'),
+    ('Corrected_class', 'category'), ('IoU', 'float'), ('Confidence_score', 'float'),
+    ('Predicted_x_center', 'float'), ('Predicted_y_center', 'float'),
+    ('Predicted_width', 'float'), ('Predicted_height', 'float'),
+    ('Corrected_x_center', 'float'), ('Corrected_y_center', 'float'),
+    ('Corrected_width', 'float'), ('Corrected_height', 'float'),
+]
+
+# Name of the partition of the rows whose partition column is empty (Hive convention)
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+def _arrow_type(column_type:str):
+    import pyarrow as pa
+
+    return {'string': pa.string(), 'category': pa.dictionary(pa.int32(), pa.string()),
+            'int': pa.int32(), 'float': pa.float64()}[column_type]
+
+
+class ResultsWriter:
+    """
+    Streams result rows to a Parquet dataset, one row group every `row_group_size` rows, and optionally to a
+    ';'-separated CSV file. Use it as a context manager:
+
+        with ResultsWriter(output_folder, EVALUATION_COLUMNS, csv_file=csv_file) as writer:
+            for image_rows in ...:
+                writer.write_rows(image_rows)
+
+    :param output_folder:
+        - Type: str
+        - Description: Path of the Parquet dataset folder ('<name>.parquet'). A previous dataset is replaced
+                       when the writer is closed.
+
+    :param columns:
+        - Type: list of tuple
+        - Description: (name, type) of the columns (see `PREDICTION_COLUMNS` and `EVALUATION_COLUMNS`).
+                       Missing or empty ('') values of the rows are written as nulls.
+
+    :param partition_by:
+        - Type: str
+        - Description: Name of a column to partition the dataset by (one folder per value), or None.
+
+    :param row_group_size:
+        - Type: int
+        - Description: Number of rows buffered before they are written as a row group.
+
+    :param csv_file:
+        - Type: str
+        - Description: Path of a ';'-separated CSV file to export the rows to as well, or None.
+    """
+
+    def __init__(self, output_folder:str, columns:list, partition_by:str=None, row_group_size:int=65536,
+                 csv_file:str=None):
+        import pyarrow as pa
+
+        self.output_folder = Path(output_folder)
+        self.columns = list(columns)
+        self.partition_by = partition_by
+        self.row_group_size = max(1, int(row_group_size))
+        self.csv_file = Path(csv_file) if csv_file else None
+
+        self.schema = pa.schema([(name, _arrow_type(column_type)) for name, column_type in self.columns])
+        self._buffer = {name: [] for name, _ in self.columns}
+        self._buffered = 0
+        self._writers = {}
+        self._csv_handle = None
+        self._csv_writer = None
+        self.stats = {'rows': 0, 'row_groups': 0, 'files': 0}
+
+        # Written in a temporary folder, which replaces the output folder when the writer is closed
+        self._tmp_folder = self.output_folder.with_name(self.output_folder.name + '.tmp')
+        shutil.rmtree(self._tmp_folder, ignore_errors=True)
+        self._tmp_folder.mkdir(parents=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._abort()
+
+    def write_rows(self, rows:list) -> None:
+        """
+        Adds rows (dicts keyed by column name) to the buffer, and writes a row group when it is full.
+        """
+        for row in rows:
+            for name, values in self._buffer.items():
+                value = row.get(name)
+                values.append(None if value == '' else value)
+        self._buffered += len(rows)
+        if self._buffered >= self.row_group_size:
+            self._flush()
+
+    def _table(self):
+        import pyarrow as pa
+
+        arrays = []
+        for (name, column_type), field in zip(self.columns, self.schema):
+            if column_type == 'category':
+                arrays.append(pa.array(self._buffer[name], type=pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array(self._buffer[name], type=field.type))
+        return pa.Table.from_arrays(arrays, schema=self.schema)
+
+    def _parquet_writer(self, partition:str):
+        import pyarrow.parquet as pq
+
+        writer = self._writers.get(partition)
+        if writer is None:
+            folder = self._tmp_folder
+            schema = self.schema
+            if self.partition_by is not None:
+                folder = folder / f"{self.partition_by}={partition}"
+                folder.mkdir(parents=True, exist_ok=True)
+                # The partition column is stored in the folder names
+                schema = schema.remove(schema.get_field_index(self.partition_by))
+            writer = pq.ParquetWriter(str(folder / 'part-00000.parquet'), schema, compression='zstd')
+            self._writers[partition] = writer
+            self.stats['files'] += 1
+        return writer
+
+    def _flush(self) -> None:
+        if not self._buffered:
+            return
+        import pyarrow.compute as pc
+
+        with span('write_results'):
+            table = self._table()
+
+            if self.partition_by is None:
+                self._parquet_writer(None).write_table(table)
+            else:
+                keys = table.column(self.partition_by).cast('string')
+                partition_table = table.drop_columns([self.partition_by])
+                for value in pc.unique(keys).to_pylist():
+                    mask = pc.is_null(keys) if value is None else pc.equal(keys, value)
+                    partition = NULL_PARTITION if value is None else quote(value, safe='')
+                    self._parquet_writer(partition).write_table(partition_table.filter(mask))
+
+            if self.csv_file is not None:
+                self._write_csv(table)
+
+        self.stats['rows'] += self._buffered
+        self.stats['row_groups'] += 1
+        count('result_rows_written', self._buffered)
+        self._buffer = {name: [] for name, _ in self.columns}
+        self._buffered = 0
+
+    def _write_csv(self, table) -> None:
+        import csv
+
+        if self._csv_writer is None:
+            self.csv_file.parent.mkdir(parents=True, exist_ok=True)
+            self._csv_handle = open(self.csv_file, 'w', newline='', encoding='utf-8')
+            # Same layout as the CSV files of the previous versions: ';' separated, empty cells for nulls
+            self._csv_writer = csv.writer(self._csv_handle, delimiter=';', lineterminator='\n')
+            self._csv_writer.writerow(table.column_names)
+        self._csv_writer.writerows(zip(*(column.to_pylist() for column in table.columns)))
+
+    def _close_writers(self) -> None:
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+        if self._csv_writer is not None:
+            self._csv_handle.close()
+            self._csv_writer = None
+
+    def _abort(self) -> None:
+        self._close_writers()
+        shutil.rmtree(self._tmp_folder, ignore_errors=True)
+
+    def close(self) -> dict:
+        """
+        Writes the last row group, closes the files and replaces the previous dataset by the new one.
+
+        :return:
+            - Type: dict
+            - Description: {'rows', 'row_groups', 'files'} written.
+        """
+        self._flush()
+        if not self._writers:
+            # No rows: an empty dataset with the schema of the columns, not partitioned (the partition column
+            # could not be discovered from an empty partition), so that it is still read with all its columns
+            import pyarrow.parquet as pq
+
+            pq.write_table(self.schema.empty_table(), str(self._tmp_folder / 'part-00000.parquet'), compression='zstd')
+            self.stats['files'] += 1
+        self._close_writers()
+
+        if self.output_folder.exists():
+            old_folder = self.output_folder.with_name(self.output_folder.name + '.old')
+            shutil.rmtree(old_folder, ignore_errors=True)
+            os.replace(self.output_folder, old_folder)
+            os.replace(self._tmp_folder, self.output_folder)
+            shutil.rmtree(old_folder, ignore_errors=True)
+        else:
+            os.replace(self._tmp_folder, self.output_folder)
+
+        return self.stats
+
+
+def read_results(source:str, columns:list=None, filters=None):
+    """
+    Reads a results file as a DataFrame, column by column: only the requested columns are read from disk.
+    Categorical columns (class names, statuses, partition columns) are returned as pandas categoricals.
+
+    :param source:
+        - Type: str or Path
+        - Description: Path to a Parquet results dataset ('<name>.parquet', see `ResultsWriter`), or to a
+                       ';'-separated CSV results file.
+
+    :param columns:
+        - Type: list of str
+        - Description: Names of the columns to read. None reads all the columns.
+
+    :param filters:
+        - Type: pyarrow.compute.Expression
+        - Description: Filter on the rows of a Parquet dataset (e.g. `pc.field('Class_Name') == 'title'`, which
+                       only reads the matching partitions). Ignored for CSV files.
+
+    :return:
+        - Type: pandas.DataFrame
+    """
+    source = Path(source)
+    if source.suffix.lower() == '.csv':
+        import pandas as pd
+
+        return pd.read_csv(source, sep=';', usecols=columns)
+
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    # Partition values are read as categories, whatever they look like (e.g. class names made of digits)
+    dataset = ds.dataset(str(source), format='parquet', partitioning=ds.HivePartitioning.discover(infer_dictionary=True))
+    with span('read_results'):
+        table = dataset.to_table(columns=columns, filter=filters)
+
+    # The dictionaries differ between row groups and partitions: the categories are rebuilt once by pandas
+    categories = [field.name for field in table.schema if pa.types.is_dictionary(field.type)]
+    table = table.cast(pa.schema([(field.name, pa.string() if field.name in categories else field.type)
+                                  for field in table.schema]))
+    df = table.to_pandas()
+    for name in categories:
+        df[name] = df[name].astype('category')
+    return df
@@ -0,0 +1,187 @@
+"""
+The following module records the inputs of the pipeline stages in a manifest, so that a stage can be skipped
+when its inputs did not change since its last successful run, or re-run only on the files that changed.
+
+Each input file is identified by its content hash (SHA-256). Hashing is only done for files whose size or
+modification time changed since the previous snapshot: the hashes of untouched files are reused, so taking a
+snapshot of a large unchanged dataset only costs one `stat` per file.
+
+The manifest is a JSON file:
+    {'version': 1,
+     'stages': {<stage>: {'params': {...}, 'inputs': {<path>: {'size', 'mtime_ns', 'hash'}}, 'outputs': [...],
+                          'completed': <ISO date>}}}
+
+Functions included:
+1. hash_file: Returns the SHA-256 hash of a file.
+2. list_files: Lists the files of a folder (non-hidden, optionally filtered by extension).
+3. snapshot_files: Returns the size, modification time and content hash of a list of files.
+4. diff_snapshots: Compares two snapshots and returns the files added, changed and removed.
+5. load_pipeline_manifest: Reads the pipeline manifest.
+6. save_pipeline_manifest: Writes the pipeline manifest atomically.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+
+MANIFEST_VERSION = 1
+
+
+def hash_file(file_path:str, chunk_size:int=1024 * 1024) -> str:
+    """
+    Returns the SHA-256 hash of a file, read by chunks.
+
+    :param file_path:
+        - Type: str
+        - Description: Path to the file.
+
+    :param chunk_size:
+        - Type: int
+        - Description: Size of the chunks read, in bytes.
+
+    :return:
+        - Type: str
+        - Description: The hexadecimal SHA-256 digest of the file content.
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def list_files(folder:str, extensions:set=None, recursive:bool=False) -> list:
+    """
+    Lists the files of a folder. Hidden files and hidden folders (names starting with '.') are ignored.
+
+    :param folder:
+        - Type: str
+        - Description: Path to the folder. A missing folder has no files.
+
+    :param extensions:
+        - Type: set of str
+        - Description: Lower-case extensions to keep (e.g. {'.jpg', '.png'}). None keeps all the files.
+
+    :param recursive:
+        - Type: bool
+        - Description: If True, the sub-folders are listed too.
+
+    :return:
+        - Type: list of str
+        - Description: The paths of the files, sorted.
+    """
+    files = []
+    if not Path(folder).is_dir():
+        return files
+
+    for entry in os.scandir(folder):
+        if entry.name.startswith('.'):
+            continue
+        if entry.is_dir():
+            if recursive:
+                files.extend(list_files(entry.path, extensions, recursive))
+        elif entry.is_file() and (extensions is None or Path(entry.name).suffix.lower() in extensions):
+            files.append(entry.path)
+    return sorted(files)
+
+
+def snapshot_files(file_paths:list, previous:dict=None) -> dict:
+    """
+    Returns the size, modification time and content hash of a list of files. The hash of a file whose size and
+    modification time are the same as in the previous snapshot is reused instead of being computed again.
+
+    :param file_paths:
+        - Type: list of str
+        - Description: Paths to the files (missing files are ignored).
+
+    :param previous:
+        - Type: dict
+        - Description: A previous snapshot of these files, or None.
+
+    :return:
+        - Type: dict
+        - Description: Dictionary mapping each path to {'size', 'mtime_ns', 'hash'}.
+    """
+    previous = previous or {}
+    snapshot = {}
+    for file_path in file_paths:
+        file_path = str(file_path)
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            continue
+
+        old = previous.get(file_path)
+        if old is not None and old['size'] == stat.st_size and old['mtime_ns'] == stat.st_mtime_ns:
+            file_hash = old['hash']
+        else:
+            file_hash = hash_file(file_path)
+        snapshot[file_path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': file_hash}
+    return snapshot
+
+
+def diff_snapshots(previous:dict, current:dict) -> dict:
+    """
+    Compares two snapshots of the same inputs. A file whose modification time changed but whose content hash
+    is the same is not considered changed.
+
+    :param previous:
+        - Type: dict
+        - Description: The snapshot of the last successful run (see `snapshot_files`).
+
+    :param current:
+        - Type: dict
+        - Description: The current snapshot.
+
+    :return:
+        - Type: dict
+        - Description: {'added', 'changed', 'removed'}: sorted lists of paths.
+    """
+    added = sorted(path for path in current if path not in previous)
+    removed = sorted(path for path in previous if path not in current)
+    changed = sorted(path for path in current if path in previous and current[path]['hash'] != previous[path]['hash'])
+    return {'added': added, 'changed': changed, 'removed': removed}
+
+
+def load_pipeline_manifest(manifest_file:str) -> dict:
+    """
+    Reads the pipeline manifest.
+
+    :param manifest_file:
+        - Type: str
+        - Description: Path to the manifest JSON file.
+
+    :return:
+        - Type: dict
+        - Description: The manifest, or an empty manifest if the file does not exist or was written by another version.
+    """
+    empty = {'version': MANIFEST_VERSION, 'stages': {}}
+    if not Path(manifest_file).exists():
+        return empty
+
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    return manifest if manifest.get('version') == MANIFEST_VERSION else empty
+
+
+def save_pipeline_manifest(manifest:dict, manifest_file:str) -> None:
+    """
+    Writes the pipeline manifest. The file is written next to the manifest and then renamed, so an interrupted
+    run never leaves a truncated manifest.
+
+    :param manifest:
+        - Type: dict
+        - Description: The manifest.
+
+    :param manifest_file:
+        - Type: str
+        - Description: Path to the manifest JSON file.
+    """
+    manifest_file = Path(manifest_file)
+    manifest_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = manifest_file.with_name(manifest_file.name + '.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    tmp_file.replace(manifest_file)
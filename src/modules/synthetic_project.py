@@ -0,0 +1,269 @@
+"""
+The following module generates synthetic TiamaT projects, for benchmarks and for trying the pipeline without
+real data. A synthetic project follows the folder structure expected by `folders_path`:
+
+    <root>/<project>/image_inputs/ground_truth_images/   annotated images
+    <root>/<project>/annotations/ground_truth/           Label Studio JSON exports of the annotated images
+    <root>/<project>/image_inputs/eval_images/           images to predict
+    <root>/<project>/annotations/prediction_corrections/ Label Studio JSON exports of the corrected predictions
+    <root>/output/runs/train/<model>/labels.txt          classes of the (stub) model
+    <root>/output/runs/predict/<project>_<model>/labels/ predictions of the model on the eval images
+    <root>/output/runs/predict/<project>_<model>/correctedLabels/ corrected predictions
+
+Everything is generated from a seed, so two projects generated with the same parameters are identical.
+It also provides a stub YOLO model, returning deterministic boxes without any neural network, which stands in
+for a real model when measuring the cost of the code around the predictions.
+
+Functions included:
+1. StubYOLOModel: A stand-in for `ultralytics.YOLO` whose `predict` returns deterministic boxes.
+2. generate_synthetic_project: Generates a synthetic project with its annotations, predictions and corrections.
+"""
+
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from class_names_functions import LabelMap
+
+
+class _Values:
+    """
+    Minimal stand-in for a torch tensor: `.cpu()`, `.numpy()` and `.tolist()`.
+    """
+
+    def __init__(self, values:np.ndarray):
+        self._values = values
+
+    def cpu(self):
+        return self
+
+    def numpy(self) -> np.ndarray:
+        return self._values
+
+    def tolist(self) -> list:
+        return self._values.tolist()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+
+class _Boxes:
+    def __init__(self, xywhn:np.ndarray, classes:np.ndarray, confidences:np.ndarray, width:int, height:int):
+        xyxy = np.concatenate([xywhn[:, :2] - xywhn[:, 2:] / 2, xywhn[:, :2] + xywhn[:, 2:] / 2], axis=1)
+        self.xywhn = _Values(xywhn)
+        self.xyxy = _Values(xyxy * np.array([width, height, width, height]))
+        self.cls = _Values(classes.astype(np.float32))
+        self.conf = _Values(confidences)
+
+    def __len__(self) -> int:
+        return len(self.conf)
+
+
+class _Result:
+    def __init__(self, boxes:_Boxes):
+        self.boxes = boxes
+
+
+class StubYOLOModel:
+    """
+    A stand-in for `ultralytics.YOLO` in benchmarks: `predict` accepts the same arguments and returns, for each
+    image, `boxes_per_image` boxes whose positions only depend on the image content and the seed.
+
+    :param boxes_per_image:
+        - Type: int
+        - Description: Number of boxes returned for each image.
+
+    :param n_classes:
+        - Type: int
+        - Description: Number of classes of the model.
+
+    :param latency:
+        - Type: float
+        - Description: Time in seconds spent per image, to simulate the cost of the network (default: 0).
+
+    :param seed:
+        - Type: int
+        - Description: Seed of the generated boxes.
+    """
+
+    def __init__(self, boxes_per_image:int=10, n_classes:int=5, latency:float=0.0, seed:int=0):
+        self.boxes_per_image = boxes_per_image
+        self.n_classes = n_classes
+        self.latency = latency
+        self.seed = seed
+        self.names = {class_id: f"class_{class_id}" for class_id in range(n_classes)}
+
+    def predict(self, source, **kwargs) -> list:
+        images = source if isinstance(source, list) else [source]
+        results = []
+        for image in images:
+            height, width = image.shape[:2]
+            rng = np.random.default_rng([self.seed, int(image[::max(1, height // 8), ::max(1, width // 8)].sum())])
+            xywhn = _random_boxes(rng, self.boxes_per_image)
+            classes = rng.integers(0, self.n_classes, self.boxes_per_image)
+            confidences = rng.uniform(0.25, 1.0, self.boxes_per_image).astype(np.float32)
+            results.append(_Result(_Boxes(xywhn, classes, confidences, width, height)))
+        if self.latency:
+            time.sleep(self.latency * len(images))
+        return results
+
+
+def _random_boxes(rng:np.random.Generator, n_boxes:int) -> np.ndarray:
+    sizes = rng.uniform(0.02, 0.2, (n_boxes, 2))
+    centers = rng.uniform(sizes / 2, 1 - sizes / 2)
+    return np.concatenate([centers, sizes], axis=1)
+
+
+def _ls_export(img_path:Path, boxes:np.ndarray, class_names:list, task_id:int, width:int, height:int,
+               scores:np.ndarray=None) -> dict:
+    results = []
+    for index, ((x, y, w, h), class_name) in enumerate(zip(boxes.tolist(), class_names)):
+        result = {
+            "id": f"{task_id}_{index}",
+            "type": "rectanglelabels",
+            "from_name": "label",
+            "to_name": "image",
+            "original_width": width,
+            "original_height": height,
+            "image_rotation": 0,
+            "value": {
+                "rotation": 0,
+                "x": (x - w / 2) * 100,
+                "y": (y - h / 2) * 100,
+                "width": w * 100,
+                "height": h * 100,
+                "rectanglelabels": [class_name]
+            }
+        }
+        if scores is not None:
+            result["score"] = float(scores[index])
+        results.append(result)
+
+    return {"id": task_id,
+            "result": results,
+            "task": {"id": task_id, "data": {"image": f"/data/local-files/?d={img_path.as_posix().lstrip('/')}"}}}
+
+
+def _write_yolo_file(label_path:Path, boxes:np.ndarray, classes:np.ndarray, scores:np.ndarray=None) -> None:
+    with open(label_path, 'w') as f:
+        for index, ((x, y, w, h), class_id) in enumerate(zip(boxes.tolist(), classes.tolist())):
+            line = f"{class_id} {x:.6f} {y:.6f} {w:.6f} {h:.6f}"
+            if scores is not None:
+                line += f" {scores[index]:.4f}"
+            f.write(line + "\n")
+
+
+def generate_synthetic_project(root:str, project_name:str='synthetic', n_images:int=1000, n_eval_images:int=None,
+                               boxes_per_image:int=10, n_classes:int=5, image_size:tuple=(320, 240),
+                               model_name:str='stub_model', seed:int=0) -> dict:
+    """
+    Generates a synthetic project: images, Label Studio exports of their annotations, a model folder with its
+    'labels.txt', predictions on the eval images and their corrections (as Label Studio exports and YOLO files).
+
+    The images are small noise JPEGs (a few different images, written many times), so generating 100k images
+    only costs the file writes.
+
+    :param root:
+        - Type: str
+        - Description: Folder in which the project, 'data' and 'output' folders are created.
+
+    :param project_name:
+        - Type: str
+        - Description: Name of the project folder.
+
+    :param n_images:
+        - Type: int
+        - Description: Number of annotated (ground truth) images.
+
+    :param n_eval_images:
+        - Type: int
+        - Description: Number of eval images, predicted and corrected. None uses `n_images`.
+
+    :param boxes_per_image:
+        - Type: int
+        - Description: Number of boxes of each annotation, prediction and correction.
+
+    :param n_classes:
+        - Type: int
+        - Description: Number of classes ('class_0', 'class_1'...).
+
+    :param image_size:
+        - Type: tuple
+        - Description: (width, height) of the images.
+
+    :param model_name:
+        - Type: str
+        - Description: Name of the model folder, in 'output/runs/train'.
+
+    :param seed:
+        - Type: int
+        - Description: Seed of the generated content.
+
+    :return:
+        - Type: dict
+        - Description: Paths of the generated project: 'project_folder', 'model_folder', 'results_folder'.
+    """
+    import cv2
+
+    root = Path(root)
+    n_eval_images = n_images if n_eval_images is None else n_eval_images
+    width, height = image_size
+    rng = np.random.default_rng(seed)
+
+    project_folder = root / project_name
+    gt_img_folder = project_folder / 'image_inputs' / 'ground_truth_images'
+    gt_folder = project_folder / 'annotations' / 'ground_truth'
+    eval_folder = project_folder / 'image_inputs' / 'eval_images'
+    corrections_folder = project_folder / 'annotations' / 'prediction_corrections'
+    model_folder = root / 'output' / 'runs' / 'train' / model_name
+    results_folder = root / 'output' / 'runs' / 'predict' / f"{project_name}_{model_name}"
+    for folder in (gt_img_folder, gt_folder, eval_folder, corrections_folder, model_folder / 'weights',
+                   results_folder / 'labels', results_folder / 'correctedLabels'):
+        folder.mkdir(parents=True, exist_ok=True)
+
+    class_names = [f"class_{class_id}" for class_id in range(n_classes)]
+    LabelMap(dict(enumerate(class_names))).save(model_folder / 'labels.txt')
+
+    # A few distinct images, so that the stub model does not return the same boxes everywhere
+    encoded_images = []
+    for _ in range(8):
+        pixels = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        encoded_images.append(cv2.imencode('.jpg', pixels)[1].tobytes())
+
+    # Ground truth: images and one Label Studio export per task (named after the task ID, as exported)
+    for index in range(n_images):
+        img_path = gt_img_folder / f"gt_{index:06d}.jpg"
+        img_path.write_bytes(encoded_images[index % len(encoded_images)])
+
+        boxes = _random_boxes(rng, boxes_per_image)
+        classes = rng.integers(0, n_classes, boxes_per_image)
+        export = _ls_export(img_path, boxes, [class_names[c] for c in classes], index + 1, width, height)
+        with open(gt_folder / str(index + 1), 'w') as f:
+            json.dump(export, f)
+
+    # Eval images, predictions and corrections (boxes moved a little, some classes changed, some boxes removed)
+    for index in range(n_eval_images):
+        img_path = eval_folder / f"eval_{index:06d}.jpg"
+        img_path.write_bytes(encoded_images[index % len(encoded_images)])
+
+        boxes = _random_boxes(rng, boxes_per_image)
+        classes = rng.integers(0, n_classes, boxes_per_image)
+        scores = rng.uniform(0.25, 1.0, boxes_per_image)
+        _write_yolo_file(results_folder / 'labels' / f"{img_path.stem}.txt", boxes, classes, scores)
+
+        kept = rng.uniform(size=boxes_per_image) > 0.1
+        corrected = np.clip(boxes[kept] + rng.normal(0, 0.005, boxes[kept].shape), 0.001, 0.999)
+        corrected_classes = np.where(rng.uniform(size=kept.sum()) < 0.1,
+                                     rng.integers(0, n_classes, kept.sum()), classes[kept])
+        _write_yolo_file(results_folder / 'correctedLabels' / f"{img_path.stem}.txt", corrected, corrected_classes)
+
+        export = _ls_export(img_path, corrected, [class_names[c] for c in corrected_classes], 100000000 + index,
+                            width, height, scores=scores[kept])
+        with open(corrections_folder / f"{img_path.stem}.json", 'w') as f:
+            json.dump(export, f)
+
+    LabelMap(dict(enumerate(class_names))).save(results_folder / 'labels.txt')
+
+    return {'project_folder': str(project_folder), 'model_folder': str(model_folder), 'results_folder': str(results_folder)}
@@ -0,0 +1,475 @@
+"""
+The following module runs a YOLO model over very large images (e.g. 10k × 14k archival scans) tile by tile.
+Each page is split into overlapping tiles, which are sent to the model in batches at their native resolution,
+so that small objects do not vanish when the page is resized to the inference size. The detections of all the
+tiles are then merged back into page coordinates, with a non-maximum suppression (or a box fusion) across tiles,
+and saved in the usual YOLO label format, normalized by the page dimensions.
+
+Tiles are read lazily: for tiled and striped TIFF files, only the TIFF segments covering a tile are read and
+decoded (with `tifffile`, when it is installed), so the memory used by a page is bounded by the size of a batch
+of tiles, not by the size of the page. Other images (JPEG, PNG, compressed TIFFs tifffile can't decode...)
+are decoded once per page with OpenCV, and tiled in memory. The phases of a run (open, read_tiles, forward, merge,
+write) and its counters (tiles, bytes read) are reported to `instrumentation`.
+
+Functions included:
+1. get_tile_grid: Returns the positions of the overlapping tiles covering a page.
+2. open_page: Opens an image for tiled reading (lazy for TIFF files).
+3. merge_tile_detections: Merges the detections of overlapping tiles (class-agnostic NMS or box fusion).
+4. format_page_predictions: Formats page detections as lines of a YOLO label file.
+5. predict_tiled: Runs tiled inference over a list of images and writes one label file per image.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+
+import numpy as np
+
+from inference_functions import _label_writer
+from instrumentation import count, get_logger, span
+
+
+logger = get_logger('tiled_inference')
+
+
+TIFF_EXTS = {".tif", ".tiff"}
+
+
+def get_tile_grid(width:int, height:int, tile_size:int=1280, overlap:int=256) -> list:
+    """
+    Returns the positions of the tiles covering a page. Consecutive tiles overlap by `overlap` pixels, and the
+    last tile of each row and column is aligned on the page border, so all the tiles have the same size
+    (except when the page is smaller than a tile).
+
+    :param width:
+        - Type: int
+        - Description: Width of the page, in pixels.
+
+    :param height:
+        - Type: int
+        - Description: Height of the page, in pixels.
+
+    :param tile_size:
+        - Type: int
+        - Description: Size (width and height) of a tile, in pixels.
+
+    :param overlap:
+        - Type: int
+        - Description: Overlap between two consecutive tiles, in pixels. Objects smaller than the overlap
+                       are entirely visible in at least one tile.
+
+    :return:
+        - Type: list of tuple
+        - Description: The (x0, y0, x1, y1) pixel coordinates of each tile, row by row.
+    """
+    if overlap >= tile_size:
+        raise ValueError(f"The overlap ({overlap}) must be smaller than the tile size ({tile_size})")
+
+    stride = tile_size - overlap
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, stride))
+        positions.append(length - tile_size)
+        return positions
+
+    return [(x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+            for y0 in starts(height) for x0 in starts(width)]
+
+
+def _to_bgr(region:np.ndarray) -> np.ndarray:
+    if region.dtype == np.uint16:
+        region = (region >> 8).astype(np.uint8)
+    elif region.dtype != np.uint8:
+        region = np.clip(region, 0, 255).astype(np.uint8)
+
+    if region.ndim == 2:
+        return np.repeat(region[:, :, None], 3, axis=2)
+    if region.shape[2] == 1:
+        return np.repeat(region, 3, axis=2)
+    # TIFF samples are RGB(A), the models expect OpenCV's BGR
+    return np.ascontiguousarray(region[:, :, 2::-1])
+
+
+class _TiffPage:
+    """
+    Reads regions of a tiled or striped TIFF page, decoding only the segments (tiles or strips) they cover.
+    """
+
+    def __init__(self, img_path):
+        import tifffile
+
+        self._tif = tifffile.TiffFile(str(img_path))
+        self._page = self._tif.pages[0]
+        self._lock = threading.Lock()
+        self.height, self.width = self._page.shape[:2]
+        self._segment_height, self._segment_width = self._page.chunks[:2]
+        self._segments_per_row = self._page.chunked[1]
+
+    @staticmethod
+    def supports(img_path) -> bool:
+        if Path(img_path).suffix.lower() not in TIFF_EXTS:
+            return False
+        try:
+            import tifffile
+        except ImportError:
+            return False
+
+        try:
+            with tifffile.TiffFile(str(img_path)) as tif:
+                page = tif.pages[0]
+                return (len(page.shape) in (2, 3) and page.planarconfig == 1 and len(page.dataoffsets) > 1
+                        and (page.is_tiled or page.rowsperstrip > 0))
+        except Exception:
+            return False
+
+    def read_region(self, x0:int, y0:int, x1:int, y1:int) -> np.ndarray:
+        page = self._page
+        region = None
+
+        rows = range(y0 // self._segment_height, (y1 - 1) // self._segment_height + 1)
+        cols = range(x0 // self._segment_width, (x1 - 1) // self._segment_width + 1)
+        for row in rows:
+            for col in cols:
+                index = row * self._segments_per_row + col
+                with self._lock:
+                    self._tif.filehandle.seek(page.dataoffsets[index])
+                    data = self._tif.filehandle.read(page.databytecounts[index])
+                count('bytes_read', len(data))
+                segment, (_, _, top, left, _), _ = page.decode(data, index, jpegtables=page.jpegtables)
+                segment = segment[0]
+                if region is None:
+                    region = np.zeros((y1 - y0, x1 - x0) + segment.shape[2:], dtype=segment.dtype)
+
+                # Intersection of the segment and the region, in page coordinates
+                top_, bottom = max(top, y0), min(top + segment.shape[0], y1)
+                left_, right = max(left, x0), min(left + segment.shape[1], x1)
+                if top_ < bottom and left_ < right:
+                    region[top_ - y0:bottom - y0, left_ - x0:right - x0] = \
+                        segment[top_ - top:bottom - top, left_ - left:right - left]
+
+        return _to_bgr(region)
+
+    def close(self) -> None:
+        self._tif.close()
+
+
+class _DecodedPage:
+    """
+    Reads regions of an image decoded once with OpenCV.
+    """
+
+    def __init__(self, img_path):
+        import cv2
+
+        self._image = cv2.imread(str(img_path))
+        count('images_decoded')
+        if self._image is None:
+            raise OSError(f"Could not read image {img_path}")
+        self.height, self.width = self._image.shape[:2]
+
+    def read_region(self, x0:int, y0:int, x1:int, y1:int) -> np.ndarray:
+        return self._image[y0:y1, x0:x1]
+
+    def close(self) -> None:
+        self._image = None
+
+
+def open_page(img_path, lazy:bool=True):
+    """
+    Opens an image for tiled reading.
+
+    :param img_path:
+        - Type: str or Path
+        - Description: Path to the image.
+
+    :param lazy:
+        - Type: bool
+        - Description: If True, tiled and striped TIFF files are read segment by segment (requires `tifffile`).
+                       Other images are always decoded entirely.
+
+    :return:
+        - Type: object
+        - Description: A page with `width` and `height` attributes, a `read_region(x0, y0, x1, y1)` method
+                       returning the BGR pixels of a region, and a `close()` method.
+    """
+    if lazy and _TiffPage.supports(img_path):
+        return _TiffPage(img_path)
+    return _DecodedPage(img_path)
+
+
+def merge_tile_detections(boxes:np.ndarray, scores:np.ndarray, classes:np.ndarray, iou_threshold:float=0.5,
+                          ios_threshold:float=0.8, method:str='nms') -> tuple:
+    """
+    Merges the detections of overlapping tiles, in page coordinates. Detections are processed by decreasing
+    confidence; every detection overlapping the current one by IoU ≥ `iou_threshold`, or whose intersection
+    covers ≥ `ios_threshold` of the smaller box (an object cut by a tile border), is merged into it,
+    whatever its class (like the class-agnostic NMS of the predictions).
+
+    :param boxes:
+        - Type: numpy.ndarray
+        - Description: Array (N, 4) of boxes (x0, y0, x1, y1) in page pixels.
+
+    :param scores:
+        - Type: numpy.ndarray
+        - Description: Array (N,) of confidences.
+
+    :param classes:
+        - Type: numpy.ndarray
+        - Description: Array (N,) of class IDs.
+
+    :param iou_threshold:
+        - Type: float
+        - Description: IoU above which two detections are the same object.
+
+    :param ios_threshold:
+        - Type: float
+        - Description: Intersection over the smaller box above which two detections are the same object.
+
+    :param method:
+        - Type: str
+        - Description: 'nms' keeps the most confident detection of each group, 'fusion' replaces it by the
+                       confidence-weighted average of the boxes of the group (with the class and confidence of
+                       the most confident one).
+
+    :return:
+        - Type: tuple
+        - Description: (boxes, scores, classes) of the merged detections.
+    """
+    if method not in ('nms', 'fusion'):
+        raise ValueError(f"Unknown merge method '{method}', use 'nms' or 'fusion'")
+
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+    classes = np.asarray(classes).reshape(-1)
+    if len(boxes) == 0:
+        return boxes, scores, classes
+
+    order = np.argsort(-scores, kind='stable')
+    boxes, scores, classes = boxes[order], scores[order], classes[order]
+
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    remaining = np.ones(len(boxes), dtype=bool)
+    kept_boxes, kept = [], []
+
+    for i in range(len(boxes)):
+        if not remaining[i]:
+            continue
+        candidates = np.flatnonzero(remaining)
+        ix0 = np.maximum(boxes[i, 0], boxes[candidates, 0])
+        iy0 = np.maximum(boxes[i, 1], boxes[candidates, 1])
+        ix1 = np.minimum(boxes[i, 2], boxes[candidates, 2])
+        iy1 = np.minimum(boxes[i, 3], boxes[candidates, 3])
+        intersection = np.clip(ix1 - ix0, 0, None) * np.clip(iy1 - iy0, 0, None)
+        union = areas[i] + areas[candidates] - intersection
+        smaller = np.minimum(areas[i], areas[candidates])
+
+        iou = np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+        ios = np.divide(intersection, smaller, out=np.zeros_like(intersection), where=smaller > 0)
+        group = candidates[(iou >= iou_threshold) | (ios >= ios_threshold)]
+        group = np.union1d(group, [i])
+        remaining[group] = False
+
+        if method == 'fusion':
+            kept_boxes.append(np.average(boxes[group], axis=0, weights=scores[group]))
+        else:
+            kept_boxes.append(boxes[i])
+        kept.append(i)
+
+    return np.array(kept_boxes), scores[kept], classes[kept]
+
+
+def format_page_predictions(boxes:np.ndarray, scores:np.ndarray, classes:np.ndarray, width:int, height:int) -> list:
+    """
+    Formats detections in page pixels as lines of a YOLO label file, normalized by the page dimensions:
+    <class_id> <x_center> <y_center> <width> <height> <confidence>
+
+    :param boxes:
+        - Type: numpy.ndarray
+        - Description: Array (N, 4) of boxes (x0, y0, x1, y1) in page pixels.
+
+    :param scores:
+        - Type: numpy.ndarray
+        - Description: Array (N,) of confidences.
+
+    :param classes:
+        - Type: numpy.ndarray
+        - Description: Array (N,) of class IDs.
+
+    :param width:
+        - Type: int
+        - Description: Width of the page, in pixels.
+
+    :param height:
+        - Type: int
+        - Description: Height of the page, in pixels.
+
+    :return:
+        - Type: list of str
+        - Description: One line per box, with relative coordinates and confidence rounded to 4 decimals
+                       (the format of `format_yolo_predictions`).
+    """
+    lines = []
+    for (x0, y0, x1, y1), score, class_id in zip(boxes, scores, classes):
+        xywhn = ((x0 + x1) / 2 / width, (y0 + y1) / 2 / height, (x1 - x0) / width, (y1 - y0) / height)
+        coordinates = " ".join([f"{value:.4f}" for value in xywhn])
+        lines.append(f"{int(class_id)} {coordinates} {score:.4f}\n")
+    return lines
+
+
+def _read_tiles(page, tiles:list) -> list:
+    with span('read_tiles'):
+        return [page.read_region(*tile) for tile in tiles]
+
+
+def predict_tiled(yolo_model, img_paths:list, labels_folder:str, device:str, tile_size:int=1280, overlap:int=256,
+                  batch_size:int=16, imgsz:int=None, iou_threshold:float=0.5, merge_method:str='nms',
+                  lazy:bool=True) -> dict:
+    """
+    Runs YOLO object detection on a list of (large) images, tile by tile, and saves one label file per image.
+
+    The tiles of a page are predicted in batches of `batch_size` tiles; the next batch is read on a background
+    thread while the current one is predicted, so at most two batches of tiles are in memory at once (plus the
+    decoded page for images that can't be read lazily). The detections are merged across tiles and saved in
+    '<labels_folder>/<image_name>.txt', normalized by the page dimensions. Images without detections do not
+    get a label file.
+
+    :param yolo_model:
+        - Type: ultralytics.YOLO
+        - Description: The loaded YOLO model (see `load_yolo_model`).
+
+    :param img_paths:
+        - Type: list of Path
+        - Description: Paths of the images to process.
+
+    :param labels_folder:
+        - Type: str
+        - Description: Folder where the '<image_name>.txt' label files are saved.
+
+    :param device:
+        - Type: str
+        - Description: The device used for inference ('cuda', 'cpu', ...).
+
+    :param tile_size:
+        - Type: int
+        - Description: Size of the tiles, in page pixels.
+
+    :param overlap:
+        - Type: int
+        - Description: Overlap between consecutive tiles, in pixels (larger than the objects to detect).
+
+    :param batch_size:
+        - Type: int
+        - Description: Number of tiles sent to the model at once.
+
+    :param imgsz:
+        - Type: int
+        - Description: Inference size of a tile. None uses `tile_size` (tiles are predicted at native resolution).
+
+    :param iou_threshold:
+        - Type: float
+        - Description: IoU above which detections of overlapping tiles are merged (see `merge_tile_detections`).
+
+    :param merge_method:
+        - Type: str
+        - Description: 'nms' or 'fusion' (see `merge_tile_detections`).
+
+    :param lazy:
+        - Type: bool
+        - Description: If True, tiled and striped TIFF files are read segment by segment.
+
+    :return:
+        - Type: dict
+        - Description: Run statistics: number of images processed, images with detections, unreadable images
+                       (that could not be read or predicted, they are skipped), number of tiles, number of boxes,
+                       elapsed time (seconds) and throughput (images per second).
+    """
+    labels_folder = Path(labels_folder)
+    labels_folder.mkdir(parents=True, exist_ok=True)
+    batch_size = max(1, int(batch_size))
+    imgsz = imgsz or tile_size
+
+    stats = {'images': 0, 'images_with_detections': 0, 'unreadable_images': 0, 'tiles': 0, 'boxes': 0}
+
+    write_queue = queue.Queue(maxsize=64)
+    writer = threading.Thread(target=_label_writer, args=(write_queue,), daemon=True)
+    writer.start()
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            for img_path in img_paths:
+                page, next_tiles = None, None
+                try:
+                    with span('open'):
+                        page = open_page(img_path, lazy=lazy)
+
+                    tiles = get_tile_grid(page.width, page.height, tile_size, overlap)
+                    batches = [tiles[i:i + batch_size] for i in range(0, len(tiles), batch_size)]
+                    boxes, scores, classes = [], [], []
+
+                    next_tiles = executor.submit(_read_tiles, page, batches[0])
+                    for batch_index, batch in enumerate(batches):
+                        with span('wait_tiles'):
+                            images = next_tiles.result()
+
+                        # Read the next tiles while the current ones are being predicted
+                        if batch_index + 1 < len(batches):
+                            next_tiles = executor.submit(_read_tiles, page, batches[batch_index + 1])
+
+                        with span('forward'):
+                            results = yolo_model.predict(source=images,
+                                                         device=device,
+                                                         agnostic_nms=True,
+                                                         imgsz=imgsz,
+                                                         save_txt=False,
+                                                         save_conf=False,
+                                                         verbose=False
+                                                         )
+
+                        for (x0, y0, _, _), result in zip(batch, results):
+                            if result.boxes is None or len(result.boxes) == 0:
+                                continue
+                            # Tile pixels → page pixels
+                            boxes.append(result.boxes.xyxy.cpu().numpy() + np.array([x0, y0, x0, y0]))
+                            scores.append(result.boxes.conf.cpu().numpy())
+                            classes.append(result.boxes.cls.cpu().numpy().astype(int))
+                        stats['tiles'] += len(batch)
+                        count('tiles', len(batch))
+                except Exception as e:
+                    # A corrupted tile or a failed prediction only skips this image
+                    logger.warning(f"Could not read or predict image {img_path}: {e}")
+                    stats['unreadable_images'] += 1
+                    continue
+                finally:
+                    # The page must not be closed while the next tiles are still being read from it
+                    if next_tiles is not None:
+                        next_tiles.cancel()
+                        wait([next_tiles])
+                    if page is not None:
+                        page.close()
+
+                stats['images'] += 1
+                if not boxes:
+                    logger.debug(f"No detections found in {img_path}")
+                    continue
+
+                with span('merge'):
+                    merged = merge_tile_detections(np.concatenate(boxes), np.concatenate(scores), np.concatenate(classes),
+                                                   iou_threshold=iou_threshold, method=merge_method)
+                    lines = format_page_predictions(*merged, page.width, page.height)
+                stats['images_with_detections'] += 1
+                stats['boxes'] += len(lines)
+                write_queue.put((labels_folder / f"{Path(img_path).stem}.txt", lines))
+    finally:
+        write_queue.put(None)
+        writer.join()
+
+    elapsed = time.perf_counter() - start
+    stats['elapsed_seconds'] = elapsed
+    stats['images_per_second'] = stats['images'] / elapsed if elapsed > 0 else 0.0
+
+    return stats
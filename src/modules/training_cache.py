@@ -0,0 +1,386 @@
+"""
+The following module builds a cache of the training images, resized to the training image size, so that the YOLO
+data loader does not decode the full-resolution ground-truth files (often large TIFF scans) and resize them again
+at every epoch.
+
+The cache is content-addressed: each resized image is stored once in 'blobs/', under the SHA-256 hash of its source
+file and the resize parameters ('<hash>_<mode><img_size>.jpg'). The source files are hashed again only when their size
+or modification time changed ('index.json'), and a resized image is only computed again when the content of its
+source changed, so the cache is reused by all the training sessions with the same image size.
+
+The training view of the cache ('<mode>_<img_size>/images' and '<mode>_<img_size>/labels') is rebuilt at each call:
+it contains hard links to the blobs (copies across file systems) named after the images, and the label files.
+
+Modes:
+    - 'resize': the longest side is resized to `img_size`, keeping the aspect ratio (images are never enlarged).
+                YOLO coordinates are relative, so the label files are used as they are.
+    - 'letterbox': the resized image is padded to a square of `img_size` pixels, and the boxes of the label files are
+                   rescaled to the padded image.
+
+Functions included:
+1. get_cache_view_folder: Returns the folder of the training view of a cache.
+2. get_cache_geometry: Returns the size and padding of a cached image.
+3. rescale_label_lines: Rescales YOLO label lines to a letterboxed image.
+4. cache_image: Resizes one image and writes it in the cache.
+5. build_training_cache: Builds (or updates) the cache of a folder of training images and its training view.
+"""
+
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from file_index import IMG_EXTS, scan_folder
+from instrumentation import count, get_logger, span
+from stage_manifest import hash_file
+
+
+logger = get_logger('training_cache')
+
+CACHE_VERSION = 1
+
+CACHE_MODES = ('resize', 'letterbox')
+
+# Padding color used by YOLO for letterboxing
+PAD_COLOR = (114, 114, 114)
+
+
+def get_cache_view_folder(cache_folder:str, img_size:int=640, mode:str='resize') -> Path:
+    """
+    Returns the folder of the training view of a cache: '<cache_folder>/<mode>_<img_size>', which contains
+    the 'images' and 'labels' sub-folders.
+
+    :param cache_folder:
+        - Type: str
+        - Description: Path to the cache folder (see `folders_path.get_image_cache_folder`).
+
+    :param img_size:
+        - Type: int
+        - Description: Training image size.
+
+    :param mode:
+        - Type: str
+        - Description: 'resize' or 'letterbox'.
+
+    :return:
+        - Type: Path
+    """
+    return Path(cache_folder) / f"{mode}_{img_size}"
+
+
+def get_cache_geometry(width:int, height:int, img_size:int=640, mode:str='resize') -> dict:
+    """
+    Returns the size and padding of the cached version of an image of `width` x `height` pixels.
+
+    :param width:
+        - Type: int
+        - Description: Width of the source image.
+
+    :param height:
+        - Type: int
+        - Description: Height of the source image.
+
+    :param img_size:
+        - Type: int
+        - Description: Training image size.
+
+    :param mode:
+        - Type: str
+        - Description: 'resize' or 'letterbox'.
+
+    :return:
+        - Type: dict
+        - Description: {'width', 'height' (of the source), 'new_width', 'new_height' (of the resized image, before
+                       padding), 'pad_x', 'pad_y' (left and top padding, 0 in 'resize' mode),
+                       'canvas_width', 'canvas_height' (of the cached image)}.
+    """
+    ratio = min(1.0, img_size / max(width, height))
+    new_width, new_height = max(1, round(width * ratio)), max(1, round(height * ratio))
+
+    if mode == 'letterbox':
+        pad_x, pad_y = (img_size - new_width) // 2, (img_size - new_height) // 2
+        canvas_width, canvas_height = img_size, img_size
+    else:
+        pad_x, pad_y = 0, 0
+        canvas_width, canvas_height = new_width, new_height
+
+    return {'width': width, 'height': height, 'new_width': new_width, 'new_height': new_height,
+            'pad_x': pad_x, 'pad_y': pad_y, 'canvas_width': canvas_width, 'canvas_height': canvas_height}
+
+
+def rescale_label_lines(lines:list, geometry:dict) -> list:
+    """
+    Rescales the boxes of YOLO label lines (relative to the source image) to the cached image, when it is padded.
+
+    :param lines:
+        - Type: list of str
+        - Description: Lines of a YOLO label file: `class_id x_center y_center width height [confidence]`.
+
+    :param geometry:
+        - Type: dict
+        - Description: Geometry of the cached image (see `get_cache_geometry`).
+
+    :return:
+        - Type: list of str
+        - Description: The rescaled lines, ending with a newline. Empty lines are dropped.
+    """
+    scale_x = geometry['new_width'] / geometry['canvas_width']
+    scale_y = geometry['new_height'] / geometry['canvas_height']
+    offset_x = geometry['pad_x'] / geometry['canvas_width']
+    offset_y = geometry['pad_y'] / geometry['canvas_height']
+
+    rescaled = []
+    for line in lines:
+        values = line.split()
+        if len(values) < 5:
+            continue
+        x, y, w, h = (float(value) for value in values[1:5])
+        rescaled.append(' '.join([values[0], f"{x * scale_x + offset_x:.6f}", f"{y * scale_y + offset_y:.6f}",
+                                  f"{w * scale_x:.6f}", f"{h * scale_y:.6f}"] + values[5:]) + "\n")
+    return rescaled
+
+
+def cache_image(img_file:str, blob_file:str, img_size:int=640, mode:str='resize', quality:int=95) -> dict:
+    """
+    Resizes an image (see `get_cache_geometry`) and writes it to `blob_file`, as a JPEG (fast to decode) unless
+    the extension of `blob_file` is another one. The file is written under a temporary name first, so an interrupted
+    run never leaves a truncated image in the cache.
+
+    :param img_file:
+        - Type: str
+        - Description: Path to the source image.
+
+    :param blob_file:
+        - Type: str
+        - Description: Path to the cached image.
+
+    :param img_size:
+        - Type: int
+        - Description: Training image size.
+
+    :param mode:
+        - Type: str
+        - Description: 'resize' or 'letterbox'.
+
+    :param quality:
+        - Type: int
+        - Description: JPEG quality.
+
+    :return:
+        - Type: dict
+        - Description: The geometry of the cached image (see `get_cache_geometry`).
+    """
+    import cv2
+
+    img = cv2.imread(str(img_file), cv2.IMREAD_COLOR)
+    if img is None:
+        raise OSError(f"Could not read image {img_file}")
+
+    height, width = img.shape[:2]
+    geometry = get_cache_geometry(width, height, img_size, mode)
+    if (geometry['new_width'], geometry['new_height']) != (width, height):
+        img = cv2.resize(img, (geometry['new_width'], geometry['new_height']), interpolation=cv2.INTER_AREA)
+    if mode == 'letterbox':
+        img = cv2.copyMakeBorder(img, geometry['pad_y'], geometry['canvas_height'] - geometry['new_height'] - geometry['pad_y'],
+                                 geometry['pad_x'], geometry['canvas_width'] - geometry['new_width'] - geometry['pad_x'],
+                                 cv2.BORDER_CONSTANT, value=PAD_COLOR)
+
+    blob_file = Path(blob_file)
+    tmp_file = blob_file.with_name(f"{blob_file.stem}.tmp{blob_file.suffix}")
+    if not cv2.imwrite(str(tmp_file), img, [cv2.IMWRITE_JPEG_QUALITY, quality]):
+        raise OSError(f"Could not write image {tmp_file}")
+    os.replace(tmp_file, blob_file)
+
+    return geometry
+
+
+def _cache_image_args(args):
+    img_file, blob_file, img_size, mode, quality = args
+    try:
+        return cache_image(img_file, blob_file, img_size, mode, quality)
+    except Exception as e:
+        get_logger('training_cache').warning(f"Error caching {Path(img_file).name}: {e}")
+        return None
+
+
+def _load_index(index_file:Path) -> dict:
+    empty = {'version': CACHE_VERSION, 'sources': {}, 'blobs': {}}
+    if not index_file.exists():
+        return empty
+    with open(index_file, 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    return index if index.get('version') == CACHE_VERSION else empty
+
+
+def _save_index(index_file:Path, index:dict) -> None:
+    tmp_file = index_file.with_name(index_file.name + '.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(tmp_file, index_file)
+
+
+def _link_or_copy(source:Path, destination:Path) -> None:
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def build_training_cache(img_folder:str, labels_folder:str, cache_folder:str, img_size:int=640, mode:str='resize',
+                         image_format:str='jpg', quality:int=95, workers:int=None) -> dict:
+    """
+    Builds or updates the cache of the images of `img_folder` resized to `img_size`, and its training view
+    (see the module description). Only the images that are new or whose content changed are decoded and resized,
+    in parallel. Blobs of this size and mode that no image uses anymore are removed.
+
+    :param img_folder:
+        - Type: str
+        - Description: Path to the folder containing the training images.
+
+    :param labels_folder:
+        - Type: str
+        - Description: Path to the folder containing the YOLO label files.
+
+    :param cache_folder:
+        - Type: str
+        - Description: Path to the cache folder (see `folders_path.get_image_cache_folder`).
+
+    :param img_size:
+        - Type: int
+        - Description: Training image size, the `imgsz` of the training.
+
+    :param mode:
+        - Type: str
+        - Description: 'resize' (default) or 'letterbox'.
+
+    :param image_format:
+        - Type: str
+        - Description: Format of the cached images: 'jpg' (default, fastest to decode) or 'png' (lossless).
+
+    :param quality:
+        - Type: int
+        - Description: JPEG quality.
+
+    :param workers:
+        - Type: int
+        - Description: Number of worker processes resizing the images. None uses all the CPU cores,
+                       1 runs in the current process.
+
+    :return:
+        - Type: dict
+        - Description: {'images': images in the view, 'resized': images resized by this call, 'reused': images
+                       taken from the cache, 'removed': unused blobs removed, 'skipped': images left out because
+                       another image has the same name with another extension, 'images_folder', 'labels_folder'
+                       (folders of the training view)}.
+    """
+    if mode not in CACHE_MODES:
+        raise ValueError(f"Unknown cache mode '{mode}', use 'resize' or 'letterbox'")
+
+    cache_folder = Path(cache_folder)
+    blobs_folder = cache_folder / 'blobs'
+    blobs_folder.mkdir(parents=True, exist_ok=True)
+    index_file = cache_folder / 'index.json'
+    index = _load_index(index_file)
+
+    with span('list'):
+        img_files = sorted(scan_folder(os.path.abspath(img_folder), IMG_EXTS))
+    count('files_scanned', len(img_files))
+
+    # Sources hashed again only when their size or modification time changed
+    stats = {path: os.stat(path) for path in img_files}
+    to_hash = [path for path in img_files
+               if (index['sources'].get(path, {}).get('size'), index['sources'].get(path, {}).get('mtime_ns'))
+               != (stats[path].st_size, stats[path].st_mtime_ns)]
+    with span('hash'):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            hashes = dict(zip(to_hash, executor.map(hash_file, to_hash)))
+    count('files_hashed', len(to_hash))
+
+    sources = {}
+    for path in img_files:
+        if path in hashes:
+            sources[path] = {'size': stats[path].st_size, 'mtime_ns': stats[path].st_mtime_ns, 'sha256': hashes[path]}
+        else:
+            sources[path] = index['sources'][path]
+
+    # One blob per source content and resize parameters
+    suffix = f"_{mode}{img_size}.{image_format}"
+    blob_names = {path: source['sha256'] + suffix for path, source in sources.items()}
+    tasks = {}
+    for path, name in blob_names.items():
+        # Identical sources share a blob: it is resized once
+        if name not in tasks and (name not in index['blobs'] or not (blobs_folder / name).exists()):
+            tasks[name] = (path, str(blobs_folder / name), img_size, mode, quality)
+    tasks = list(tasks.values())
+
+    with span('resize'):
+        if workers == 1 or len(tasks) < 2:
+            geometries = list(map(_cache_image_args, tasks))
+        else:
+            workers = workers or os.cpu_count() or 1
+            chunksize = max(1, len(tasks) // (4 * workers))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                geometries = list(executor.map(_cache_image_args, tasks, chunksize=chunksize))
+
+    resized_names = set()
+    for task, geometry in zip(tasks, geometries):
+        if geometry is not None:
+            index['blobs'][Path(task[1]).name] = geometry
+            resized_names.add(Path(task[1]).name)
+    resized = len(resized_names)
+
+    # Blobs of the same parameters that no source uses anymore
+    used = set(blob_names.values())
+    removed = [name for name in index['blobs'] if name.endswith(suffix) and name not in used]
+    for name in removed:
+        index['blobs'].pop(name)
+        (blobs_folder / name).unlink(missing_ok=True)
+
+    index['sources'] = sources
+    _save_index(index_file, index)
+
+    # Training view, rebuilt from the blobs: hard links named after the images, and their labels
+    view_folder = get_cache_view_folder(cache_folder, img_size, mode)
+    shutil.rmtree(view_folder, ignore_errors=True)
+    view_images, view_labels = view_folder / 'images', view_folder / 'labels'
+    view_images.mkdir(parents=True)
+    view_labels.mkdir(parents=True)
+
+    n_images = reused = skipped = 0
+    view_sources = {}
+    with span('link'):
+        for path, name in blob_names.items():
+            geometry = index['blobs'].get(name)
+            if geometry is None:
+                continue  # unreadable image
+            stem = Path(path).stem
+            # Images with the same name but another extension ('page.tif', 'page.jpg') would have the same view
+            # image and label file: the first one (in path order) is kept
+            if stem in view_sources:
+                logger.warning(f"{path} is not in the training cache: {view_sources[stem]} has the same name "
+                               f"(the label file '{stem}.txt' is used for one image only)")
+                skipped += 1
+                continue
+            view_sources[stem] = path
+            _link_or_copy(blobs_folder / name, view_images / f"{stem}.{image_format}")
+            n_images += 1
+            reused += name not in resized_names
+
+            label_file = Path(labels_folder) / f"{stem}.txt"
+            if not label_file.exists():
+                continue
+            if mode == 'letterbox':
+                with open(label_file, 'r') as f:
+                    lines = rescale_label_lines(f.readlines(), geometry)
+                with open(view_labels / label_file.name, 'w') as f:
+                    f.writelines(lines)
+            else:
+                shutil.copy2(label_file, view_labels / label_file.name)
+
+    logger.info(f"{n_images} image(s) in the training cache {view_folder} "
+                f"({resized} resized, {len(removed)} unused removed, {skipped} skipped as duplicate names)")
+    count('images_resized', resized)
+
+    return {'images': n_images, 'resized': resized, 'reused': reused, 'removed': len(removed),
+            'skipped': skipped, 'images_folder': str(view_images), 'labels_folder': str(view_labels)}
@@ -0,0 +1,701 @@
+"""
+The following module runs YOLO training sessions from a persistent local job queue, so that a grid of
+hyper-parameters (model size, image size, batch, label smoothing...) is trained unattended, e.g. overnight.
+
+The queue is a SQLite file ('output/runs/train/training_queue.sqlite', see `folders_path.get_training_queue_file`).
+Each job is a training session with its parameters, named after them ('<project>_<model>_i<img_size>_e<epochs>_
+b<batch>_<hash of all the parameters>'): submitting the same parameters twice does not train them twice.
+
+The scheduler (`run_training_queue`) starts the queued jobs as separate processes, as long as the CPU cores and the
+memory they need are free: each job gets its own cores (its data loader `workers` and its PyTorch threads are set to
+their number, and the process is pinned to them on Linux), an estimate of its memory (from the model size, the image
+size and the batch, or the 'memory_gb' of its parameters) and, on GPU machines, a GPU of its own.
+
+A job that crashes (or whose scheduler was stopped) is queued again and resumed from its 'weights/last.pt'
+checkpoint, up to `max_attempts` times. The queue is also the run registry: each finished job keeps its parameters,
+the hash of the dataset split it was trained on, its model folder and its final validation metrics
+(`list_training_jobs`, `write_run_registry`).
+
+Functions included:
+1. expand_grid: Expands a grid of parameters into the list of their combinations.
+2. get_job_name: Returns the name of the training session of a set of parameters.
+3. hash_dataset_split: Returns the hash of the train/val split and of the YAML file of a dataset.
+4. estimate_job_resources: Estimates the CPU cores and the memory needed by a training job.
+5. get_available_resources: Returns the CPU cores and the memory available for the training jobs.
+6. submit_training_jobs: Adds the jobs of a parameter grid to the queue.
+7. requeue_training_jobs: Queues failed jobs again.
+8. list_training_jobs: Returns the jobs of the queue (the run registry).
+9. write_run_registry: Writes the run registry (parameters, split hash, metrics) as a CSV file.
+10. run_training_queue: Runs the queued jobs, as many at once as the resources allow.
+"""
+
+import hashlib
+import itertools
+import json
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from cpu_inference import THREAD_ENV_VARS
+from folders_path import get_data_folder
+from instrumentation import count, get_logger
+
+
+logger = get_logger('training_queue')
+
+# Parameters used by the queue only, not passed to `YOLO.train`
+QUEUE_PARAMS = ('use_model', 'pretrained_model', 'cores', 'memory_gb')
+
+# Memory (GB) of a training process per model size, at img_size 640 and batch 16
+MODEL_MEMORY_GB = {'n': 2.0, 's': 3.0, 'm': 5.0, 'l': 7.0, 'x': 10.0}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id             INTEGER PRIMARY KEY AUTOINCREMENT,
+    name           TEXT UNIQUE NOT NULL,
+    project_folder TEXT NOT NULL,
+    params         TEXT NOT NULL,
+    priority       INTEGER NOT NULL DEFAULT 0,
+    status         TEXT NOT NULL DEFAULT 'queued',
+    attempts       INTEGER NOT NULL DEFAULT 0,
+    pid            INTEGER,
+    device         TEXT,
+    cores          INTEGER,
+    memory_gb      REAL,
+    submitted      TEXT,
+    started        TEXT,
+    finished       TEXT,
+    model_folder   TEXT,
+    split_hash     TEXT,
+    metrics        TEXT,
+    error          TEXT
+);
+"""
+
+
+def _connect(db_path) -> sqlite3.Connection:
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+    # The jobs write their results in the queue while the scheduler updates it
+    connection = sqlite3.connect(str(db_path), timeout=60)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def expand_grid(grid:dict) -> list:
+    """
+    Expands a grid of parameters into the list of their combinations: each list value is a dimension of the grid,
+    the other values are the same in all the combinations.
+
+    Example: {'use_model': ['yolo11n.pt', 'yolo11s.pt'], 'img_size': [640, 1024], 'epochs': 100} gives 4 combinations.
+
+    :param grid:
+        - Type: dict
+        - Description: Parameter names and values (a list of values for the parameters to compare).
+
+    :return:
+        - Type: list of dict
+        - Description: One dict of parameters per combination.
+    """
+    names = list(grid)
+    values = [value if isinstance(value, (list, tuple)) else [value] for value in grid.values()]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def get_job_name(project_name:str, params:dict) -> str:
+    """
+    Returns the name of the training session (and of its model folder) of a set of parameters: the main parameters
+    are readable in the name, and a short hash of all the parameters makes it unique.
+
+    :param project_name:
+        - Type: str
+        - Description: Name of the project.
+
+    :param params:
+        - Type: dict
+        - Description: Parameters of the training session.
+
+    :return:
+        - Type: str
+        - Description: '<project>_<model>_i<img_size>_e<epochs>_b<batch>_<hash>'.
+    """
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:8]
+    model = Path(params.get('pretrained_model') or params.get('use_model', 'yolo11n.pt')).stem
+    return (f"{project_name}_{model}_i{params.get('img_size', 640)}_e{params.get('epochs', 100)}"
+            f"_b{params.get('batch', 16)}_{digest}")
+
+
+def _split_names(dataset_folder:Path, split:str) -> list:
+    list_file = dataset_folder / f"{split}.txt"
+    if list_file.exists():
+        with open(list_file, 'r', encoding='utf-8') as f:
+            return sorted(Path(line.strip()).name for line in f if line.strip())
+    split_folder = dataset_folder / 'images' / split
+    if split_folder.exists():
+        return sorted(entry.name for entry in os.scandir(split_folder))
+    return []
+
+
+def _get_dataset_yaml(project_folder:Path) -> tuple:
+    project_name = Path(project_folder).name
+    dataset_folder = Path(get_data_folder(project_folder)).parent / 'datasets' / project_name
+    return dataset_folder, dataset_folder / f"{project_name}.yaml"
+
+
+def _check_cache_img_size(yaml_file:Path, params_list:list) -> None:
+    """
+    Raises a ValueError if the dataset points at a training image cache (see `training_cache`) smaller than the
+    img_size of a job: its images would be trained on downscaled, then upscaled again.
+    """
+    if not yaml_file.exists():
+        return
+    # Recorded by `write_yaml_file` (notebook 3): '# images: pre-resized training cache <cache>/<mode>_<img_size>'
+    match = re.search(r"^# images: pre-resized training cache .*_(\d+)\s*$", yaml_file.read_text(encoding='utf-8'),
+                      re.MULTILINE)
+    if match is None:
+        return
+    cache_img_size = int(match.group(1))
+    too_large = sorted({params.get('img_size', 640) for params in params_list
+                        if params.get('img_size', 640) > cache_img_size})
+    if too_large:
+        raise ValueError(f"The dataset {yaml_file} uses the training cache of {cache_img_size} px, smaller than "
+                         f"img_size {', '.join(map(str, too_large))}: prepare it again with notebook 3 and "
+                         f"cache_img_size={too_large[-1]} (or without the cache)")
+
+
+def hash_dataset_split(dataset_folder:str, yaml_file:str) -> str:
+    """
+    Returns the hash of the dataset a model is trained on: the YAML file (classes and split entries) and the names
+    of the images of the train and val splits, whether the split is made of list files or of folders
+    (see `dataset_split`). Two runs with the same hash were trained and validated on the same images.
+
+    :param dataset_folder:
+        - Type: str
+        - Description: Path to the dataset folder of the training session ('datasets/<project>').
+
+    :param yaml_file:
+        - Type: str
+        - Description: Path to the YAML file of the dataset.
+
+    :return:
+        - Type: str
+        - Description: SHA-256 hash (hexadecimal).
+    """
+    dataset_folder = Path(dataset_folder)
+    digest = hashlib.sha256(Path(yaml_file).read_bytes())
+    for split in ('train', 'val'):
+        digest.update(f"\n[{split}]\n".encode('utf-8'))
+        digest.update('\n'.join(_split_names(dataset_folder, split)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def estimate_job_resources(params:dict, cores_per_job:int=4) -> tuple:
+    """
+    Estimates the CPU cores and the memory needed by a training job. The memory grows with the model size (letter of
+    the model name), the number of pixels of the images and the batch; AutoBatch (batch ≤ 0 or a fraction) is
+    counted as a batch of 16. The estimate can be replaced by the 'cores' and 'memory_gb' parameters of the job.
+
+    :param params:
+        - Type: dict
+        - Description: Parameters of the training session.
+
+    :param cores_per_job:
+        - Type: int
+        - Description: Number of cores of a job without a 'cores' parameter.
+
+    :return:
+        - Type: tuple
+        - Description: (cores, memory in GB).
+    """
+    cores = int(params.get('cores') or cores_per_job)
+    if params.get('memory_gb'):
+        return cores, float(params['memory_gb'])
+
+    model = Path(params.get('pretrained_model') or params.get('use_model', 'yolo11n.pt')).stem
+    size = re.search(r'\d+([nsmlx])', model)
+    model_memory = MODEL_MEMORY_GB[size.group(1)] if size else MODEL_MEMORY_GB['m']
+
+    batch = params.get('batch', 16)
+    batch = batch if isinstance(batch, int) and batch > 0 else 16
+    scale = (params.get('img_size', 640) / 640) ** 2 * batch / 16
+
+    # The data loader workers hold a few batches of images each
+    return cores, round(model_memory * max(scale, 0.25) + 0.5 * cores, 1)
+
+
+def get_available_resources() -> tuple:
+    """
+    Returns the CPU cores the process may use and the memory available, in GB.
+
+    :return:
+        - Type: tuple
+        - Description: (list of the core IDs, available memory in GB).
+    """
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+    try:
+        import psutil
+        memory = psutil.virtual_memory().available
+    except ImportError:
+        try:
+            memory = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        except (ValueError, OSError, AttributeError):
+            memory = float('inf')
+    return cores, memory / 1e9
+
+
+def submit_training_jobs(db_path:str, project_folder:str, grid:dict, priority:int=0) -> list:
+    """
+    Adds a training job to the queue for each combination of the parameter grid (see `expand_grid`).
+    A combination already in the queue (same parameters) is not added again, whatever its status.
+
+    Accepted parameters: 'use_model' (e.g. 'yolo11n.pt'), 'pretrained_model' (path to the weights to start from,
+    replaces 'use_model'), 'cores' and 'memory_gb' (resources of the job, see `estimate_job_resources`), and the
+    arguments of `YOLO.train` ('img_size' for 'imgsz', 'epochs', 'batch', 'label_smoothing', 'dropout'...).
+    If the dataset uses the training image cache, no img_size can be larger than the size of the cache: a ValueError
+    is raised and no job is added.
+
+    :param db_path:
+        - Type: str
+        - Description: Path to the queue (see `folders_path.get_training_queue_file`).
+
+    :param project_folder:
+        - Type: str
+        - Description: Path to the project folder; its dataset must be prepared with notebook 3.
+
+    :param grid:
+        - Type: dict
+        - Description: Parameter names and values (a list of values for the parameters to compare).
+
+    :param priority:
+        - Type: int
+        - Description: Jobs with a higher priority are started first. Default is 0.
+
+    :return:
+        - Type: list of str
+        - Description: Names of the jobs added.
+    """
+    project_name = Path(project_folder).name
+    combinations = expand_grid(grid)
+    # The dataset has to provide images of the size of each job
+    _check_cache_img_size(_get_dataset_yaml(project_folder)[1], combinations)
+
+    added = []
+    connection = _connect(db_path)
+    try:
+        for params in combinations:
+            name = get_job_name(project_name, params)
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO jobs (name, project_folder, params, priority, submitted) VALUES (?, ?, ?, ?, ?)",
+                (name, str(Path(project_folder).resolve()), json.dumps(params, sort_keys=True), priority, _now()))
+            if cursor.rowcount:
+                added.append(name)
+        connection.commit()
+    finally:
+        connection.close()
+
+    count('training_jobs_submitted', len(added))
+    logger.info(f"{len(added)} training job(s) added to {db_path}")
+    return added
+
+
+def requeue_training_jobs(db_path:str, names:list=None) -> int:
+    """
+    Queues failed jobs again (they are resumed from their last checkpoint, if any), with a new count of attempts.
+
+    :param db_path:
+        - Type: str
+        - Description: Path to the queue.
+
+    :param names:
+        - Type: list of str
+        - Description: Names of the jobs to queue again. None queues all the failed jobs.
+
+    :return:
+        - Type: int
+        - Description: Number of jobs queued again.
+    """
+    connection = _connect(db_path)
+    try:
+        if names is None:
+            cursor = connection.execute("UPDATE jobs SET status = 'queued', attempts = 0 WHERE status = 'failed'")
+        else:
+            cursor = connection.executemany(
+                "UPDATE jobs SET status = 'queued', attempts = 0 WHERE status = 'failed' AND name = ?",
+                [(name,) for name in names])
+        connection.commit()
+        return cursor.rowcount
+    finally:
+        connection.close()
+
+
+def _job_dict(row:sqlite3.Row) -> dict:
+    job = dict(row)
+    job['params'] = json.loads(job['params'])
+    job['metrics'] = json.loads(job['metrics']) if job['metrics'] else None
+    return job
+
+
+def list_training_jobs(db_path:str, status:str=None) -> list:
+    """
+    Returns the jobs of the queue, which is also the run registry of the training sessions.
+
+    :param db_path:
+        - Type: str
+        - Description: Path to the queue.
+
+    :param status:
+        - Type: str
+        - Description: Only the jobs with this status ('queued', 'running', 'done' or 'failed'). None returns all.
+
+    :return:
+        - Type: list of dict
+        - Description: One dict per job, in the order of submission, with its 'name', 'status', 'params' (dict),
+                       'attempts', 'device', 'cores', 'memory_gb', 'submitted', 'started' and 'finished' times,
+                       'model_folder', 'split_hash', 'metrics' (dict of the final validation metrics) and 'error'.
+    """
+    if not Path(db_path).exists():
+        return []
+    connection = _connect(db_path)
+    try:
+        if status is None:
+            rows = connection.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+        else:
+            rows = connection.execute("SELECT * FROM jobs WHERE status = ? ORDER BY id", (status,)).fetchall()
+    finally:
+        connection.close()
+    return [_job_dict(row) for row in rows]
+
+
+def write_run_registry(db_path:str, csv_file:str) -> int:
+    """
+    Writes the run registry as a ';'-separated CSV file, one row per job: its name, status, model folder, dataset
+    split hash and times, then one column per parameter and per metric of the jobs, to compare the runs.
+
+    :param db_path:
+        - Type: str
+        - Description: Path to the queue.
+
+    :param csv_file:
+        - Type: str
+        - Description: Path to the CSV file to write.
+
+    :return:
+        - Type: int
+        - Description: Number of jobs written.
+    """
+    import csv
+
+    jobs = list_training_jobs(db_path)
+    param_names = sorted({name for job in jobs for name in job['params']})
+    metric_names = sorted({name for job in jobs for name in job['metrics'] or {}})
+    columns = ['name', 'status', 'attempts', 'model_folder', 'split_hash', 'started', 'finished']
+
+    with open(csv_file, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, delimiter=';', lineterminator='\n')
+        writer.writerow(columns + param_names + metric_names)
+        for job in jobs:
+            writer.writerow([job[column] for column in columns]
+                            + [job['params'].get(name) for name in param_names]
+                            + [(job['metrics'] or {}).get(name) for name in metric_names])
+    return len(jobs)
+
+
+def _pin_job(cores:list) -> None:
+    # Done before PyTorch is imported in the job
+    for variable in THREAD_ENV_VARS:
+        os.environ[variable] = str(len(cores))
+    if hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, cores)
+        except OSError:
+            pass
+
+
+def _copy_dataset_files(project_folder:Path, dataset_folder:Path, model_folder:Path) -> None:
+    # The files describing the dataset are kept with each model (see `dispatch_data` in notebook 3)
+    project_name = project_folder.name
+    for source in (dataset_folder / f"{project_name}.yaml", Path(get_data_folder(project_folder)) / 'labels.txt',
+                   dataset_folder / 'train.txt', dataset_folder / 'val.txt'):
+        if source.exists():
+            shutil.copy2(source, model_folder / source.name)
+
+
+def _run_job(db_path:str, job_id:int, device:str, cores:list, log_file:str) -> None:
+    """
+    Trains (or resumes) one job, in its own process, and records its results in the queue.
+    """
+    _pin_job(cores)
+
+    # The output of Ultralytics goes to the log file of the job
+    log = open(log_file, 'a', buffering=1, encoding='utf-8')
+    os.dup2(log.fileno(), 1)
+    os.dup2(log.fileno(), 2)
+    sys.stdout = sys.stderr = log
+
+    connection = _connect(db_path)
+    job = _job_dict(connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+    connection.close()
+
+    import torch
+    from ultralytics import YOLO
+    torch.set_num_threads(len(cores))
+
+    params = job['params']
+    project_folder = Path(job['project_folder'])
+    project_name = project_folder.name
+    dataset_folder, yaml_file = _get_dataset_yaml(project_folder)
+    train_folder = project_folder.parent / 'output' / 'runs' / 'train'
+    model_folder = train_folder / job['name']
+    last_weights = model_folder / 'weights' / 'last.pt'
+
+    try:
+        if not yaml_file.exists():
+            raise FileNotFoundError(f"YAML file not found: {yaml_file}. Prepare the dataset with notebook 3 first.")
+        # The dataset may have been prepared again since the job was submitted
+        _check_cache_img_size(yaml_file, [params])
+        split_hash = hash_dataset_split(dataset_folder, yaml_file)
+
+        if last_weights.exists():
+            logger.info(f"Resuming {job['name']} from {last_weights}")
+            try:
+                YOLO(str(last_weights)).train(resume=True, device=device)
+            except AssertionError as error:
+                # Crashed after the last epoch: the training is complete
+                if 'nothing to resume' not in str(error):
+                    raise
+        else:
+            train_args = {name: value for name, value in params.items() if name not in QUEUE_PARAMS}
+            train_args['imgsz'] = train_args.pop('img_size', 640)
+            model = YOLO(params.get('pretrained_model') or params.get('use_model', 'yolo11n.pt'))
+            model.train(data=yaml_file, name=job['name'], project=train_folder, exist_ok=True, device=device,
+                        workers=len(cores), **train_args)
+
+        # Evaluate the model's performance on the validation set
+        val_results = YOLO(str(model_folder / 'weights' / 'best.pt')).val(
+            data=yaml_file, name=f"{job['name']}/{project_name}_val", project=train_folder, exist_ok=True,
+            device=device, workers=len(cores))
+        metrics = {name: float(value) for name, value in val_results.results_dict.items()}
+        _copy_dataset_files(project_folder, dataset_folder, model_folder)
+    except Exception as error:
+        connection = _connect(db_path)
+        connection.execute("UPDATE jobs SET error = ? WHERE id = ?", (f"{type(error).__name__}: {error}", job_id))
+        connection.commit()
+        connection.close()
+        raise
+
+    connection = _connect(db_path)
+    connection.execute(
+        "UPDATE jobs SET status = 'done', finished = ?, model_folder = ?, split_hash = ?, metrics = ?, error = NULL "
+        "WHERE id = ?", (_now(), str(model_folder), split_hash, json.dumps(metrics), job_id))
+    connection.commit()
+    connection.close()
+
+
+def _is_alive(pid:int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _end_attempt(connection:sqlite3.Connection, job_id:int, max_attempts:int, reason:str) -> None:
+    row = connection.execute("SELECT name, status, attempts, error FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row['status'] != 'running':
+        return
+    attempts = row['attempts'] + 1
+    status = 'queued' if attempts < max_attempts else 'failed'
+    connection.execute("UPDATE jobs SET status = ?, attempts = ?, pid = NULL, error = ? WHERE id = ?",
+                       (status, attempts, row['error'] or reason, job_id))
+    connection.commit()
+    if status == 'queued':
+        logger.warning(f"{row['name']} stopped ({row['error'] or reason}): queued again, it will be resumed "
+                       f"from its last checkpoint (attempt {attempts + 1}/{max_attempts})")
+    else:
+        logger.error(f"{row['name']} failed {attempts} time(s) ({row['error'] or reason}), it is not queued again")
+
+
+def _get_devices() -> list:
+    from device_function import which_device
+
+    device = which_device()
+    if device == 'cuda':
+        import torch
+        # One job per GPU
+        return [str(index) for index in range(torch.cuda.device_count())]
+    return [device]
+
+
+def run_training_queue(db_path:str, max_jobs:int=None, cores_per_job:int=4, reserve_cores:int=1,
+                       reserve_memory_gb:float=2.0, max_attempts:int=3, poll_interval:float=30.0,
+                       devices:list=None, wait:bool=True) -> dict:
+    """
+    Runs the queued training jobs, each in its own process, as many at once as the resources allow, until the queue
+    is empty (or only once through the queue, with `wait=False`).
+
+    A job is started when its cores and its memory (see `estimate_job_resources`) are free, after keeping
+    `reserve_cores` cores and `reserve_memory_gb` GB for the rest of the system, and, on CUDA machines, when a GPU is
+    free (one job per GPU). A job that needs more than the whole machine is started when no other job runs.
+    The output of each job is written in 'output/runs/train/<job name>.log'.
+
+    Jobs left 'running' by a scheduler that was stopped, and jobs whose process crashed, are queued again and resumed
+    from their 'weights/last.pt' checkpoint, until they failed `max_attempts` times. Interrupting the scheduler
+    (Ctrl+C) stops the running jobs, which are resumed by the next run.
+
+    :param db_path:
+        - Type: str
+        - Description: Path to the queue (see `folders_path.get_training_queue_file`).
+
+    :param max_jobs:
+        - Type: int
+        - Description: Maximum number of jobs running at once. None only limits them by the resources.
+
+    :param cores_per_job:
+        - Type: int
+        - Description: Number of cores of a job without a 'cores' parameter: its data loader workers and threads.
+
+    :param reserve_cores:
+        - Type: int
+        - Description: Number of cores left to the rest of the system.
+
+    :param reserve_memory_gb:
+        - Type: float
+        - Description: Memory (GB) left to the rest of the system.
+
+    :param max_attempts:
+        - Type: int
+        - Description: Number of times a job is started (then resumed) before it is marked as failed.
+
+    :param poll_interval:
+        - Type: float
+        - Description: Seconds between two checks of the running jobs.
+
+    :param devices:
+        - Type: list of str
+        - Description: Devices of the jobs, e.g. ['0', '1'] for two GPUs (one job per GPU) or ['cpu'].
+                       None detects them (see `which_device`).
+
+    :param wait:
+        - Type: bool
+        - Description: If True (default), runs until the queue is empty. If False, starts the jobs that fit and
+                       waits for them only.
+
+    :return:
+        - Type: dict
+        - Description: Number of jobs 'done', 'failed' and 'requeued' during the run.
+    """
+    import multiprocessing
+
+    # The jobs start in a new interpreter: PyTorch and CUDA are not shared with the scheduler
+    context = multiprocessing.get_context('spawn')
+    db_path = str(Path(db_path).resolve())
+    devices = devices or _get_devices()
+    gpu_devices = [device for device in devices if device not in ('cpu', 'mps', 'xla')]
+
+    all_cores, memory_gb = get_available_resources()
+    free_cores = all_cores[:max(1, len(all_cores) - reserve_cores)]
+    free_memory = max(0.0, memory_gb - reserve_memory_gb)
+    free_gpus = list(gpu_devices)
+    logger.info(f"Training queue: {len(free_cores)} core(s), {free_memory:.1f} GB, devices {devices}")
+
+    running = {}
+    stats = {'done': 0, 'failed': 0, 'requeued': 0}
+
+    # Jobs left running by a previous scheduler
+    connection = _connect(db_path)
+    for row in connection.execute("SELECT id, pid FROM jobs WHERE status = 'running'").fetchall():
+        if row['pid'] is None or not _is_alive(row['pid']):
+            _end_attempt(connection, row['id'], max_attempts, 'scheduler stopped')
+            stats['requeued'] += 1
+
+    started_once = set()
+    try:
+        while True:
+            # Finished jobs give their resources back
+            for job_id, (process, cores, memory, device) in list(running.items()):
+                if process.is_alive():
+                    continue
+                process.join()
+                del running[job_id]
+                free_cores = sorted(free_cores + cores)
+                free_memory += memory
+                if device in gpu_devices:
+                    free_gpus.append(device)
+
+                row = connection.execute("SELECT name, status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                if row['status'] == 'done':
+                    logger.info(f"{row['name']} done")
+                else:
+                    _end_attempt(connection, job_id, max_attempts, f"exit code {process.exitcode}")
+                status = connection.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()['status']
+                stats[status if status in ('done', 'failed') else 'requeued'] += 1
+
+            # Queued jobs that fit in the free resources, by priority then submission
+            queued = connection.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY priority DESC, id").fetchall()
+            if not wait:
+                queued = [row for row in queued if row['id'] not in started_once]
+            for row in queued:
+                if max_jobs is not None and len(running) >= max_jobs:
+                    break
+                if gpu_devices and not free_gpus:
+                    break
+                nb_cores, memory = estimate_job_resources(json.loads(row['params']), cores_per_job)
+                nb_cores = min(nb_cores, len(all_cores))
+                fits = nb_cores <= len(free_cores) and memory <= free_memory
+                if not fits and (running or not free_cores):
+                    continue
+
+                cores = free_cores[:nb_cores] if fits else list(free_cores)
+                free_cores = [core for core in free_cores if core not in cores]
+                memory = min(memory, free_memory)
+                free_memory -= memory
+                device = free_gpus.pop(0) if gpu_devices else devices[0]
+
+                log_file = Path(row['project_folder']).parent / 'output' / 'runs' / 'train' / f"{row['name']}.log"
+                log_file.parent.mkdir(parents=True, exist_ok=True)
+                process = context.Process(target=_run_job, args=(db_path, row['id'], device, cores, str(log_file)),
+                                          name=row['name'])
+                process.start()
+                connection.execute(
+                    "UPDATE jobs SET status = 'running', pid = ?, device = ?, cores = ?, memory_gb = ?, started = ?, "
+                    "error = NULL WHERE id = ?", (process.pid, device, len(cores), memory, _now(), row['id']))
+                connection.commit()
+                running[row['id']] = (process, cores, memory, device)
+                started_once.add(row['id'])
+                count('training_jobs_started')
+                logger.info(f"Started {row['name']} on {device} with {len(cores)} core(s) and {memory:.1f} GB "
+                            f"(log: {log_file})")
+
+            if not running:
+                remaining = connection.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+                if not wait or not remaining:
+                    break
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        # The running jobs are stopped and queued again: they are resumed from their last checkpoint next time
+        logger.warning(f"Interrupted: stopping {len(running)} job(s)")
+        for job_id, (process, _, _, _) in running.items():
+            process.terminate()
+            process.join()
+            connection.execute("UPDATE jobs SET status = 'queued', pid = NULL WHERE id = ? AND status = 'running'",
+                               (job_id,))
+        connection.commit()
+        raise
+    finally:
+        connection.close()
+
+    logger.info(f"Training queue: {stats['done']} job(s) done, {stats['failed']} failed, "
+                f"{stats['requeued']} queued again")
+    return stats
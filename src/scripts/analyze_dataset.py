@@ -0,0 +1,14 @@
+"""
+Stage 2 – Dataset statistics.
+
+Runs the 'statistics' stage of the pipeline (see run_pipeline.py): skipped when its inputs are unchanged since the last run.
+All the options of run_pipeline.py are accepted, e.g. `python analyze_dataset.py --force`.
+"""
+
+import sys
+
+from run_pipeline import main
+
+
+if __name__ == '__main__':
+    sys.exit(main(['statistics'] + sys.argv[1:]))
@@ -0,0 +1,14 @@
+"""
+Stage 5 – Evaluate model & review corrections.
+
+Runs the 'evaluate' stage of the pipeline (see run_pipeline.py): skipped when its inputs are unchanged since the last run.
+All the options of run_pipeline.py are accepted, e.g. `python evaluate_model.py --force`.
+"""
+
+import sys
+
+from run_pipeline import main
+
+
+if __name__ == '__main__':
+    sys.exit(main(['evaluate'] + sys.argv[1:]))
@@ -0,0 +1,14 @@
+"""
+Stage 1 – Extract annotated training data.
+
+Runs the 'extract' stage of the pipeline (see run_pipeline.py): skipped when its inputs are unchanged since the last run.
+All the options of run_pipeline.py are accepted, e.g. `python extract_training_data.py --force`.
+"""
+
+import sys
+
+from run_pipeline import main
+
+
+if __name__ == '__main__':
+    sys.exit(main(['extract'] + sys.argv[1:]))
@@ -0,0 +1,14 @@
+"""
+Stage 6 – Generate new ground truth.
+
+Runs the 'ground_truth' stage of the pipeline (see run_pipeline.py): skipped when its inputs are unchanged since the last run.
+All the options of run_pipeline.py are accepted, e.g. `python generate_ground_truth.py --force`.
+"""
+
+import sys
+
+from run_pipeline import main
+
+
+if __name__ == '__main__':
+    sys.exit(main(['ground_truth'] + sys.argv[1:]))
@@ -0,0 +1,76 @@
+"""
+Stages 4 to 6 – Label Studio synchronization.
+
+Pushes the predictions to a Label Studio project and pulls the finished annotations back through the Label Studio API
+(see `ls_client`), instead of importing and exporting files by hand:
+    - push: imports the tasks of the import files written by notebook 4 (`get_ls_for_local_files`), in batches;
+    - pull: writes the annotations finished since the last pull in 'annotations/prediction_corrections'
+      (or 'annotations/ground_truth' with --ground-truth), one JSON file per annotation, as notebooks 1, 5 and 6 expect.
+
+The server and the access token come from `config.py` (LS_HOST, LS_PORT and LS_API_KEY, see `.env`).
+
+Usage:
+    python ls_sync.py push --ls-project 3 --tasks results/project_ls_local_files.json
+    python ls_sync.py push --ls-project 3 --tasks results/project_ls_local_files_*.ndjson --batch-size 1000
+    python ls_sync.py pull --ls-project 3                   # corrections finished since the last pull
+    python ls_sync.py pull --ls-project 1 --ground-truth    # annotations of the ground truth
+    python ls_sync.py pull --ls-project 3 --full            # all the annotations again
+
+The default project folder comes from `config.py` (see `.env`).
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'modules'))
+
+import config
+from folders_path import get_corrections_folder_inference, get_ground_truth_folder_training, get_ls_sync_file
+from instrumentation import configure_logging
+from ls_client import LabelStudioClient, push_tasks, pull_annotations
+from ls_export import read_ls_tasks
+
+
+def parse_args(argv:list=None):
+    parser = argparse.ArgumentParser(description="Push predictions to Label Studio and pull the annotations through its API.")
+    parser.add_argument('command', choices=['push', 'pull'], help="Action on the Label Studio project")
+    parser.add_argument('--ls-project', type=int, required=True, help="ID of the Label Studio project (in its URL)")
+    parser.add_argument('--project-folder', default=config.PROJECT_DIR, help="Project folder (default: config.PROJECT_DIR)")
+    parser.add_argument('--url', default=None, help="URL of Label Studio (default: from LS_HOST and LS_PORT)")
+    parser.add_argument('--api-key', default=None, help="Access token of Label Studio (default: LS_API_KEY)")
+    parser.add_argument('--tasks', nargs='+', default=None, help="With push: import files (.json or .ndjson) to push")
+    parser.add_argument('--batch-size', type=int, default=500, help="With push: number of tasks per request")
+    parser.add_argument('--ground-truth', action='store_true', help="With pull: write in 'annotations/ground_truth'")
+    parser.add_argument('--full', action='store_true', help="With pull: pull all the annotations, not only the new ones")
+    parser.add_argument('--retries', type=int, default=5, help="Number of times a failed request is sent again")
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help="Level of the messages (default: INFO)")
+    parser.add_argument('--log-file', default=None, help="Also write the messages in this file")
+    args = parser.parse_args(argv)
+
+    if args.command == 'push' and not args.tasks:
+        parser.error("push needs --tasks")
+    return args
+
+
+def main(argv:list=None) -> int:
+    args = parse_args(argv)
+    configure_logging(args.log_level, args.log_file)
+
+    with LabelStudioClient(args.url, api_key=args.api_key, retries=args.retries) as client:
+        if args.command == 'push':
+            push_tasks(client, args.ls_project, read_ls_tasks(args.tasks), batch_size=args.batch_size)
+
+        elif args.command == 'pull':
+            if args.ground_truth:
+                output_folder = get_ground_truth_folder_training(args.project_folder)
+            else:
+                output_folder = get_corrections_folder_inference(args.project_folder)
+            pull_annotations(client, args.ls_project, output_folder, get_ls_sync_file(args.project_folder),
+                             full=args.full)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,14 @@
+"""
+Stage 4 – Predict on evaluation images.
+
+Runs the 'predict' stage of the pipeline (see run_pipeline.py): skipped when its inputs are unchanged since the last run.
+All the options of run_pipeline.py are accepted, e.g. `python predict.py --force`.
+"""
+
+import sys
+
+from run_pipeline import main
+
+
+if __name__ == '__main__':
+    sys.exit(main(['predict'] + sys.argv[1:]))
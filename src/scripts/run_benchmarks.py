@@ -0,0 +1,295 @@
+"""
+Benchmarks of the hot paths of the pipeline, on synthetic projects of several sizes (see `synthetic_project`).
+
+For each scale (number of images), a synthetic project is generated in a work folder, then each benchmark is
+run `--repeat` times and its best time is kept. A stub model stands in for YOLO, so the benchmarks measure
+the cost of the pipeline code (decoding, file I/O, parsing, matching), not of the network.
+
+Benchmarks:
+    ls_conversion            Label Studio JSON → YOLO conversion, all files (notebook 1, `convert_annotations`)
+    ls_conversion_unchanged  Same conversion when no annotation file changed (incremental run)
+    statistics               Dataset statistics in one pass (notebook 2, `dataset_statistics`)
+    augmentation             Perspective augmentation, one variant per image (notebook 3, `generate_transformed_data`)
+    prediction               Batched predictions with the stub model (notebook 4, `process_images_with_yolo`)
+    image_metadata           Image metadata index, cold and warm (notebook 4, `yolo_to_csv`)
+    evaluation               Matching of the predictions with the corrections (notebook 5, `get_csv_results`)
+    metrics                  Counts, precision-recall curves, mAP and confusion matrix (notebook 5, `compute_evaluation_metrics`)
+
+The results are written as JSON ('<output>/<date>_<commit>.json'), with the commit, the machine and the
+parameters, so that two runs can be compared with `--compare`:
+
+    python run_benchmarks.py --scales 1000 10000
+    python run_benchmarks.py --scales 1000 10000 --compare ../../output/benchmarks/20250101-120000_abc1234.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'modules'))
+
+import config
+from folders_path import get_data_folder, get_ground_truth_folder_training, get_img_folder_training, get_img_folder_inference
+from synthetic_project import StubYOLOModel, generate_synthetic_project
+
+
+BENCHMARKS = ['ls_conversion', 'ls_conversion_unchanged', 'statistics', 'augmentation', 'prediction',
+              'image_metadata', 'evaluation', 'metrics']
+
+
+def _link_folder(source:Path, destination:Path) -> None:
+    # A copy of a folder made of hard links (copies when the file system does not support them)
+    if destination.exists():
+        shutil.rmtree(destination)
+    destination.mkdir(parents=True)
+    for entry in os.scandir(source):
+        try:
+            os.link(entry.path, destination / entry.name)
+        except OSError:
+            shutil.copy2(entry.path, destination / entry.name)
+
+
+def get_benchmarks(paths:dict, args) -> dict:
+    """
+    Returns the benchmarks of a generated project.
+
+    :param paths:
+        - Type: dict
+        - Description: The paths returned by `generate_synthetic_project`.
+
+    :param args:
+        - Type: argparse.Namespace
+        - Description: The command-line arguments.
+
+    :return:
+        - Type: dict
+        - Description: Dictionary mapping each benchmark name to a (setup, run) pair of functions.
+                       `setup` is not timed; `run` returns the number of items processed.
+    """
+    from ls_conversion import convert_ls_annotations
+    from dataset_statistics import scan_dataset, write_dataset_statistics
+    from augmentation_functions import augment_dataset
+    from inference_functions import list_images, predict_images_in_batches
+    from image_metadata import refresh_image_metadata
+    from evaluation_functions import evaluate_images
+    from file_index import index_folder, join_indexes
+    from evaluation_metrics import load_match_results, compute_metrics
+    from class_names_functions import load_label_map
+    from results_writer import EVALUATION_COLUMNS, ResultsWriter
+
+    project_folder = paths['project_folder']
+    data_folder = Path(get_data_folder(project_folder))
+    results_folder = Path(paths['results_folder'])
+    work_folder = Path(project_folder).parent / 'benchmarks'
+    label_map = load_label_map(Path(paths['model_folder']) / 'labels.txt')
+
+    def convert():
+        stats = convert_ls_annotations(get_ground_truth_folder_training(project_folder), data_folder / 'labels',
+                                       data_folder / 'labels.txt', data_folder / 'annotations_manifest.json',
+                                       workers=args.workers)
+        return stats['files']
+
+    def reset_conversion():
+        shutil.rmtree(data_folder, ignore_errors=True)
+
+    def setup_dataset():
+        if not (data_folder / 'labels.txt').exists():
+            convert()
+        if not (data_folder / 'images').exists():
+            _link_folder(Path(get_img_folder_training(project_folder)), data_folder / 'images')
+
+    def statistics():
+        stats = scan_dataset(data_folder / 'images', data_folder / 'labels', workers=args.workers or 8)
+        write_dataset_statistics(stats, label_map, work_folder / 'dataset_statistics', show=False)
+        return len(stats['images'])
+
+    def setup_augmentation():
+        setup_dataset()
+        _link_folder(data_folder / 'images', work_folder / 'augmentation' / 'images')
+        _link_folder(data_folder / 'labels', work_folder / 'augmentation' / 'labels')
+
+    def augmentation():
+        return augment_dataset(work_folder / 'augmentation' / 'images', work_folder / 'augmentation' / 'labels',
+                               n_variants=1, seed=0, workers=args.workers)
+
+    eval_images = list_images(get_img_folder_inference(project_folder))
+
+    def prediction():
+        model = StubYOLOModel(boxes_per_image=args.boxes_per_image, n_classes=args.classes)
+        stats = predict_images_in_batches(model, eval_images, work_folder / 'prediction', 'cpu', batch_size=16)
+        return stats['images']
+
+    def image_metadata():
+        db_path = work_folder / 'image_metadata.sqlite'
+        if db_path.exists():
+            db_path.unlink()
+        # Cold run (all the headers are read), then warm run (only stat calls)
+        refresh_image_metadata(get_img_folder_inference(project_folder), str(db_path))
+        return len(refresh_image_metadata(get_img_folder_inference(project_folder), str(db_path)))
+
+    evaluation_rows = []
+
+    def evaluation():
+        predictions = index_folder(results_folder / 'labels', {'.txt'})
+        corrections = index_folder(results_folder / 'correctedLabels', {'.txt'})
+        pairs = [(f"{stem}.txt", pred_path, corr_path)
+                 for stem, pred_path, corr_path in join_indexes(predictions, corrections, how='left')]
+        evaluation_rows[:] = evaluate_images(pairs, label_map, workers=args.workers)
+        return len(pairs)
+
+    def setup_metrics():
+        if not evaluation_rows:
+            evaluation()
+        results_file = work_folder / 'results_for_evaluation.parquet'
+        if not results_file.exists():
+            with ResultsWriter(results_file, EVALUATION_COLUMNS) as writer:
+                writer.write_rows(evaluation_rows)
+
+    def metrics():
+        results = load_match_results(work_folder / 'results_for_evaluation.parquet')
+        compute_metrics(results, labels=label_map.names())
+        return len(results['status'])
+
+    def nothing():
+        pass
+
+    def setup_work_folder():
+        work_folder.mkdir(parents=True, exist_ok=True)
+
+    return {
+        'ls_conversion': (reset_conversion, convert),
+        'ls_conversion_unchanged': (setup_dataset, convert),
+        'statistics': (setup_dataset, statistics),
+        'augmentation': (setup_augmentation, augmentation),
+        'prediction': (setup_work_folder, prediction),
+        'image_metadata': (setup_work_folder, image_metadata),
+        'evaluation': (nothing, evaluation),
+        'metrics': (setup_metrics, metrics),
+    }
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).resolve().parent,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_benchmarks(args) -> dict:
+    """
+    Generates a synthetic project for each scale and runs the selected benchmarks on it.
+
+    :param args:
+        - Type: argparse.Namespace
+        - Description: The command-line arguments.
+
+    :return:
+        - Type: dict
+        - Description: The results: commit, date, machine, parameters and one entry per benchmark and scale
+                       (best time in seconds, all the times, items processed, items per second).
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+
+    results = {
+        'commit': get_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count()},
+        'parameters': {'scales': args.scales, 'boxes_per_image': args.boxes_per_image, 'classes': args.classes,
+                       'repeat': args.repeat, 'workers': args.workers, 'seed': args.seed},
+        'benchmarks': []
+    }
+
+    if args.workdir:
+        Path(args.workdir).mkdir(parents=True, exist_ok=True)
+
+    for scale in args.scales:
+        work_root = Path(tempfile.mkdtemp(prefix=f'tiamat_bench_{scale}_', dir=args.workdir))
+        try:
+            start = time.perf_counter()
+            paths = generate_synthetic_project(work_root, n_images=scale, boxes_per_image=args.boxes_per_image,
+                                               n_classes=args.classes, seed=args.seed)
+            print(f"Synthetic project of {scale} images generated in {time.perf_counter() - start:.1f} s")
+
+            benchmarks = get_benchmarks(paths, args)
+            for name in args.benchmarks:
+                setup, run = benchmarks[name]
+                times = []
+                for _ in range(args.repeat):
+                    setup()
+                    start = time.perf_counter()
+                    items = run()
+                    times.append(time.perf_counter() - start)
+
+                best = min(times)
+                results['benchmarks'].append({'name': name, 'scale': scale, 'seconds': best, 'times': times,
+                                              'items': items, 'items_per_second': items / best if best > 0 else None})
+                print(f"[{scale}] {name}: {best:.3f} s ({items / best if best > 0 else float('inf'):.0f} items/s)")
+        finally:
+            if not args.keep:
+                shutil.rmtree(work_root, ignore_errors=True)
+
+    return results
+
+
+def compare_results(results:dict, reference:dict) -> None:
+    """
+    Prints the ratio of the times of two benchmark runs (> 1 means slower than the reference).
+    """
+    reference_times = {(entry['name'], entry['scale']): entry['seconds'] for entry in reference['benchmarks']}
+    print(f"\nComparison with {reference.get('commit')} ({reference.get('date')}):")
+    for entry in results['benchmarks']:
+        reference_time = reference_times.get((entry['name'], entry['scale']))
+        if not reference_time:
+            continue
+        ratio = entry['seconds'] / reference_time
+        flag = '  ⚠️ slower' if ratio > 1.1 else ('  ✅ faster' if ratio < 0.9 else '')
+        print(f"[{entry['scale']}] {entry['name']}: {reference_time:.3f} s → {entry['seconds']:.3f} s (×{ratio:.2f}){flag}")
+
+
+def parse_args(argv:list=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline hot paths on synthetic projects.")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1000, 10000],
+                        help="Numbers of images of the synthetic projects (default: 1000 10000)")
+    parser.add_argument('--benchmarks', nargs='+', default=BENCHMARKS, choices=BENCHMARKS, help="Benchmarks to run")
+    parser.add_argument('--boxes-per-image', type=int, default=10, help="Number of boxes per image")
+    parser.add_argument('--classes', type=int, default=5, help="Number of classes")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of runs of each benchmark (the best is kept)")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes (default: all the CPU cores)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic projects")
+    parser.add_argument('--workdir', default=None, help="Folder where the synthetic projects are generated (default: temporary folder)")
+    parser.add_argument('--keep', action='store_true', help="Keep the synthetic projects")
+    parser.add_argument('--output', default=os.path.join(config.OUTPUT_DIR, 'benchmarks'), help="Folder of the JSON results")
+    parser.add_argument('--compare', default=None, help="JSON results of a previous run to compare with")
+    return parser.parse_args(argv)
+
+
+def main(argv:list=None) -> int:
+    args = parse_args(argv)
+    results = run_benchmarks(args)
+
+    output_folder = Path(args.output)
+    output_folder.mkdir(parents=True, exist_ok=True)
+    output_file = output_folder / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}_{results['commit']}.json"
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output_file}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare_results(results, json.load(f))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
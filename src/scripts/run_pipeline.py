@@ -0,0 +1,562 @@
+"""
+Command-line runner of the TiamaT pipeline, for unattended (e.g. nightly) runs of the stages of the notebooks.
+
+Each stage declares its input files, its parameters and its outputs. After a successful run, the content hashes
+of its inputs are recorded in the pipeline manifest ('data/<project>/pipeline_manifest.json'). On the next run:
+    - a stage whose inputs, parameters and outputs are unchanged is skipped;
+    - a stage whose inputs changed only re-runs on the files that were added, changed or removed
+      (e.g. only the new eval images are predicted, only the new corrections are converted);
+    - a stage whose parameters changed, or whose outputs are missing, is re-run entirely (as with --force).
+
+Stages, in pipeline order:
+    extract       Stage 1: converts the Label Studio annotations and copies the annotated images (notebook 1)
+    statistics    Stage 2: dataset statistics (notebook 2)
+    train         Stage 3: trains a model on the dataset prepared by notebook 3 (only run when asked for)
+    predict       Stage 4: predicts the eval images (notebook 4)
+    evaluate      Stage 5: converts the corrections and evaluates the predictions (notebook 5)
+    ground_truth  Stage 6: adds the corrected eval images to the dataset (notebook 6)
+
+Usage:
+    python run_pipeline.py                             # all the stages except 'train'
+    python run_pipeline.py predict evaluate --model-folder <output/runs/train/MODEL_NAME>
+    python run_pipeline.py statistics --force
+    python run_pipeline.py predict --profile --trace-file predict_trace.json --log-level WARNING
+    python run_pipeline.py predict --reuse-duplicates    # near-duplicate scans are predicted once
+
+With --profile, the time of each stage and of its phases (decode, forward, write...) and its counters (files
+scanned, images decoded, boxes written, bytes read) are printed as a table at the end of the run, and written
+as a Chrome trace with --trace-file (see `instrumentation`). --log-level WARNING hides the per-file messages.
+
+The default project and model folders come from `config.py` (see `.env`).
+"""
+
+import argparse
+import shutil
+import sys
+from datetime import datetime
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'modules'))
+
+import config
+from file_index import IMG_EXTS
+from folders_path import (get_img_folder_training, get_img_folder_inference, get_ground_truth_folder_training,
+                          get_corrections_folder_inference, get_results_folder, get_data_folder,
+                          get_correctedLabels_folder, get_image_metadata_file, get_image_hash_file,
+                          get_blob_store_folder)
+from stage_manifest import list_files, snapshot_files, diff_snapshots, load_pipeline_manifest, save_pipeline_manifest
+from instrumentation import configure_logging, enable_instrumentation, format_summary, get_logger, write_trace
+from instrumentation import stage as instrumented_stage
+
+
+DEFAULT_STAGES = ['extract', 'statistics', 'predict', 'evaluate', 'ground_truth']
+
+logger = get_logger('pipeline')
+
+
+def get_pipeline_manifest_file(project_folder:str) -> str:
+    """
+    Returns the path to the pipeline manifest of a project: 'data/<project>/pipeline_manifest.json'.
+    """
+    return str(Path(get_data_folder(project_folder)) / 'pipeline_manifest.json')
+
+
+# --- Stage 1: extract ---
+
+def extract_inputs(args) -> list:
+    return (list_files(get_ground_truth_folder_training(args.project_folder))
+            + list_files(get_img_folder_training(args.project_folder), IMG_EXTS))
+
+
+def extract_outputs(args) -> list:
+    data_folder = Path(get_data_folder(args.project_folder))
+    return [data_folder / 'images', data_folder / 'labels', data_folder / 'labels.txt']
+
+
+def run_extract(args, changes:dict, full:bool, state:dict) -> dict:
+    from ls_conversion import convert_ls_annotations
+    from image_metadata import refresh_image_metadata, write_metadata_csv
+    from blob_store import link_files
+
+    data_folder = Path(get_data_folder(args.project_folder))
+    img_folder = data_folder / 'images'
+    img_folder.mkdir(parents=True, exist_ok=True)
+    img_folder_training = Path(get_img_folder_training(args.project_folder))
+
+    # The conversion keeps its own manifest and only parses the new or changed annotation files
+    stats = convert_ls_annotations(get_ground_truth_folder_training(args.project_folder),
+                                   data_folder / 'labels',
+                                   data_folder / 'labels.txt',
+                                   data_folder / 'annotations_manifest.json',
+                                   workers=args.workers,
+                                   force=full)
+    logger.info(f"{stats['converted']} annotation file(s) converted, {stats['unchanged']} unchanged, "
+                f"{stats['removed']} label file(s) removed")
+
+    # The images are placed as links to the image store, not copied
+    pairs = [(file_path, img_folder / Path(file_path).name) for file_path in changes['added'] + changes['changed']
+             if Path(file_path).parent == img_folder_training]
+    placed = link_files(pairs, get_blob_store_folder(args.project_folder), adopt_sources=True)
+    for file_path in changes['removed']:
+        file_path = Path(file_path)
+        if file_path.parent == img_folder_training and (img_folder / file_path.name).exists():
+            (img_folder / file_path.name).unlink()
+    logger.info(f"{placed['files']} image(s) placed in {img_folder} ({placed['bytes_copied'] / 1e6:.1f} MB copied)")
+
+    if img_folder_training.exists():
+        entries = refresh_image_metadata(str(img_folder_training), get_image_metadata_file(args.project_folder))
+        write_metadata_csv(entries, img_folder_training / f"{Path(args.project_folder).name}_data.csv",
+                           folder=img_folder_training.name)
+    return state
+
+
+# --- Stage 2: statistics ---
+
+def statistics_inputs(args) -> list:
+    data_folder = Path(get_data_folder(args.project_folder))
+    return (list_files(data_folder / 'images', IMG_EXTS) + list_files(data_folder / 'labels', {'.txt'})
+            + [str(data_folder / 'labels.txt')])
+
+
+def statistics_outputs(args) -> list:
+    return [Path(get_data_folder(args.project_folder)) / 'dataset_statistics' / 'global_data.csv']
+
+
+def run_statistics(args, changes:dict, full:bool, state:dict) -> dict:
+    import matplotlib
+    matplotlib.use('Agg')
+
+    from class_names_functions import load_label_map
+    from dataset_statistics import scan_dataset, write_dataset_statistics
+
+    # The statistics are aggregates: they are computed again in a single pass over the dataset
+    data_folder = Path(get_data_folder(args.project_folder))
+    stats = scan_dataset(data_folder / 'images', data_folder / 'labels', workers=args.workers or 8)
+    for file_name, file_encoding in stats['encodings'].items():
+        logger.info(f"{file_name} is encoded in {file_encoding.upper()}")
+    logger.info(f"{len(stats['without_annotations'])} image(s) without annotations")
+
+    write_dataset_statistics(stats, load_label_map(data_folder / 'labels.txt'), data_folder / 'dataset_statistics',
+                             show=False)
+    return state
+
+
+# --- Stage 3: train ---
+
+def get_dataset_folder(project_folder:str) -> Path:
+    return Path(get_data_folder(project_folder)).parent / 'datasets' / Path(project_folder).name
+
+
+def train_inputs(args) -> list:
+    data_folder = Path(get_data_folder(args.project_folder))
+    return (list_files(get_dataset_folder(args.project_folder), {'.yaml', '.txt'})
+            + list_files(data_folder / 'labels', {'.txt'}) + list_files(data_folder / 'images', IMG_EXTS))
+
+
+def train_params(args) -> dict:
+    return {'use_model': args.use_model, 'img_size': args.img_size, 'epochs': args.epochs, 'batch': args.batch_size}
+
+
+def run_train(args, changes:dict, full:bool, state:dict) -> dict:
+    from ultralytics import YOLO
+    from device_function import which_device
+
+    # Training always starts from scratch (or from the pretrained model) on the whole dataset
+    project_name = Path(args.project_folder).name
+    yaml_file = get_dataset_folder(args.project_folder) / f"{project_name}.yaml"
+    if not yaml_file.exists():
+        raise FileNotFoundError(f"YAML file not found: {yaml_file}. Prepare the dataset with notebook 3 first.")
+
+    date = datetime.now().strftime('%Y%m%d')
+    model_name = f'{project_name}_{date}_{Path(args.use_model).stem}_i{args.img_size}_e{args.epochs}_b{args.batch_size}'
+
+    model = YOLO(args.use_model).to(which_device())
+    model.train(data=yaml_file, imgsz=args.img_size, epochs=args.epochs, batch=args.batch_size,
+                name=model_name, project=Path(args.project_folder).parent / 'output' / 'runs' / 'train')
+    state['last_model'] = model_name
+    return state
+
+
+# --- Stage 4: predict ---
+
+def get_weights_file(model_folder:str) -> Path:
+    return Path(model_folder) / 'weights' / 'best.pt'
+
+
+def predict_inputs(args) -> list:
+    from inference_functions import list_images
+
+    eval_folder = Path(args.project_folder) / 'image_inputs' / 'eval_images'
+    return [str(img_path) for img_path in list_images(eval_folder)] + [str(get_weights_file(args.model_folder))]
+
+
+def predict_params(args) -> dict:
+    params = {'model_folder': str(Path(args.model_folder).resolve()), 'img_size': args.img_size,
+              'tile_size': args.tile_size, 'overlap': args.overlap, 'backend': args.backend}
+    if args.reuse_duplicates:
+        params['duplicate_radius'] = args.duplicate_radius
+    return params
+
+
+def predict_outputs(args) -> list:
+    return [Path(get_results_folder(args.project_folder, args.model_folder)) / 'labels']
+
+
+def run_predict(args, changes:dict, full:bool, state:dict) -> dict:
+    from inference_functions import load_yolo_model, predict_images_in_batches
+    from tiled_inference import predict_tiled
+    from cpu_inference import export_cpu_model, load_exported_model, predict_images_cpu
+
+    weights_file = str(get_weights_file(args.model_folder))
+    labels_folder = Path(get_results_folder(args.project_folder, args.model_folder)) / 'labels'
+    if not Path(weights_file).exists():
+        raise FileNotFoundError(f"Model weights not found: {weights_file}")
+
+    # Loaded (or exported) before any prediction is removed
+    if args.backend == 'torch':
+        from device_function import which_device
+
+        device = which_device()
+        yolo_model = load_yolo_model(str(args.model_folder))
+    else:
+        device = 'cpu'
+        model_path = export_cpu_model(args.model_folder, export_format=args.backend,
+                                      imgsz=args.tile_size or args.img_size)
+
+    # New weights: every image has to be predicted again
+    if full or weights_file in changes['changed'] + changes['added']:
+        img_paths = [path for path in predict_inputs(args) if path != weights_file]
+        if labels_folder.exists():
+            shutil.rmtree(labels_folder)
+    else:
+        img_paths = changes['added'] + changes['changed']
+
+    # Images without detections get no label file: remove the predictions of the changed and removed images first
+    for img_path in changes['changed'] + changes['removed']:
+        label_path = labels_folder / f"{Path(img_path).stem}.txt"
+        if label_path.exists():
+            label_path.unlink()
+
+    # Near-duplicate pages are predicted once, through their representative image
+    duplicates = {}
+    if args.reuse_duplicates:
+        from near_duplicates import refresh_image_hashes, group_near_duplicates, copy_duplicate_labels
+
+        hashes = refresh_image_hashes(get_img_folder_inference(args.project_folder),
+                                      get_image_hash_file(args.project_folder), workers=args.workers)
+        duplicates = group_near_duplicates(hashes, radius=args.duplicate_radius)
+        # Images that were near-duplicates at the last run but are not anymore have to be predicted
+        img_paths = sorted({str(Path(path).resolve()) for path in img_paths}
+                           | {path for path in state.get('duplicates', {}) if path in hashes})
+        img_paths = [path for path in img_paths if path not in duplicates]
+        logger.info(f"{len(duplicates)} near-duplicate image(s) reuse the predictions of another image")
+
+    if img_paths and args.backend != 'torch' and not args.tile_size:
+        # Images shared between pinned worker processes
+        stats = predict_images_cpu(args.model_folder, img_paths, labels_folder, export_format=args.backend,
+                                   workers=args.workers, threads_per_worker=args.threads_per_worker,
+                                   batch_size=args.batch_size, imgsz=args.img_size)
+    elif img_paths:
+        if args.backend != 'torch':
+            yolo_model = load_exported_model(model_path)
+        if args.tile_size:
+            stats = predict_tiled(yolo_model, img_paths, labels_folder, device, tile_size=args.tile_size,
+                                  overlap=args.overlap, batch_size=args.batch_size)
+        else:
+            stats = predict_images_in_batches(yolo_model, img_paths, labels_folder, device,
+                                              batch_size=args.batch_size, imgsz=args.img_size)
+    if img_paths:
+        logger.info(f"✅ {stats['images']} images processed in {stats['elapsed_seconds']:.1f} s "
+                    f"({stats['images_per_second']:.2f} images/sec), {stats['boxes']} boxes saved to {labels_folder}")
+    if args.reuse_duplicates:
+        copy_duplicate_labels(duplicates, labels_folder)
+        state['duplicates'] = duplicates
+    return state
+
+
+# --- Stage 5: evaluate ---
+
+def evaluate_inputs(args) -> list:
+    results_folder = Path(get_results_folder(args.project_folder, args.model_folder))
+    return (list_files(get_corrections_folder_inference(args.project_folder))
+            + list_files(results_folder / 'labels', {'.txt'}) + [str(Path(args.model_folder) / 'labels.txt')])
+
+
+def evaluate_params(args) -> dict:
+    return {'model_folder': str(Path(args.model_folder).resolve()), 'method': args.method,
+            'export_csv': args.export_csv}
+
+
+def evaluate_outputs(args) -> list:
+    results_folder = Path(get_results_folder(args.project_folder, args.model_folder))
+    return [results_folder / 'labels.txt', Path(get_correctedLabels_folder(args.project_folder, args.model_folder)),
+            results_folder / 'results' / 'results_for_evaluation.parquet']
+
+
+def _parse_correction(correction_file:str) -> tuple:
+    from manipulate_files import open_json_file
+    from transform_coordinates_functions import from_ls_to_yolo
+
+    corrections = open_json_file(correction_file)
+    img_name = Path(corrections['task']['data']['image']).stem
+    boxes = []
+    for item in corrections['result']:
+        # Deleted prediction boxes have no id
+        if 'id' not in item or not item.get('value', {}).get('rectanglelabels'):
+            continue
+        value = item['value']
+        boxes.append((value['rectanglelabels'][0],) + tuple(from_ls_to_yolo(value['x'], value['y'], value['width'], value['height'])))
+    return img_name, boxes
+
+
+def run_evaluate(args, changes:dict, full:bool, state:dict) -> dict:
+    import matplotlib
+    matplotlib.use('Agg')
+
+    from class_names_functions import load_label_map
+    from evaluation_functions import iter_evaluation_rows
+    from evaluation_metrics import load_match_results, compute_metrics, write_evaluation_reports
+    from file_index import index_folder, join_indexes
+    from results_writer import EVALUATION_COLUMNS, ResultsWriter
+
+    results_folder = Path(get_results_folder(args.project_folder, args.model_folder))
+    corrections_folder = Path(get_corrections_folder_inference(args.project_folder))
+    corrected_labels_folder = Path(get_correctedLabels_folder(args.project_folder, args.model_folder))
+    corrected_labels_folder.mkdir(parents=True, exist_ok=True)
+
+    # state['corrections'] maps each correction file to its image and classes
+    corrections = {} if full else dict(state.get('corrections', {}))
+    if str(Path(args.model_folder) / 'labels.txt') in changes['changed']:
+        corrections = {}
+
+    to_convert = [path for path in list_files(corrections_folder) if path not in corrections
+                  or path in changes['added'] + changes['changed']]
+
+    parsed = {}
+    for correction_file in to_convert:
+        img_name, boxes = _parse_correction(correction_file)
+        parsed[correction_file] = (img_name, boxes)
+        corrections[correction_file] = {'image': img_name, 'classes': sorted({box[0] for box in boxes})}
+
+    for correction_file in changes['removed']:
+        entry = corrections.pop(correction_file, None)
+        if entry is not None and (corrected_labels_folder / f"{entry['image']}.txt").exists():
+            (corrected_labels_folder / f"{entry['image']}.txt").unlink()
+
+    # New classes get the next IDs (see `add_new_labels` in notebook 5)
+    train_labels = load_label_map(Path(args.model_folder) / 'labels.txt')
+    all_classes = sorted({class_name for entry in corrections.values() for class_name in entry['classes']})
+    label_map = train_labels.merge(all_classes)
+    label_map.save(results_folder / 'labels.txt')
+
+    for img_name, boxes in parsed.values():
+        with open(corrected_labels_folder / f"{img_name}.txt", 'w') as yolo_correction:
+            for class_name, x, y, w, h in boxes:
+                yolo_correction.write(f"{label_map.id(class_name)} {x} {y} {w} {h}\n")
+    logger.info(f"{len(parsed)} correction file(s) converted in {corrected_labels_folder}")
+
+    # The evaluation itself is vectorized and cheap: all the images are evaluated again
+    prediction_index = index_folder(results_folder / 'labels', {'.txt'})
+    correction_index = index_folder(corrected_labels_folder, {'.txt'})
+    pairs = sorted(((f"{stem}.txt", pred_path, corr_path)
+                    for stem, pred_path, corr_path in join_indexes(prediction_index, correction_index)),
+                   key=lambda pair: pair[0])
+
+    # The rows are streamed to the Parquet results image by image (see `save_results` in notebook 5)
+    output_folder = results_folder / 'results' / 'results_for_evaluation.parquet'
+    csv_file = output_folder.with_suffix('.csv') if args.export_csv else None
+    with ResultsWriter(output_folder, EVALUATION_COLUMNS, csv_file=csv_file) as writer:
+        for image_rows in iter_evaluation_rows(pairs, label_map, method=args.method, workers=args.workers):
+            writer.write_rows(image_rows)
+
+    if writer.stats['rows']:
+        logger.info(f"The {output_folder} file has been created ({writer.stats['rows']} rows).")
+
+        # Metrics and reports of notebook 5 (`get_txt_results`, `create_confusion_matrix`), from the columns they use
+        metrics = compute_metrics(load_match_results(output_folder), labels=label_map.names())
+        write_evaluation_reports(metrics, output_folder.parent, show=False)
+        logger.info(f"mAP@0.5: {metrics['map50']:.4f}, mAP@0.5:0.95: {metrics['map50_95']:.4f}")
+
+    state['corrections'] = corrections
+    return state
+
+
+# --- Stage 6: ground_truth ---
+
+def ground_truth_inputs(args) -> list:
+    results_folder = Path(get_results_folder(args.project_folder, args.model_folder))
+    return (list_files(get_correctedLabels_folder(args.project_folder, args.model_folder), {'.txt'})
+            + list_files(get_img_folder_inference(args.project_folder), IMG_EXTS)
+            + [str(results_folder / 'labels.txt')])
+
+
+def ground_truth_outputs(args) -> list:
+    return [Path(get_data_folder(args.project_folder)) / 'labels']
+
+
+def run_ground_truth(args, changes:dict, full:bool, state:dict) -> dict:
+    from blob_store import link_files, collect_garbage
+
+    data_folder = Path(get_data_folder(args.project_folder))
+    results_labels_file = Path(get_results_folder(args.project_folder, args.model_folder)) / 'labels.txt'
+
+    # Only the new or changed corrected labels and eval images are copied; the dataset is never pruned
+    copied_labels, images = 0, []
+    for file_path in changes['added'] + changes['changed']:
+        file_path = Path(file_path)
+        if file_path == results_labels_file or file_path.stem.endswith('_PT'):
+            continue
+        if file_path.suffix == '.txt':
+            (data_folder / 'labels').mkdir(parents=True, exist_ok=True)
+            shutil.copy2(file_path, data_folder / 'labels' / file_path.name)
+            copied_labels += 1
+        else:
+            images.append((file_path, data_folder / 'images' / file_path.name))
+    # The images are placed as links to the image store, not copied
+    store_folder = get_blob_store_folder(args.project_folder)
+    placed = link_files(images, store_folder, adopt_sources=True)
+    logger.info(f"[OK] {copied_labels} corrected label file(s) copied and {placed['files']} image(s) placed in {data_folder}")
+
+    if results_labels_file.exists():
+        shutil.copy2(results_labels_file, data_folder / 'labels.txt')
+        logger.info(f"Labels file copied to: {data_folder / 'labels.txt'}")
+
+    collect_garbage(store_folder)
+    return state
+
+
+def no_params(args) -> dict:
+    return {}
+
+
+# name: (inputs, parameters, outputs, run)
+STAGES = {
+    'extract': (extract_inputs, no_params, extract_outputs, run_extract),
+    'statistics': (statistics_inputs, no_params, statistics_outputs, run_statistics),
+    'train': (train_inputs, train_params, lambda args: [], run_train),
+    'predict': (predict_inputs, predict_params, predict_outputs, run_predict),
+    'evaluate': (evaluate_inputs, evaluate_params, evaluate_outputs, run_evaluate),
+    'ground_truth': (ground_truth_inputs, no_params, ground_truth_outputs, run_ground_truth),
+}
+
+
+def run_stage(stage:str, args, manifest:dict) -> bool:
+    """
+    Runs one stage if its inputs, parameters or outputs changed since its last successful run, and records
+    the snapshot of its inputs in the manifest.
+
+    :param stage:
+        - Type: str
+        - Description: Name of the stage (see `STAGES`).
+
+    :param args:
+        - Type: argparse.Namespace
+        - Description: The command-line arguments.
+
+    :param manifest:
+        - Type: dict
+        - Description: The pipeline manifest (see `load_pipeline_manifest`), updated in place.
+
+    :return:
+        - Type: bool
+        - Description: True if the stage was run, False if it was skipped.
+    """
+    inputs, params, outputs, run = STAGES[stage]
+    record = manifest['stages'].get(stage)
+
+    # Reuse the recorded hashes of the files whose size and modification time did not change
+    snapshot = snapshot_files(inputs(args), record['inputs'] if record else None)
+    stage_params = params(args)
+    missing_outputs = [str(path) for path in outputs(args) if not Path(path).exists()]
+
+    full = args.force or record is None or record['params'] != stage_params or bool(missing_outputs)
+    if full:
+        changes = {'added': sorted(snapshot), 'changed': [], 'removed': []}
+        state = {}
+    else:
+        changes = diff_snapshots(record['inputs'], snapshot)
+        state = record.get('state', {})
+        if not any(changes.values()):
+            logger.info(f"[{stage}] skipped, inputs unchanged since {record['completed']}")
+            return False
+
+    logger.info(f"[{stage}] {'full run' if full else 'incremental run'}: {len(changes['added'])} added, "
+                f"{len(changes['changed'])} changed, {len(changes['removed'])} removed input file(s)")
+    with instrumented_stage(stage):
+        state = run(args, changes, full, state)
+
+    manifest['stages'][stage] = {'params': stage_params, 'inputs': snapshot, 'state': state,
+                                 'outputs': [str(path) for path in outputs(args)],
+                                 'completed': datetime.now().isoformat(timespec='seconds')}
+    return True
+
+
+def parse_args(argv:list=None):
+    parser = argparse.ArgumentParser(description="Run the TiamaT pipeline stages, skipping the ones whose inputs are unchanged.")
+    parser.add_argument('stages', nargs='*', metavar='stage',
+                        help=f"Stages to run among {', '.join(STAGES)}, in pipeline order (default: {' '.join(DEFAULT_STAGES)}). 'all' includes 'train'.")
+    parser.add_argument('--project-folder', default=config.PROJECT_DIR, help="Project folder (default: config.PROJECT_DIR)")
+    parser.add_argument('--model-folder', default=config.MODEL_FOLDER, help="YOLO model folder (default: config.MODEL_FOLDER)")
+    parser.add_argument('--force', action='store_true', help="Re-run the stages even if their inputs are unchanged")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes (default: all the CPU cores)")
+    parser.add_argument('--batch-size', type=int, default=16, help="Batch size for the predictions and the training")
+    parser.add_argument('--img-size', type=int, default=640, help="Image size for the predictions and the training")
+    parser.add_argument('--tile-size', type=int, default=0,
+                        help="Predict large scans tile by tile, with tiles of this size in pixels (default: 0, not tiled)")
+    parser.add_argument('--overlap', type=int, default=256, help="Overlap between tiles in pixels, in tiled mode")
+    parser.add_argument('--backend', choices=['torch', 'onnx', 'openvino'], default='torch',
+                        help="Inference backend: 'onnx' or 'openvino' export the model once for CPU-only machines (default: torch)")
+    parser.add_argument('--threads-per-worker', type=int, default=None,
+                        help="Threads of each prediction process with the onnx and openvino backends (default: cores / workers)")
+    parser.add_argument('--reuse-duplicates', action='store_true',
+                        help="Predict the near-duplicate eval images (same perceptual hash) once, and copy the predictions to the others")
+    parser.add_argument('--duplicate-radius', type=int, default=4,
+                        help="Largest number of different bits between the perceptual hashes of near-duplicate images (default: 4)")
+    parser.add_argument('--method', choices=['greedy', 'hungarian'], default='greedy', help="Box matching method of the evaluation")
+    parser.add_argument('--export-csv', action='store_true',
+                        help="Also export the evaluation results as 'results_for_evaluation.csv' (';' separated)")
+    parser.add_argument('--use-model', default='yolo11n.pt', help="Model to start the training from")
+    parser.add_argument('--epochs', type=int, default=100, help="Number of training epochs")
+    parser.add_argument('--profile', action='store_true', help="Time the stages and their phases, and print a summary table")
+    parser.add_argument('--trace-file', default=None, help="With --profile, write the run as a Chrome trace (chrome://tracing, Perfetto) in this file")
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help="Level of the messages (default: INFO)")
+    parser.add_argument('--log-file', default=None, help="Also write the messages in this file")
+    args = parser.parse_args(argv)
+
+    unknown = [stage for stage in args.stages if stage not in STAGES and stage != 'all']
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(unknown)}")
+    return args
+
+
+def main(argv:list=None) -> int:
+    args = parse_args(argv)
+    configure_logging(args.log_level, args.log_file)
+    if args.profile or args.trace_file:
+        enable_instrumentation()
+
+    if 'all' in args.stages:
+        stages = list(STAGES)
+    else:
+        stages = [stage for stage in STAGES if stage in (args.stages or DEFAULT_STAGES)]
+
+    manifest_file = get_pipeline_manifest_file(args.project_folder)
+    manifest = load_pipeline_manifest(manifest_file)
+
+    for stage in stages:
+        run_stage(stage, args, manifest)
+        # Saved after each stage: a failure does not lose the stages already done
+        save_pipeline_manifest(manifest, manifest_file)
+
+    if args.profile or args.trace_file:
+        # Printed whatever the log level: the summary was asked for
+        print(format_summary())
+        if args.trace_file:
+            write_trace(args.trace_file, trace_format='chrome')
+            print(f"Trace written to {args.trace_file}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,14 @@
+"""
+Stage 3 – Model training.
+
+Runs the 'train' stage of the pipeline (see run_pipeline.py): skipped when its inputs are unchanged since the last run.
+All the options of run_pipeline.py are accepted, e.g. `python train_model.py --force`.
+"""
+
+import sys
+
+from run_pipeline import main
+
+
+if __name__ == '__main__':
+    sys.exit(main(['train'] + sys.argv[1:]))
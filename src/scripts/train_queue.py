@@ -0,0 +1,103 @@
+"""
+Stage 3 – Training queue.
+
+Trains grids of hyper-parameters unattended (e.g. overnight) from a persistent local job queue (see `training_queue`):
+the jobs are run as many at once as the CPU cores, the memory and the GPUs allow, a crashed job is resumed from its
+'weights/last.pt' checkpoint, and the queue keeps the registry of the runs (parameters, dataset split hash, metrics).
+The dataset must be prepared with notebook 3 first; the queue is 'output/runs/train/training_queue.sqlite'.
+
+Usage:
+    python train_queue.py submit --grid '{"use_model": ["yolo11n.pt", "yolo11s.pt"], "img_size": [640, 1024], "epochs": 100}'
+    python train_queue.py submit --grid grid.json --priority 1
+    python train_queue.py run                          # until the queue is empty
+    python train_queue.py run --max-jobs 2 --cores-per-job 8
+    python train_queue.py status
+    python train_queue.py registry --output runs.csv   # parameters and metrics of every run, to compare them
+    python train_queue.py requeue                      # failed jobs are queued again
+
+The default project folder comes from `config.py` (see `.env`).
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'modules'))
+
+import config
+from folders_path import get_training_queue_file
+from instrumentation import configure_logging
+from training_queue import (submit_training_jobs, requeue_training_jobs, list_training_jobs, write_run_registry,
+                            run_training_queue)
+
+
+def _load_grid(grid:str) -> dict:
+    # A JSON file or an inline JSON object
+    if Path(grid).is_file():
+        with open(grid, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return json.loads(grid)
+
+
+def parse_args(argv:list=None):
+    parser = argparse.ArgumentParser(description="Run the training sessions of a parameter grid from a local job queue.")
+    parser.add_argument('command', choices=['submit', 'run', 'status', 'registry', 'requeue'], help="Action on the queue")
+    parser.add_argument('--project-folder', default=config.PROJECT_DIR, help="Project folder (default: config.PROJECT_DIR)")
+    parser.add_argument('--grid', default=None, help="With submit: parameter grid, as a JSON file or an inline JSON object")
+    parser.add_argument('--priority', type=int, default=0, help="With submit: jobs with a higher priority start first")
+    parser.add_argument('--max-jobs', type=int, default=None, help="With run: maximum number of jobs at once (default: as the resources allow)")
+    parser.add_argument('--cores-per-job', type=int, default=4, help="With run: cores (data loader workers and threads) of each job")
+    parser.add_argument('--reserve-cores', type=int, default=1, help="With run: cores left to the rest of the system")
+    parser.add_argument('--reserve-memory-gb', type=float, default=2.0, help="With run: memory (GB) left to the rest of the system")
+    parser.add_argument('--max-attempts', type=int, default=3, help="With run: number of times a crashed job is started before it fails")
+    parser.add_argument('--poll-interval', type=float, default=30.0, help="With run: seconds between two checks of the jobs")
+    parser.add_argument('--devices', nargs='+', default=None, help="With run: devices of the jobs, e.g. 0 1 or cpu (default: detected)")
+    parser.add_argument('--no-wait', action='store_true', help="With run: only start the jobs that fit now, and wait for them")
+    parser.add_argument('--output', default=None, help="With registry: CSV file to write (default: next to the queue)")
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help="Level of the messages (default: INFO)")
+    parser.add_argument('--log-file', default=None, help="Also write the messages in this file")
+    args = parser.parse_args(argv)
+
+    if args.command == 'submit' and not args.grid:
+        parser.error("submit needs a --grid")
+    return args
+
+
+def main(argv:list=None) -> int:
+    args = parse_args(argv)
+    configure_logging(args.log_level, args.log_file)
+    queue_file = get_training_queue_file(args.project_folder)
+
+    if args.command == 'submit':
+        added = submit_training_jobs(queue_file, args.project_folder, _load_grid(args.grid), priority=args.priority)
+        for name in added:
+            print(name)
+
+    elif args.command == 'run':
+        stats = run_training_queue(queue_file, max_jobs=args.max_jobs, cores_per_job=args.cores_per_job,
+                                   reserve_cores=args.reserve_cores, reserve_memory_gb=args.reserve_memory_gb,
+                                   max_attempts=args.max_attempts, poll_interval=args.poll_interval,
+                                   devices=args.devices, wait=not args.no_wait)
+        return 1 if stats['failed'] else 0
+
+    elif args.command == 'status':
+        for job in list_training_jobs(queue_file):
+            metrics = job['metrics'] or {}
+            map50_95 = metrics.get('metrics/mAP50-95(B)')
+            print(f"{job['status']:<8} {job['name']:<60} attempts {job['attempts']}"
+                  + (f"  mAP@0.5:0.95 {map50_95:.4f}" if map50_95 is not None else '')
+                  + (f"  ({job['error']})" if job['error'] and job['status'] != 'done' else ''))
+
+    elif args.command == 'registry':
+        output = args.output or str(Path(queue_file).with_name('run_registry.csv'))
+        print(f"{write_run_registry(queue_file, output)} run(s) written to {output}")
+
+    elif args.command == 'requeue':
+        print(f"{requeue_training_jobs(queue_file)} job(s) queued again")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())